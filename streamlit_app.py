@@ -1,40 +1,95 @@
+from vou.batch import build_simulation
 from vou.person import Person, BehaviorWhenResumingUse
+from vou.progressive import BackgroundSimulation
+from vou.pyramid import TraceIndex
 from vou.simulation import Simulation
+from vou.store import ResultStore
 from vou.visualize import visualize
 from vou.opioid import mme_equivalents
 
+from inspect import signature
+from io import BytesIO
 from random import Random
 
+import matplotlib.pyplot as plt
 import streamlit as st
 
 
-# @st.cache
-def simulate(
-    rng: Random,
+# Day at which the app's use modes diverge. Every mode shares the simulation up to this
+# day, which is computed once and forked for each mode.
+BRANCH_DAY = 360
+
+# Simulations that aren't cached run in the background in chunks of this many days, and
+# the plot is redrawn at PROGRESS_DPI as they arrive
+PROGRESS_DAYS = 30
+PROGRESS_DPI = 100
+
+# Simulated persons are also kept in a result store on disk (see vou.store), shared by
+# every app process on the machine and by restarts, at the path in the VOU_RESULT_STORE
+# environment variable or a user cache directory by default
+RESULT_STORE = ResultStore()
+
+# Images stretch to the width of their column. Streamlit versions whose st.image() width
+# is a string (e.g. "content") take width="stretch"; older ones (such as the pinned
+# 1.39) only have use_column_width, which newer ones have removed.
+if isinstance(signature(st.image).parameters["width"].default, str):
+    STRETCH = {"width": "stretch"}
+else:
+    STRETCH = {"use_column_width": True}
+
+
+def model_args(
+    opioid: str = "Hydrocodone",
+    starting_dose: int = 50,
+    dose_increase: int = 25,
+    **params,
+):
+    """
+    The Person and Simulation keyword arguments for the app's parameters (the arguments
+    to simulate() other than seed), with doses converted to MME.
+    """
+    dose_multiplier = mme_equivalents[opioid]
+    return dict(
+        params,
+        starting_dose=starting_dose * dose_multiplier,
+        dose_increase=dose_increase * dose_multiplier,
+    )
+
+
+def result_key(seed: int, **params):
+    """
+    The key in RESULT_STORE of the person simulated by simulate() with the same
+    arguments.
+    """
+    return RESULT_STORE.key(model_args(**params), seed, result="person")
+
+
+@st.cache_data(max_entries=32)
+def simulate_prefix(
+    seed: int,
     starting_dose: int = 50,
     dose_increase: int = 25,
     base_threshold: float = 0.001,
     tolerance_window: int = 3_000,
     external_risk: float = 0.5,
     internal_risk: float = 0.5,
-    behavior_when_resuming_use: BehaviorWhenResumingUse = None,
     days: int = 730,
-    stop_use_day: int = None,
-    resume_use_day: int = None,
     dose_variability: float = 0.1,
     behavioral_variability: float = 0.1,
     availability: float = 0.9,
     fentanyl_prob: float = 0.0001,
     counterfeit_prob: float = 0.1,
     opioid: str = "Hydrocodone",
+    branch_day: int = BRANCH_DAY,
 ):
     """
     Streamlit cached function to instantiate a Person and Simulation and run the
-    simulation. Looks a bit repetitive, but this allows us to take advantage of
-    Streamlit caching and avoid running the simulation repeatedly when an app user
-    changes visualization parameters.
+    simulation up to branch_day, before any stop/resume schedule takes effect. Looks a
+    bit repetitive, but this allows us to take advantage of Streamlit caching. The
+    returned simulation is forked by simulate() for each use mode.
     """
     dose_multiplier = mme_equivalents[opioid]
+    rng = Random(seed)
 
     person = Person(
         rng=rng,
@@ -45,21 +100,148 @@ def simulate(
         external_risk=external_risk,
         internal_risk=internal_risk,
         behavioral_variability=behavioral_variability,
-        behavior_when_resuming_use=behavior_when_resuming_use,
     )
     simulation = Simulation(
         person=person,
         rng=rng,
         days=days,
-        stop_use_day=stop_use_day,
-        resume_use_day=resume_use_day,
         dose_variability=dose_variability,
         availability=availability,
         fentanyl_prob=fentanyl_prob,
         counterfeit_prob=counterfeit_prob,
     )
+    simulation.simulate(until_day=branch_day)
+    return simulation
+
+
+@st.cache_data(max_entries=32)
+def simulate(
+    seed: int,
+    behavior_when_resuming_use: BehaviorWhenResumingUse = None,
+    stop_use_day: int = None,
+    resume_use_day: int = None,
+    **params,
+):
+    """
+    Streamlit cached function to run a simulation, which allows us to avoid running the
+    simulation repeatedly when an app user changes visualization parameters. params are
+    the arguments to simulate_prefix() other than branch_day.
+
+    The simulation is forked from the shared prefix computed by simulate_prefix() (see
+    Simulation.fork()), so switching use modes only simulates the days after the
+    branch.
+
+    Results are cached by all of the model parameters plus the random seed. The cache
+    is shared by all sessions and evicts the least recently used simulations beyond
+    max_entries, so memory stays bounded however many users are exploring. Beyond it,
+    simulations are read from RESULT_STORE if any app process has run them before.
+    """
+    key = result_key(
+        seed,
+        behavior_when_resuming_use=behavior_when_resuming_use,
+        stop_use_day=stop_use_day,
+        resume_use_day=resume_use_day,
+        **params,
+    )
+    person = RESULT_STORE.get(key)
+    if person is not None:
+        return person
+    branch_day = BRANCH_DAY if stop_use_day is None else min(stop_use_day, BRANCH_DAY)
+    simulation = simulate_prefix(seed, branch_day=branch_day, **params).fork(
+        stop_use_day=stop_use_day,
+        resume_use_day=resume_use_day,
+        behavior_when_resuming_use=behavior_when_resuming_use,
+    )
     simulation.simulate()
-    return person
+    RESULT_STORE.put(key, simulation.person)
+    return simulation.person
+
+
+def simulate_in_background(seed: int, **params):
+    """
+    Starts simulating the person that simulate() returns for the same arguments in a
+    background thread (see vou.progressive), without the shared prefix, publishing
+    every PROGRESS_DAYS days. The completed person is put in RESULT_STORE, where
+    simulate() then finds it.
+    """
+    key = result_key(seed, **params)
+    return BackgroundSimulation(
+        build_simulation(model_args(**params), Random(seed)),
+        chunk_days=PROGRESS_DAYS,
+        on_complete=lambda simulation: RESULT_STORE.put(key, simulation.person),
+    )
+
+
+def render_progress(
+    person: Person,
+    opioid: str,
+    show_desperation: bool = False,
+    show_habit: bool = True,
+    show_effect: bool = True,
+):
+    """
+    Plots a simulation in progress over all days and renders the plot as PNG bytes at
+    PROGRESS_DPI.
+    """
+    fig = visualize(
+        person,
+        show_desperation=show_desperation,
+        show_habit=show_habit,
+        show_effect=show_effect,
+        opioid=opioid,
+        dpi=PROGRESS_DPI,
+        complete=False,
+    )
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", dpi=PROGRESS_DPI, bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+@st.cache_resource(max_entries=32)
+def trace_index(simulation_args: dict):
+    """
+    Streamlit cached function to build the TraceIndex of a simulation, which answers
+    each plot's downsampling of any window in time proportional to the plot's width.
+    Cached as a shared resource rather than copied per call, since it is only read.
+    """
+    return TraceIndex.from_person(simulate(**simulation_args))
+
+
+@st.cache_data(max_entries=128)
+def render(
+    simulation_args: dict,
+    start_day: int = 0,
+    duration: int = 730,
+    show_desperation: bool = False,
+    show_habit: bool = True,
+    show_effect: bool = True,
+    dpi: int = 300,
+):
+    """
+    Streamlit cached function to plot a simulation and render the plot as PNG bytes.
+    simulation_args are the arguments to simulate(), which identify the simulation to
+    plot (and are only simulated again if that simulation has been evicted from its
+    cache). The remaining arguments are visualization options.
+
+    Cached separately from simulate(), so that toggling visualization options only
+    re-plots a cached simulation, and returning to options seen before costs nothing.
+    """
+    fig = visualize(
+        simulate(**simulation_args),
+        index=trace_index(simulation_args),
+        start_day=start_day,
+        duration=duration,
+        show_desperation=show_desperation,
+        show_habit=show_habit,
+        show_effect=show_effect,
+        opioid=simulation_args["opioid"],
+        dpi=dpi,
+    )
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
 
 
 if __name__ == "__main__":
@@ -237,8 +419,8 @@ if __name__ == "__main__":
         behavior_when_resuming_use = BehaviorWhenResumingUse.LOWER_DOSE
         detail_viz_start = 530
 
-    sim = simulate(
-        rng=Random(seed),
+    simulation_args = dict(
+        seed=seed,
         starting_dose=starting_dose,
         dose_increase=dose_increase,
         external_risk=external_risk,
@@ -295,25 +477,48 @@ if __name__ == "__main__":
             )
 
     with col2:
-        fig = visualize(
-            sim,
+        # A simulation that isn't stored yet is run in the background and drawn as it
+        # progresses. A job for other inputs (changed while it ran) is cancelled.
+        key = result_key(**simulation_args)
+        job_key, job = st.session_state.get("simulation_job", (None, None))
+        if job is not None and job_key != key:
+            job.cancel()
+            job = None
+        if job is None and key not in RESULT_STORE:
+            job = simulate_in_background(**simulation_args)
+            st.session_state["simulation_job"] = (key, job)
+        main_plot = st.empty()
+        if job is not None and not job.complete:
+            for progress in job.updates():
+                if progress.complete:
+                    break
+                main_plot.image(
+                    render_progress(
+                        progress.person,
+                        opioid,
+                        show_desperation=show_desperation,
+                        show_habit=show_habit,
+                        show_effect=show_effect,
+                    ),
+                    **STRETCH,
+                )
+        fig = render(
+            simulation_args,
             show_desperation=show_desperation,
             show_habit=show_habit,
             show_effect=show_effect,
-            opioid=opioid,
         )
-        st.pyplot(fig, dpi=300)
+        main_plot.image(fig, **STRETCH)
         if show_zoomed_viz is True:
-            zoomed_fig = visualize(
-                sim,
+            zoomed_fig = render(
+                simulation_args,
                 start_day=zoomed_viz_start,
                 duration=zoomed_viz_duration,
                 show_desperation=show_desperation,
                 show_habit=show_habit,
                 show_effect=show_effect,
-                opioid=opioid,
             )
-            st.pyplot(zoomed_fig, dpi=300)
+            st.image(zoomed_fig, **STRETCH)
         st.markdown(
             "Copyright 2021 [RTI International](https://www.rti.org/). Virtual Opioid User is an open source project. The code base is on [GitHub](https://github.com/RTIInternational/virtual-opioid-user)."
         )
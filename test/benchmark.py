@@ -0,0 +1,288 @@
+"""
+Benchmarks the simulation, plotting, and batch throughput on fixed scenarios and seeds.
+
+    python test/benchmark.py --output results.json
+    python test/benchmark.py --baseline results.json
+
+Each scenario is timed in separate phases (setting up the Person and Simulation,
+simulating, building the figure, and rendering it as PNG), so that a regression in one
+doesn't hide in the noise of another. Times are the minimum and median over repeats.
+Peak memory is measured in a separate pass with tracemalloc, and the share of
+simulation time spent in each phase of a time step in another with
+Simulation(profile=True), since both slow down the timed code. The speedup of the
+"fast" and "event" engines over the "step" engine is measured on some scenarios, as the
+ratio of their minimum simulation times. Batch throughput is measured in simulations per
+second for each number of worker processes.
+
+Results are written as JSON. Given a baseline (the JSON output of an earlier run), each
+time, peak memory, and engine speedup is compared to the baseline and the script exits
+with status 1 if any has regressed by more than the tolerance (--memory-tolerance for
+peak memory, which varies much less between runs than time). It also exits with status
+1 if the speedup of the "fast" engine is below --min-speedup.
+"""
+from vou.person import BehaviorWhenResumingUse
+from vou.batch import build_simulation, run_batch, keep_summary
+from vou.visualize import visualize
+
+from argparse import ArgumentParser
+from io import BytesIO
+from random import Random
+from statistics import median
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+
+
+SEEDS = (1, 2, 3)
+
+# The app's four use modes
+USE_MODES = {
+    "keep_using": dict(),
+    "stop": dict(stop_use_day=360),
+    "resume_same_dose": dict(
+        stop_use_day=360,
+        resume_use_day=540,
+        behavior_when_resuming_use=BehaviorWhenResumingUse.SAME_DOSE,
+    ),
+    "resume_lower_dose": dict(
+        stop_use_day=360,
+        resume_use_day=540,
+        behavior_when_resuming_use=BehaviorWhenResumingUse.LOWER_DOSE,
+    ),
+}
+
+SCENARIOS = {
+    **USE_MODES,
+    "short_horizon": dict(days=90),
+    "long_horizon": dict(days=3650),
+    "low_dose": dict(starting_dose=10, dose_increase=10),
+    "high_dose": dict(starting_dose=400, dose_increase=50),
+    "high_fentanyl": dict(counterfeit_prob=0.5, fentanyl_prob=0.5),
+}
+
+# Scenarios on which the engines are compared, and the engines compared to "step"
+ENGINE_SCENARIOS = ("keep_using", "high_dose")
+ENGINES = ("fast", "event")
+
+
+def time_phases(params: dict, seed: int):
+    """
+    Runs a scenario once and returns the time taken by each phase.
+    """
+    times = {}
+    start = time.perf_counter()
+    simulation = build_simulation(params, Random(seed))
+    times["setup"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    simulation.simulate()
+    times["simulate"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fig = visualize(simulation.person, duration=simulation.days)
+    times["visualize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fig.savefig(BytesIO(), format="png", dpi=300, bbox_inches="tight")
+    times["render"] = time.perf_counter() - start
+    plt.close(fig)
+    return times
+
+
+def peak_memory(params: dict, seed: int):
+    """
+    Returns the peak memory allocated while setting up and simulating a scenario.
+    """
+    tracemalloc.start()
+    try:
+        build_simulation(params, Random(seed)).simulate()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def profile(params: dict, seed: int):
+    """
+    Returns the share of simulation time spent in each phase of a time step, measured
+    with Simulation(profile=True).
+    """
+    simulation = build_simulation(dict(params, profile=True), Random(seed))
+    simulation.simulate()
+    report = simulation.profiler.report()
+    return {phase: times["share"] for phase, times in report["phases"].items()}
+
+
+def benchmark_scenarios(repeat: int):
+    results = {}
+    for name, params in SCENARIOS.items():
+        runs = [time_phases(params, seed) for seed in SEEDS for _ in range(repeat)]
+        results[name] = {
+            phase: {
+                "min": min(run[phase] for run in runs),
+                "median": median(run[phase] for run in runs),
+            }
+            for phase in runs[0]
+        }
+        phases = ", ".join(f"{k} {v['min']:.4f}s" for k, v in results[name].items())
+        results[name]["peak_memory"] = max(peak_memory(params, seed) for seed in SEEDS)
+        results[name]["profile"] = profile(params, SEEDS[0])
+        print(f"{name}: {phases}, peak {results[name]['peak_memory'] / 1e6:.1f} MB")
+    return results
+
+
+def time_simulate(params: dict, seed: int):
+    simulation = build_simulation(params, Random(seed))
+    start = time.perf_counter()
+    simulation.simulate()
+    return time.perf_counter() - start
+
+
+def benchmark_engines(repeat: int):
+    results = {}
+    for name in ENGINE_SCENARIOS:
+        times = {
+            engine: min(
+                time_simulate(dict(SCENARIOS[name], engine=engine), seed)
+                for seed in SEEDS
+                for _ in range(repeat)
+            )
+            for engine in ("step",) + ENGINES
+        }
+        results[name] = {
+            "seconds": times,
+            "speedup": {engine: times["step"] / times[engine] for engine in ENGINES},
+        }
+        speedups = ", ".join(
+            f"{engine} {speedup:.1f}x"
+            for engine, speedup in results[name]["speedup"].items()
+        )
+        print(f"{name} speedup over step: {speedups}")
+    return results
+
+
+def benchmark_batch(tasks: int, workers: list):
+    results = {}
+    params = [dict(USE_MODES["keep_using"], record="summary")] * tasks
+    for n in workers:
+        start = time.perf_counter()
+        run_batch(params, seed=0, workers=n, collect=keep_summary)
+        elapsed = time.perf_counter() - start
+        results[str(n)] = {"seconds": elapsed, "runs_per_second": tasks / elapsed}
+        print(f"{n:>3} workers: {tasks / elapsed:.1f} runs/s")
+    return results
+
+
+def compare(
+    results: dict, baseline: dict, tolerance: float, memory_tolerance: float = 0.1
+):
+    """
+    Returns a description of every time or engine speedup that regressed by more than
+    the tolerance relative to the baseline, and of every peak memory that grew by more
+    than memory_tolerance.
+    """
+    regressions = []
+    for name, phases in results["scenarios"].items():
+        for phase, times in phases.items():
+            if phase == "peak_memory":
+                before = baseline["scenarios"].get(name, {}).get(phase)
+                if before and times > before * (1 + memory_tolerance):
+                    regressions.append(
+                        f"{name} peak memory: {times / 1e6:.1f} MB vs "
+                        f"{before / 1e6:.1f} MB"
+                    )
+                continue
+            if phase == "profile":
+                continue
+            try:
+                before = baseline["scenarios"][name][phase]["min"]
+            except KeyError:
+                continue
+            if times["min"] > before * (1 + tolerance):
+                regressions.append(
+                    f"{name} {phase}: {times['min']:.4f}s vs {before:.4f}s"
+                )
+    for name, engines in results["engines"].items():
+        for engine, speedup in engines["speedup"].items():
+            before = baseline.get("engines", {}).get(name, {}).get("speedup", {})
+            before = before.get(engine)
+            if before and speedup < before / (1 + tolerance):
+                regressions.append(
+                    f"{name} {engine} engine: {speedup:.1f}x vs {before:.1f}x"
+                )
+    for n, batch in results["batch"].items():
+        before = baseline.get("batch", {}).get(n)
+        if before and batch["runs_per_second"] < before["runs_per_second"] / (
+            1 + tolerance
+        ):
+            regressions.append(
+                f"batch {n} workers: {batch['runs_per_second']:.1f} runs/s vs "
+                f"{before['runs_per_second']:.1f} runs/s"
+            )
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--output", help="File to write results to as JSON")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--memory-tolerance", type=float, default=0.1)
+    parser.add_argument(
+        "--min-speedup",
+        type=float,
+        help='Least speedup of the "fast" engine over the "step" engine to accept',
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-tasks", type=int, default=64)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=sorted({1, 2, os.cpu_count()})
+    )
+    args = parser.parse_args()
+
+    results = {
+        "environment": {
+            "python": sys.version,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "scenarios": benchmark_scenarios(args.repeat),
+        "engines": benchmark_engines(args.repeat),
+        "batch": benchmark_batch(args.batch_tasks, args.workers),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(
+                results, json.load(f), args.tolerance, args.memory_tolerance
+            )
+        failures.extend(f"Regression: {regression}" for regression in regressions)
+    if args.min_speedup is not None:
+        for name, engines in results["engines"].items():
+            speedup = engines["speedup"]["fast"]
+            if speedup < args.min_speedup:
+                failures.append(
+                    f"{name} fast engine speedup {speedup:.1f}x is below "
+                    f"{args.min_speedup:.1f}x"
+                )
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+from vou.adaptive import estimate, replicate
+from vou.summary import BINARY_OUTCOMES, Moments
+
+import math
+
+import numpy as np
+import pytest
+
+
+# Settings under which about a third of the persons overdose fatally within 20 days
+RISKY = dict(
+    external_risk=0.9, internal_risk=0.9, starting_dose=700, days=20, fentanyl_prob=0.2
+)
+# Settings under which nobody overdoses within 5 days
+SAFE = dict(external_risk=0.1, internal_risk=0.1, days=5)
+
+
+def moments_of(values):
+    moments = Moments()
+    moments.update(np.asarray(values, dtype=float))
+    return moments
+
+
+def test_binary_estimate_is_agresti_coull():
+    values = [0.0] * 27 + [1.0] * 3
+    z = 1.96
+    adjusted = 30 + z * z
+    p = (3 + z * z / 2) / adjusted
+    binary = estimate(moments_of(values), 3, True, z)
+    assert binary.mean == pytest.approx(0.1)
+    assert binary.half_width == pytest.approx(z * math.sqrt(p * (1 - p) / adjusted))
+    other = estimate(moments_of(values), 3, False, z)
+    assert other.half_width == pytest.approx(z * np.std(values, ddof=1) / math.sqrt(30))
+    # Without any event, a proportion still isn't known precisely
+    assert estimate(moments_of([0.0] * 30), 0, True, z).half_width > 0.05
+    assert estimate(moments_of([0.0] * 30), 0, False, z).half_width == 0
+
+
+def test_replicate_stops_at_the_first_batch_meeting_its_targets():
+    targets = {"overdoses": 0.25, "fatal_overdose": 0.08}
+    result = replicate(RISKY, targets, seed=0, workers=1, batch=10)
+    n = result.replications
+    assert result.converged and n > 30 and (n - 30) % 10 == 0
+    for name, target in targets.items():
+        assert result.estimates[name].half_width <= target
+        assert result.estimates[name].replications == n
+    # The replications before the last batch are the same, and didn't meet a target
+    shorter = replicate(
+        RISKY, targets, seed=0, workers=1, batch=10, max_replications=n - 10
+    )
+    assert not shorter.converged and shorter.replications == n - 10
+    assert any(
+        shorter.estimates[name].half_width > target for name, target in targets.items()
+    )
+
+
+def test_replicate_doesnt_depend_on_workers():
+    targets = {"overdoses": 0.5}
+    results = [
+        replicate(RISKY, targets, seed=1, workers=workers, batch=10)
+        for workers in (1, 2)
+    ]
+    assert results[0] == results[1]
+
+
+def test_binary_outcomes_are_declared():
+    assert BINARY_OUTCOMES == {"fatal_overdose"}
+    # A count that is 0 in every replication isn't estimated as a proportion, so it
+    # meets its target at the first check...
+    counts = replicate(SAFE, {"dose_increases": 0.01}, seed=0, workers=1)
+    assert counts.converged and counts.replications == 50
+    assert counts.estimates["dose_increases"].half_width == 0
+    # ...but a proportion without any event is
+    events = replicate(
+        SAFE, {"fatal_overdose": 0.02}, seed=0, workers=1, max_replications=100
+    )
+    assert events.estimates["fatal_overdose"].mean == 0
+    assert not events.converged and events.replications == 100
+
+
+def test_replicate_stops_at_the_budget():
+    result = replicate(
+        RISKY, {"final_dose": 0.001}, seed=0, workers=1, max_replications=45, batch=10
+    )
+    assert not result.converged and result.replications == 45
+
+
+def test_unknown_targets_are_rejected():
+    with pytest.raises(ValueError):
+        replicate(RISKY, {"overdose": 0.1})
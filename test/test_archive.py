@@ -0,0 +1,87 @@
+from vou.archive import ArchiveWriter, TraceArchive, SERIES
+from vou.person import Person
+from vou.pyramid import TraceIndex
+from vou.simulation import Simulation
+
+from random import Random
+
+import numpy as np
+
+
+# Seed 5 ends with a fatal overdose on day 4 under these settings, so its run is shorter
+# than the others
+RISKY = dict(external_risk=0.9, internal_risk=0.9, starting_dose=700)
+SEEDS = (0, 5, 1)
+
+
+def simulate(seed: int):
+    rng = Random(seed)
+    person = Person(rng=rng, **RISKY)
+    simulation = Simulation(person, rng, days=100, fentanyl_prob=0.2)
+    simulation.simulate()
+    return simulation
+
+
+def assert_run_matches(archive: TraceArchive, run: int, simulation: Simulation):
+    person = simulation.person
+    record = archive.run(run)
+    n = len(person.concentration)
+    assert archive.lengths[run] == n
+    for name in SERIES:
+        # Padded with NaN after the run ended (desperation ends one earlier at a fatal
+        # overdose)
+        values = getattr(person, name).values
+        assert len(record[name]) == n
+        assert np.array_equal(record[name][: len(values)], values)
+        assert np.isnan(archive.series[name][run, len(values) :]).all()
+    assert record["overdoses"].tolist() == person.overdoses
+    assert record["doses"].tolist() == person.took_dose
+    assert record["params"] == {"seed": SEEDS[run]}
+
+
+def test_append_reopen_and_read(tmp_path):
+    path = str(tmp_path / "archive")
+    simulations = [simulate(seed) for seed in SEEDS]
+    assert len(simulations[1].person.concentration) < 100 * 100
+    with ArchiveWriter(path) as writer:
+        for seed, simulation in zip(SEEDS[:2], simulations):
+            writer.append(simulation, {"seed": seed})
+    # Appending to an existing archive
+    with ArchiveWriter(path) as writer:
+        writer.append(simulations[2], {"seed": SEEDS[2]})
+
+    archive = TraceArchive(path)
+    assert len(archive) == 3 and archive.length == 100 * 100
+    for run, simulation in enumerate(simulations):
+        assert_run_matches(archive, run, simulation)
+    window = archive.window("habit", 300, 500)
+    assert window.shape == (3, 200)
+    assert np.isnan(window[1, 101:]).all() and not np.isnan(window[0]).any()
+    index = TraceIndex.from_archive(archive, 1)
+    assert len(index["habit"]) == len(simulations[1].person.habit)
+
+
+def test_interrupted_writer_leaves_its_complete_runs(tmp_path):
+    path = str(tmp_path / "archive")
+    simulations = [simulate(seed) for seed in SEEDS]
+    writer = ArchiveWriter(path)
+    for seed, simulation in zip(SEEDS[:2], simulations):
+        writer.append(simulation, {"seed": seed})
+    # An append interrupted after writing part of a run, without close()
+    writer.files["concentration"].write(np.zeros(123).tobytes())
+    writer.files["doses"].write(np.arange(7).tobytes())
+    for file in writer.files.values():
+        file.flush()
+
+    archive = TraceArchive(path)
+    assert len(archive) == 2
+    for run, simulation in enumerate(simulations[:2]):
+        assert_run_matches(archive, run, simulation)
+
+    # Writing again drops the incomplete run
+    with ArchiveWriter(path) as writer:
+        writer.append(simulations[2], {"seed": SEEDS[2]})
+    archive = TraceArchive(path)
+    assert len(archive) == 3
+    for run, simulation in enumerate(simulations):
+        assert_run_matches(archive, run, simulation)
@@ -0,0 +1,59 @@
+from vou.batch import iter_batch, run_batch, run_task, task_seed
+from vou.store import ResultStore
+
+import numpy as np
+import pytest
+
+
+TASKS = [dict(days=60, external_risk=risk) for risk in (0.2, 0.5, 0.8)] * 2
+
+
+def doses(simulation):
+    # A small, picklable result that identifies a run
+    person = simulation.person
+    return person.took_dose, person.overdoses
+
+
+@pytest.mark.parametrize("streams", [False, True])
+def test_results_depend_only_on_seed_and_tasks(streams):
+    serial = run_batch(TASKS, seed=7, workers=1, collect=doses, streams=streams)
+    pooled = run_batch(
+        TASKS, seed=7, workers=2, chunksize=2, collect=doses, streams=streams
+    )
+    assert pooled == serial
+    # Tasks with the same parameters still get their own seeds
+    assert serial[0] != serial[3]
+    assert run_batch(TASKS, seed=8, workers=1, collect=doses) != serial
+
+
+def test_seed_sequence_and_integer_seeds_agree():
+    by_int = run_batch(TASKS, seed=7, workers=1, collect=doses)
+    by_sequence = run_batch(
+        TASKS, seed=np.random.SeedSequence(7), workers=1, collect=doses
+    )
+    assert by_sequence == by_int
+
+
+def test_resumed_batch_gets_the_same_seeds():
+    whole = run_batch(TASKS, seed=7, workers=1, collect=doses)
+    resumed = list(iter_batch(TASKS[2:], seed=7, workers=1, collect=doses, start=2))
+    assert resumed == whole[2:]
+
+
+def test_task_seed_matches_spawn():
+    root = np.random.SeedSequence(7)
+    children = np.random.SeedSequence(7).spawn(4)
+    for index, child in enumerate(children):
+        seed = task_seed(root, index)
+        assert np.array_equal(seed.generate_state(4), child.generate_state(4))
+
+
+def test_stored_results_match_simulated_ones(tmp_path):
+    store = ResultStore(str(tmp_path))
+    simulated = run_batch(TASKS, seed=7, workers=1, collect=doses, store=store)
+    assert len(store) == len(TASKS)
+    assert run_batch(TASKS, seed=7, workers=1, collect=doses, store=store) == simulated
+    # Results are stored under collect's name, which a lambda doesn't have
+    seed = task_seed(np.random.SeedSequence(7), 0)
+    with pytest.raises(ValueError):
+        run_task(TASKS[0], seed, lambda simulation: simulation, store=store)
@@ -0,0 +1,94 @@
+from vou import calibration
+from vou.calibration import Calibration, DoseBandODRates
+
+import math
+
+import numpy as np
+import pytest
+
+
+PRIORS = {"OD_X0": (800, 1600)}
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    # The number of runs simulated (in this process, with workers=1)
+    counted = []
+    run_evaluations = calibration.run_evaluations
+
+    def counting(chunk, *args):
+        counted.extend(chunk)
+        return run_evaluations(chunk, *args)
+
+    monkeypatch.setattr(calibration, "run_evaluations", counting)
+    return counted
+
+
+def calibrate(path, **settings):
+    settings = dict(dict(target=DoseBandODRates(days=10), replications=2), **settings)
+    return Calibration(str(path), PRIORS, **settings)
+
+
+def test_dose_band_target():
+    target = DoseBandODRates(days=10)
+    assert len(target.tasks()) == len(target.observed) == 15
+    assert target.doses[-1] == 650
+    assert target.distance(target.observed) == 0
+    assert target.distance(target.observed * math.e) == pytest.approx(1)
+
+
+def test_evaluations_are_memoized(tmp_path, runs):
+    candidates = calibrate(tmp_path).sample(3)
+    per_candidate = 15 * 2
+    evaluations = calibrate(tmp_path).evaluate(candidates + candidates[:1], workers=1)
+    assert len(runs) == 3 * per_candidate
+    assert evaluations[3] == evaluations[0]
+    # Reused by the same calibration, and when it is created again
+    runs.clear()
+    again = calibrate(tmp_path)
+    assert again.evaluate(candidates, workers=1) == evaluations[:3]
+    assert not runs
+    # A different seed, number of replications, or model misses the cache
+    for settings in ({"seed": 1}, {"replications": 3}):
+        runs.clear()
+        other = calibrate(tmp_path, **settings)
+        other.evaluate(candidates, workers=1)
+        replications = settings.get("replications", 2)
+        assert len(runs) == 3 * 15 * replications
+
+
+def test_model_version_is_part_of_the_key(tmp_path, runs, monkeypatch):
+    candidates = calibrate(tmp_path).sample(2)
+    calibrate(tmp_path).evaluate(candidates, workers=1)
+    runs.clear()
+    monkeypatch.setattr(calibration, "MODEL_VERSION", "changed")
+    calibrate(tmp_path).evaluate(candidates, workers=1)
+    assert len(runs) == 2 * 15 * 2
+
+
+def test_interrupted_evaluations_are_kept(tmp_path, runs):
+    first = calibrate(tmp_path)
+    evaluations = first.evaluate(first.sample(2), workers=1)
+    with open(first.cache_file, "a") as f:
+        f.write('{"key": "cut off')
+    runs.clear()
+    resumed = calibrate(tmp_path)
+    assert resumed.evaluate(resumed.sample(2), workers=1) == evaluations
+    assert not runs
+    with open(resumed.cache_file) as f:
+        assert len(f.read().splitlines()) == 2
+
+
+def test_abc_accepts_the_closest_candidates(tmp_path, runs):
+    study = calibrate(tmp_path)
+    accepted = study.abc(6, accept=0.4, workers=1)
+    evaluations = study.evaluate(study.sample(6), workers=1)
+    distances = sorted(evaluation.distance for evaluation in evaluations)
+    assert [evaluation.distance for evaluation in accepted] == distances[:3]
+    assert np.isfinite(distances).all()
+    low, high = PRIORS["OD_X0"]
+    assert all(low <= evaluation.constants.OD_X0 <= high for evaluation in accepted)
+    # Extending the calibration only evaluates the new candidates
+    runs.clear()
+    study.abc(8, workers=1)
+    assert len(runs) == 2 * 15 * 2
@@ -0,0 +1,77 @@
+from vou.cohort import CohortSimulation
+from vou.person import Person
+from vou.simulation import Simulation
+
+from random import Random
+import warnings
+
+import numpy as np
+
+
+# Settings under which about half of the persons overdose fatally within 100 days
+PERSON = dict(external_risk=0.9, internal_risk=0.9, starting_dose=700)
+SIMULATION = dict(days=100, counterfeit_prob=0.5, fentanyl_prob=0.5)
+SIZE = 200
+
+
+def scalar_outcomes():
+    overdoses, fatal, dose = [], [], []
+    for seed in range(SIZE):
+        rng = Random(seed)
+        person = Person(rng=rng, **PERSON)
+        simulation = Simulation(person, rng, **SIMULATION)
+        simulation.simulate()
+        overdoses.append(len(person.overdoses))
+        fatal.append(len(person.concentration) < simulation.days * 100)
+        dose.append(person.dose)
+    return np.array(overdoses), np.array(fatal), np.array(dose)
+
+
+def test_cohort_matches_scalar_model():
+    cohort = CohortSimulation(SIZE, np.random.default_rng(0), **PERSON, **SIMULATION)
+    cohort.simulate()
+    outcomes = (
+        np.array([len(overdoses) for overdoses in cohort.overdoses]),
+        cohort.fatal_overdose_time >= 0,
+        cohort.dose,
+    )
+    for vectorized, scalar in zip(outcomes, scalar_outcomes()):
+        standard_error = np.sqrt((vectorized.var() + scalar.var()) / SIZE)
+        assert abs(vectorized.mean() - scalar.mean()) < 4 * standard_error
+
+
+def test_dead_persons_are_not_updated():
+    cohort = CohortSimulation(
+        50,
+        np.random.default_rng(1),
+        trace_persons=range(50),
+        **PERSON,
+        **SIMULATION,
+    )
+    cohort.simulate()
+    dead = np.flatnonzero(cohort.fatal_overdose_time >= 0)
+    assert dead.size and cohort.concentration.shape == (50,)
+    for person in dead:
+        t = cohort.fatal_overdose_time[person]
+        assert cohort.trace_length[person] == t + 1
+        assert not cohort.active[person]
+        # State stays as it was at the fatal overdose, a dose taken at t
+        assert cohort.time_since_dose[person] == 0
+        assert cohort.concentration[person] == cohort.traces["concentration"][person, t]
+        assert cohort.habit[person] == cohort.traces["habit"][person, t]
+    alive = cohort.fatal_overdose_time < 0
+    assert (cohort.trace_length[alive] == SIMULATION["days"] * 100).all()
+
+
+def test_large_doses_do_not_overflow():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        cohort = CohortSimulation(
+            10,
+            np.random.default_rng(2),
+            days=40,
+            starting_dose=10_000,
+            external_risk=0.9,
+            internal_risk=0.9,
+        )
+        cohort.simulate()
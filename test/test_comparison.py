@@ -0,0 +1,50 @@
+from vou.comparison import compare, iter_pairs
+from vou.summary import OUTCOMES
+
+import numpy as np
+import pytest
+
+
+# Settings under which about a third of the persons overdose fatally within 20 days
+BASELINE = dict(
+    external_risk=0.9,
+    internal_risk=0.9,
+    starting_dose=700,
+    days=20,
+    fentanyl_prob=0.2,
+    availability=0.75,
+)
+ALTERNATIVE = dict(BASELINE, availability=0.9)
+# Outcomes that differ between the scenarios
+DIFFERING = ("days_survived", "doses_taken")
+
+
+@pytest.mark.parametrize("antithetic", [False, True])
+def test_identical_scenarios_do_not_differ(antithetic):
+    differences = compare(
+        BASELINE, BASELINE, 30, seed=0, antithetic=antithetic, workers=1
+    )
+    assert set(differences) == set(OUTCOMES)
+    for difference in differences.values():
+        assert difference.baseline == difference.alternative
+        assert difference.difference == 0 and difference.standard_error == 0
+        assert difference.replications == 30
+    # Doses taken vary between replications, and only the paired differences are 0
+    assert differences["doses_taken"].variance_reduction == np.inf
+
+
+def test_common_random_numbers_reduce_variance():
+    pairs = list(iter_pairs(BASELINE, ALTERNATIVE, 100, seed=0, workers=1))
+    # The same scenarios with independent random numbers: alternatives from another
+    # root seed
+    others = list(iter_pairs(BASELINE, ALTERNATIVE, 100, seed=1, workers=1))
+    differences = compare(BASELINE, ALTERNATIVE, 100, seed=0, workers=1)
+    for name in DIFFERING:
+        outcome = OUTCOMES[name]
+        common = [outcome(a) - outcome(b) for b, a in pairs]
+        independent = [outcome(a) - outcome(b) for (b, _), (_, a) in zip(pairs, others)]
+        assert 0 < np.var(common, ddof=1) < np.var(independent, ddof=1) / 5
+        difference = differences[name]
+        assert difference.difference == pytest.approx(np.mean(common))
+        assert difference.standard_error == pytest.approx(np.std(common, ddof=1) / 10)
+        assert difference.variance_reduction > 5
@@ -0,0 +1,55 @@
+from vou.constants import Constants
+from vou.person import Person
+from vou.simulation import Simulation
+
+from random import Random
+
+import numpy as np
+
+
+# Constants under which habit builds up much faster than with the defaults
+FAST_HABIT = Constants(K1=1.0, increase_threshold=0.9)
+
+
+def simulate(constants=None, days=200, seed=0):
+    rng = Random(seed)
+    person = Person(rng=rng)
+    simulation = Simulation(person, rng, days=days, constants=constants)
+    simulation.simulate()
+    return simulation
+
+
+def test_default_constants_match_no_constants():
+    default = simulate(Constants()).person
+    plain = simulate().person
+    assert default.took_dose == plain.took_dose
+    assert np.array_equal(default.habit.values, plain.habit.values)
+
+
+def test_constants_change_results():
+    changed = simulate(FAST_HABIT).person
+    plain = simulate().person
+    assert not np.array_equal(changed.habit.values, plain.habit.values)
+    assert changed.dose != plain.dose
+
+
+def test_iter_steps_uses_constants():
+    rng = Random(0)
+    person = Person(rng=rng)
+    simulation = Simulation(person, rng, days=200, constants=FAST_HABIT)
+    habit = np.array([step.habit for step in simulation.iter_steps()])
+    expected = simulate(FAST_HABIT).person
+    assert np.array_equal(habit, expected.habit.values)
+    assert person.dose == expected.dose
+    assert person.took_dose == expected.took_dose
+
+
+def test_iter_blocks_and_summary_use_constants():
+    expected = simulate(FAST_HABIT)
+    rng = Random(0)
+    simulation = Simulation(
+        Person(rng=rng), rng, days=200, constants=FAST_HABIT, record="summary"
+    )
+    simulation.simulate()
+    assert simulation.summary.final_dose == expected.person.dose
+    assert simulation.summary.doses_taken == len(expected.person.took_dose)
@@ -0,0 +1,143 @@
+from vou.person import BehaviorWhenResumingUse, Person
+from vou.rare import ForcedOverdoseStream
+from vou.simulation import Simulation
+from vou.streams import RandomStreams
+
+from random import Random
+
+import numpy as np
+import pytest
+
+
+# Settings under which persons take doses, increase them, and overdose within a year
+RISKY = dict(
+    person=dict(external_risk=0.9, internal_risk=0.9, starting_dose=150),
+    simulation=dict(days=365, counterfeit_prob=0.5, fentanyl_prob=0.2),
+)
+
+
+def simulate(engine: str, seed: int, separate: bool):
+    """
+    Simulates a risky person with the engine. With separate, the Person and the
+    Simulation get their own random.Random, as in most user code.
+    """
+    person_rng = Random(seed)
+    simulation_rng = Random(seed + 1_000) if separate else person_rng
+    person = Person(rng=person_rng, **RISKY["person"])
+    simulation = Simulation(
+        person, simulation_rng, engine=engine, **RISKY["simulation"]
+    )
+    simulation.simulate()
+    return person
+
+
+@pytest.mark.parametrize("separate", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_fast_engine_matches_step_engine(seed, separate):
+    fast = simulate("fast", seed, separate)
+    step = simulate("step", seed, separate)
+    assert fast.took_dose == step.took_dose
+    assert fast.overdoses == step.overdoses
+    assert fast.dose == step.dose
+    for name in ("concentration", "habit", "effect", "desperation"):
+        assert np.array_equal(getattr(fast, name).values, getattr(step, name).values)
+
+
+@pytest.mark.parametrize("separate", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_event_engine_matches_step_engine(seed, separate):
+    event = simulate("event", seed, separate)
+    step = simulate("step", seed, separate)
+    assert event.took_dose == step.took_dose
+    assert event.overdoses == step.overdoses
+    assert event.dose == step.dose
+    for name in ("concentration", "habit", "effect", "desperation"):
+        assert np.allclose(getattr(event, name).values, getattr(step, name).values)
+
+
+def assert_close_runs(a: Person, b: Person):
+    assert a.took_dose == b.took_dose
+    assert a.overdoses == b.overdoses
+    assert a.dose == b.dose
+    for name in ("concentration", "habit", "effect", "desperation"):
+        assert np.allclose(getattr(a, name).values, getattr(b, name).values)
+
+
+def run(engine: str, seed: int, person: dict, simulation: dict, days=None):
+    # Simulates up to each of days in turn (all at once by default)
+    rng = Random(seed)
+    person = Person(rng=rng, **person)
+    simulation = Simulation(person, rng, engine=engine, **simulation)
+    for day in days or [None]:
+        simulation.simulate(until_day=day)
+    return person
+
+
+@pytest.mark.parametrize("engine", ["fast", "event"])
+@pytest.mark.parametrize("window", [1, 50, 99])
+def test_engines_match_step_engine_with_short_tolerance_windows(engine, window):
+    # The event engine's days are blocks of up to 99 time points, longer than these
+    # windows
+    for seed in range(3):
+        params = dict(tolerance_window=window, external_risk=0.7)
+        assert_close_runs(
+            run(engine, seed, params, dict(days=200)),
+            run("step", seed, params, dict(days=200)),
+        )
+
+
+@pytest.mark.parametrize("engine", ["fast", "event"])
+@pytest.mark.parametrize("window", [50, 3_000])
+def test_engines_match_step_engine_across_pauses_and_chunks(engine, window):
+    person = dict(
+        tolerance_window=window,
+        external_risk=0.7,
+        behavior_when_resuming_use=BehaviorWhenResumingUse.LOWER_DOSE,
+    )
+    simulation = dict(days=300, stop_use_day=100, resume_use_day=150)
+    for seed in range(3):
+        step = run("step", seed, person, simulation)
+        assert_close_runs(run(engine, seed, person, simulation), step)
+        # Chunks that end inside and at the edges of the pause
+        days = [37, 100, 101, 149, 150, 233, 300]
+        assert_close_runs(run(engine, seed, person, simulation, days), step)
+
+
+def test_risky_settings_overdose():
+    # The comparisons above should cover overdoses
+    assert any(simulate("step", seed, True).overdoses for seed in range(5))
+
+
+@pytest.mark.parametrize("engine", ["fast", "event"])
+def test_profiling_does_not_change_results(engine):
+    # Profiling counts draws by wrapping the person's and the simulation's streams
+    plain = simulate(engine, 0, separate=True)
+    person = Person(rng=Random(0), **RISKY["person"])
+    simulation = Simulation(
+        person, Random(1_000), engine=engine, profile=True, **RISKY["simulation"]
+    )
+    simulation.simulate()
+    assert person.took_dose == plain.took_dose
+    assert person.overdoses == plain.overdoses
+
+
+@pytest.mark.parametrize("engine", ["fast", "event"])
+def test_person_overdose_stream_is_shared_by_engines(engine):
+    # Wrapping the person's overdose stream (as vou.rare does) acts on the same draws
+    # in every engine
+    runs = []
+    for name in (engine, "step"):
+        person_streams = RandomStreams(np.random.SeedSequence(0))
+        person_streams.overdose = ForcedOverdoseStream(person_streams.overdose, 3)
+        person = Person(rng=person_streams, **RISKY["person"])
+        simulation = Simulation(
+            person,
+            RandomStreams(np.random.SeedSequence(1)),
+            engine=name,
+            **RISKY["simulation"],
+        )
+        simulation.simulate()
+        runs.append(person)
+    assert runs[0].overdoses == runs[1].overdoses
+    assert runs[0].overdoses[0] == runs[0].took_dose[3]
+    assert runs[0].took_dose == runs[1].took_dose
@@ -0,0 +1,77 @@
+from vou.person import BehaviorWhenResumingUse, Person
+from vou.simulation import Simulation
+from vou.streams import RandomStreams
+
+from random import Random
+
+import numpy as np
+import pytest
+
+
+def build(seed: int, engine: str = "fast", streams: bool = False, **params):
+    rng = RandomStreams(np.random.SeedSequence(seed)) if streams else Random(seed)
+    person = Person(
+        rng=rng,
+        external_risk=0.6,
+        behavior_when_resuming_use=BehaviorWhenResumingUse.LOWER_DOSE,
+    )
+    return Simulation(person, rng, days=400, engine=engine, **params)
+
+
+def assert_same_run(a: Person, b: Person):
+    assert a.took_dose == b.took_dose
+    assert a.overdoses == b.overdoses
+    assert a.dose == b.dose
+    for name in ("concentration", "habit", "effect", "desperation"):
+        assert np.array_equal(getattr(a, name).values, getattr(b, name).values)
+
+
+@pytest.mark.parametrize("engine", ["fast", "step", "event"])
+@pytest.mark.parametrize("streams", [False, True])
+def test_snapshot_continues_like_the_original(engine, streams):
+    whole = build(0, engine, streams)
+    whole.simulate()
+    original = build(0, engine, streams)
+    original.simulate(until_day=150)
+    snapshot = original.snapshot()
+    snapshot.simulate()
+    original.simulate()
+    assert_same_run(snapshot.person, whole.person)
+    assert_same_run(original.person, whole.person)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_fork_matches_a_run_with_the_changes_from_the_start(seed):
+    shared = build(seed)
+    shared.simulate(until_day=150)
+    forks = {
+        stop: shared.fork(stop_use_day=stop, resume_use_day=stop + 60)
+        for stop in (200, 250)
+    }
+    for stop, fork in forks.items():
+        fork.simulate()
+        whole = build(seed, stop_use_day=stop, resume_use_day=stop + 60)
+        whole.simulate()
+        assert_same_run(fork.person, whole.person)
+    # The scenarios diverge after the earlier stop
+    assert forks[200].person.took_dose != forks[250].person.took_dose
+
+
+def test_fork_leaves_the_original_unchanged():
+    original = build(0)
+    original.simulate(until_day=150)
+    fork = original.fork(stop_use_day=160, external_risk=0.1)
+    fork.simulate()
+    assert original.t == 150 * 100
+    assert original.stop_use_time is None
+    assert original.person.external_risk == 0.6
+    assert len(original.person.concentration) == 150 * 100
+
+
+def test_fork_rejects_invalid_changes():
+    simulation = build(0)
+    simulation.simulate(until_day=150)
+    with pytest.raises(ValueError):
+        simulation.fork(starting_dose=100)
+    with pytest.raises(ValueError):
+        simulation.fork(days=100)
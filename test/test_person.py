@@ -0,0 +1,89 @@
+from vou.person import EFFECT_WINDOW, Person, downward_pressure
+
+from random import Random
+
+import numpy as np
+import pytest
+
+
+def windowed_mean(doses: list, effects: dict, last_increase: int):
+    # The mean effect of the last EFFECT_WINDOW doses, of those taken after the last
+    # dose increase, from every dose taken
+    recent = [effects[t] for t in doses[-EFFECT_WINDOW:] if t > last_increase]
+    return np.mean(recent) if recent else None
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_windowed_mean_matches_all_doses(seed):
+    rng = Random(seed)
+    person = Person(rng=Random(seed), starting_dose=100)
+    doses, effects = [], {}
+    increases = full = 0
+    t = 0
+    for _ in range(500):
+        t += rng.randint(1, 150)
+        effect = rng.uniform(0, person.dose)
+        doses.append(t)
+        effects[t] = effect
+        person.record_dose_effect(t, effect)
+        expected = windowed_mean(doses, effects, person.last_dose_increase)
+        assert len(person.dose_effects) == min(
+            EFFECT_WINDOW, sum(d > person.last_dose_increase for d in doses)
+        )
+        assert person.dose_effects_sum / len(person.dose_effects) == pytest.approx(
+            expected
+        )
+        # The decision to increase compares the mean to the dose, up to a dose of 2,000
+        # (with every draw passing downward pressure)
+        person.downward_pressure = -1
+        increase = person.will_increase_dose()
+        assert bool(increase) == (person.dose < 2_000 and expected < person.dose * 0.4)
+        # Increases at some doses, so that the window both fills and resets. Increasing
+        # at the time of a dose resets the window, which excludes that dose
+        if rng.random() < 0.04:
+            person.increase_dose(t)
+            increases += 1
+            assert not person.dose_effects and person.dose_effects_sum == 0
+            assert windowed_mean(doses, effects, person.last_dose_increase) is None
+            assert not person.will_increase_dose()
+        full += len(person.dose_effects) == EFFECT_WINDOW
+    assert increases > 5 and person.dose_increases == increases
+    assert full > 100
+
+
+def test_effects_at_the_last_increase_are_not_recorded():
+    person = Person(rng=Random(0))
+    person.record_dose_effect(100, 10.0)
+    person.increase_dose(200)
+    person.record_dose_effect(200, 20.0)
+    assert not person.dose_effects
+    person.record_dose_effect(201, 30.0)
+    assert list(person.dose_effects) == [30.0] and person.dose_effects_sum == 30.0
+
+
+def uncached_downward_pressure(person: Person, midpoint_min=100, midpoint_max=1_000):
+    # Person.update_downward_pressure() before downward pressure was cached
+    midpoint = person.internal_risk * (midpoint_max - midpoint_min) + midpoint_min
+    baseline_dp = 1 - person.external_risk
+    return baseline_dp + (
+        (1 - baseline_dp) / (1 + np.exp(-0.005 * (person.dose - midpoint)))
+    )
+
+
+def test_cached_downward_pressure_matches_formula():
+    rng = Random(0)
+    for _ in range(200):
+        person = Person(
+            rng=rng,
+            starting_dose=rng.choice([5, 50, 100, 700]),
+            dose_increase=rng.choice([10, 25, 50]),
+            external_risk=rng.random(),
+            internal_risk=rng.random(),
+        )
+        assert person.downward_pressure == uncached_downward_pressure(person)
+        for _ in range(rng.randint(1, 20)):
+            person.increase_dose(0)
+            assert person.downward_pressure == uncached_downward_pressure(person)
+        person.update_downward_pressure(50, 500)
+        assert person.downward_pressure == uncached_downward_pressure(person, 50, 500)
+    assert downward_pressure.cache_info().maxsize == 4_096
@@ -0,0 +1,91 @@
+from vou.person import Person
+from vou.simulation import Simulation
+from vou.streams import PURPOSES, RandomStreams
+
+from random import Random
+
+import pytest
+
+
+# Settings under which some runs end with a fatal overdose (seed 5 here), without
+# counterfeit pills, so every dose makes one dose and one counterfeit draw
+RISKY = dict(external_risk=0.9, internal_risk=0.9, starting_dose=700)
+SIMULATION = dict(days=10, counterfeit_prob=0.0)
+
+
+class Tally(Random):
+    # A random.Random that counts its draws (every method the model uses makes one)
+    def __init__(self, seed):
+        super().__init__(seed)
+        self.draws = 0
+
+    def random(self):
+        self.draws += 1
+        return super().random()
+
+
+def simulate(rng, engine: str, profile: bool):
+    person = Person(rng=rng, **RISKY)
+    simulation = Simulation(person, rng, engine=engine, profile=profile, **SIMULATION)
+    simulation.simulate()
+    return simulation
+
+
+@pytest.mark.parametrize("engine", ["step", "event"])
+@pytest.mark.parametrize("seed", [0, 5])
+def test_draws_per_purpose(seed, engine):
+    simulation = simulate(Random(seed), engine, profile=True)
+    person = simulation.person
+    report = simulation.profiler.report()
+    draws, counters = report["draws"], report["counters"]
+    doses, overdoses = len(person.took_dose), len(person.overdoses)
+    assert counters["time_points"] == len(person.concentration)
+    assert counters["doses"] == doses and counters["overdoses"] == overdoses
+    assert counters["rng_draws"] == sum(draws.values())
+    # A draw at the start of each day
+    assert draws["availability"] == -(-len(person.concentration) // 100)
+    assert draws["dose"] == draws["counterfeit"] == doses
+    # Whether each dose causes an overdose, and the pause and dose reduction after one
+    assert draws["overdose"] == doses + 2 * overdoses
+    assert draws["fatality"] == overdoses
+
+    # Every purpose counted separately in a run without the profiler
+    tallies = {purpose: Tally(seed + i) for i, purpose in enumerate(PURPOSES)}
+    unprofiled = simulate(RandomStreams.from_streams(tallies), engine, profile=False)
+    profiled = simulate(
+        RandomStreams.from_streams(
+            {purpose: Random(seed + i) for i, purpose in enumerate(PURPOSES)}
+        ),
+        engine,
+        profile=True,
+    )
+    assert unprofiled.person.overdoses == profiled.person.overdoses
+    draws = profiled.profiler.report()["draws"]
+    assert draws == {purpose: tally.draws for purpose, tally in tallies.items()}
+
+
+@pytest.mark.parametrize("seed", [0, 5])
+def test_calls_per_phase(seed):
+    simulation = simulate(Random(seed), "step", profile=True)
+    person = simulation.person
+    phases = simulation.profiler.report()["phases"]
+    calls = {phase: times["calls"] for phase, times in phases.items()}
+    n = len(person.concentration)
+    doses = len(person.took_dose)
+    fatal = int(n < SIMULATION["days"] * 100)
+    # A dose is always taken at the start of a day on which opioids are available
+    available = [t // 100 for t in person.took_dose if t % 100 == 0]
+    time_points_available = sum(min(100, n - day * 100) for day in available)
+    assert calls == {
+        "concentration": n,
+        "availability": n,
+        "will_take_dose": time_points_available,
+        "record_dose": doses,
+        "habit": n,
+        "effect": n,
+        "overdose": doses,
+        "will_increase_dose": doses - fatal,
+        "integrals": n - fatal,
+        "desperation": n - fatal,
+        "threshold": n - fatal,
+    }
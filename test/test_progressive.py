@@ -0,0 +1,48 @@
+from vou.person import Person
+from vou.progressive import BackgroundSimulation
+from vou.simulation import Simulation
+
+from random import Random
+import time
+
+import numpy as np
+
+
+def make_simulation(seed: int = 0, days: int = 200):
+    rng = Random(seed)
+    return Simulation(Person(rng=rng), rng, days=days)
+
+
+def test_chunks_match_a_single_run():
+    expected = make_simulation()
+    expected.simulate()
+    updates = list(BackgroundSimulation(make_simulation(), chunk_days=30).updates())
+    assert updates[-1].complete
+    assert not any(progress.complete for progress in updates[:-1])
+    days = [progress.day for progress in updates]
+    assert days == sorted(days)
+    person = updates[-1].person
+    assert person.took_dose == expected.person.took_dose
+    assert np.array_equal(person.habit.values, expected.person.habit.values)
+
+
+def test_on_complete_runs_before_completion_is_published():
+    stored = []
+
+    def store(simulation):
+        # A slow store
+        time.sleep(0.2)
+        stored.append(simulation)
+
+    job = BackgroundSimulation(make_simulation(), on_complete=store)
+    for progress in job.updates():
+        if progress.complete:
+            assert stored
+
+
+def test_cancel_stops_the_simulation():
+    job = BackgroundSimulation(make_simulation(days=730), chunk_days=1)
+    job.cancel()
+    job.thread.join()
+    assert not job.complete
+    assert job.simulation.t < 730 * 100
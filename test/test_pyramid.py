@@ -0,0 +1,107 @@
+from vou.pyramid import Pyramid, TraceIndex
+from vou.visualize import downsample
+
+import numpy as np
+import pytest
+
+
+def brute_force(values, envelope):
+    # Minimum, maximum, and mean of each bucket of the envelope, from the values
+    buckets = [values[a:b] for a, b in zip(envelope.start, envelope.stop)]
+    return (
+        np.array([bucket.min() for bucket in buckets]),
+        np.array([bucket.max() for bucket in buckets]),
+        np.array([bucket.mean() for bucket in buckets]),
+    )
+
+
+def assert_extremes_located(values, envelope):
+    # The minimum and maximum of each bucket are at the first time points they occur
+    for start, stop, low, high, _, low_at, high_at in zip(*envelope):
+        window = values[start:stop]
+        assert low_at == start + np.argmin(window) and values[low_at] == low
+        assert high_at == start + np.argmax(window) and values[high_at] == high
+
+
+@pytest.mark.parametrize("ties", [False, True])
+@pytest.mark.parametrize("length", [1, 2, 7, 1_000, 1_023, 4_097])
+def test_query_matches_brute_force(length, ties):
+    rng = np.random.default_rng(length)
+    if ties:
+        values = rng.integers(0, 4, size=length).astype(float)
+    else:
+        values = rng.normal(size=length)
+    pyramid = Pyramid(values)
+    for _ in range(50):
+        start, stop = sorted(rng.integers(0, length + 1, size=2))
+        buckets = int(rng.integers(1, 100))
+        envelope = pyramid.query(start, stop, buckets)
+        if stop == start:
+            assert len(envelope.start) == 0
+            continue
+        assert envelope.start[0] == start and envelope.stop[-1] == stop
+        assert np.array_equal(envelope.start[1:], envelope.stop[:-1])
+        assert len(envelope.start) <= buckets
+        low, high, mean = brute_force(values, envelope)
+        assert np.array_equal(envelope.low, low)
+        assert np.array_equal(envelope.high, high)
+        assert np.allclose(envelope.mean, mean)
+        assert_extremes_located(values, envelope)
+
+
+def test_points_are_extremes_in_time_order():
+    values = np.random.default_rng(2).normal(size=4_096)
+    values[1_234] = 100
+    times, points = Pyramid(values).query(0, len(values), 32).points()
+    assert (np.diff(times) >= 0).all()
+    assert np.array_equal(points, values[times])
+    assert 1_234 in times
+    # Buckets of a power of two time points are the same as downsample()'s
+    indices, downsampled = downsample(values, 32)
+    assert np.array_equal(times, indices) and np.array_equal(points, downsampled)
+
+
+def test_query_clips_to_the_series():
+    values = np.arange(10.0)
+    envelope = Pyramid(values).query(-5, 20, 100)
+    assert envelope.start.tolist() == list(range(10))
+    assert envelope.low.tolist() == values.tolist()
+
+
+def test_max_matches_brute_force():
+    values = np.random.default_rng(0).normal(size=5_000).astype(np.float32)
+    pyramid = Pyramid(values)
+    assert pyramid.max() == values.max()
+    assert pyramid.lows[0].dtype == np.float32
+    with pytest.raises(ValueError):
+        Pyramid(np.empty(0)).max()
+
+
+def test_trace_index_window():
+    rng = np.random.default_rng(1)
+    series = {name: rng.normal(size=3_000) for name in ("a", "b")}
+    index = TraceIndex(series)
+    envelopes = index.window(start_day=5, duration=10, buckets=40)
+    for name, envelope in envelopes.items():
+        assert envelope.start[0] == 500 and envelope.stop[-1] == 1_500
+        low, high, mean = brute_force(series[name], envelope)
+        assert np.array_equal(envelope.low, low)
+        assert np.array_equal(envelope.high, high)
+        assert np.allclose(envelope.mean, mean)
+
+
+def test_query_ignores_nan_padding():
+    # Trace archives pad runs that ended early (e.g. with a fatal overdose) with NaN
+    values = np.arange(4_096.0)
+    values[2_100:] = np.nan
+    pyramid = Pyramid(values)
+    for buckets in range(2, 40):
+        envelope = pyramid.query(0, len(values), buckets)
+        for start, stop, low, high, _, low_at, high_at in zip(*envelope):
+            window = values[start:stop]
+            assert start <= low_at < stop and start <= high_at < stop
+            if np.isnan(window).all():
+                assert np.isnan(low) and np.isnan(high)
+            else:
+                assert low == np.nanmin(window) and high == np.nanmax(window)
+                assert values[low_at] == low and values[high_at] == high
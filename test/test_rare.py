@@ -0,0 +1,24 @@
+from vou.batch import keep_summary, run_batch
+from vou.constants import Constants
+from vou.rare import any_overdose, estimate_overdose_probabilities
+
+import math
+
+
+# Overdoses are common enough at this risk curve for plain Monte Carlo to estimate
+# their probability, and much more common than at the default one
+PARAMS = dict(days=100, starting_dose=150, constants=Constants(OD_X0=1000.0))
+
+
+def test_estimate_uses_the_runs_constants():
+    estimate = estimate_overdose_probabilities(PARAMS, 50, seed=0)["any_overdose"]
+    runs = 200
+    summaries = run_batch(
+        [dict(PARAMS, record="summary")] * runs,
+        seed=1,
+        workers=1,
+        collect=keep_summary,
+    )
+    frequency = sum(map(any_overdose, summaries)) / runs
+    standard_error = math.sqrt(frequency * (1 - frequency) / runs)
+    assert abs(estimate.probability - frequency) < 4 * standard_error
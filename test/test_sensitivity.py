@@ -0,0 +1,89 @@
+from vou.sensitivity import SensitivityAnalysis, morris_design
+
+import math
+
+import numpy as np
+import pytest
+
+
+# Any Person or Simulation arguments, as the parameters of analytic functions
+NAMES = ("external_risk", "internal_risk", "availability")
+# Settings under which about a third of the persons overdose fatally within 5 days
+PARAMS = dict(starting_dose=700, days=5, fentanyl_prob=0.2)
+
+
+def analytic(path, method: str, samples: int, ranges: dict, function):
+    # An analysis whose results are a function of its design points, written as if
+    # they had been run
+    analysis = SensitivityAnalysis(
+        str(path), method, ranges, samples, seed=0, outcomes={"y": None}
+    )
+    low, high = np.array(list(ranges.values())).T
+    values = function(low + analysis.design * (high - low))
+    values.astype(np.float64).tofile(analysis.results_file)
+    return analysis.indices(resamples=100, seed=0)["y"]
+
+
+def ishigami(x, a=7, b=0.1):
+    return (
+        np.sin(x[:, 0]) + a * np.sin(x[:, 1]) ** 2 + b * x[:, 2] ** 4 * np.sin(x[:, 0])
+    )
+
+
+def test_sobol_indices_of_the_ishigami_function(tmp_path):
+    # The analytic indices of the Ishigami function with a = 7 and b = 0.1 (Saltelli et
+    # al., 2008)
+    first = (0.3139, 0.4424, 0.0)
+    total = (0.5576, 0.4424, 0.2437)
+    ranges = {name: (-math.pi, math.pi) for name in NAMES}
+    indices = analytic(tmp_path, "sobol", 20_000, ranges, ishigami)
+    for name, expected_first, expected_total in zip(NAMES, first, total):
+        index = indices[name]
+        assert index.first == pytest.approx(expected_first, abs=0.03)
+        assert index.total == pytest.approx(expected_total, abs=0.03)
+        assert index.first_low < index.first < index.first_high
+        assert index.total_low < index.total < index.total_high
+
+
+def test_morris_effects_of_a_linear_function(tmp_path):
+    # The elementary effects of an additive linear function are its coefficients (per
+    # parameter range), from every level and in either direction
+    coefficients = np.array([3.0, -1.0, 0.0])
+    ranges = dict(zip(NAMES, [(0, 1), (0, 2), (5, 10)]))
+    indices = analytic(tmp_path, "morris", 50, ranges, lambda x: x @ coefficients)
+    for name, coefficient, (low, high) in zip(NAMES, coefficients, ranges.values()):
+        index = indices[name]
+        assert index.mu == pytest.approx(coefficient * (high - low))
+        assert index.mu_star == pytest.approx(abs(index.mu))
+        assert index.sigma == pytest.approx(0, abs=1e-9)
+
+
+def test_morris_design_steps_both_ways():
+    design = morris_design(4, 200, np.random.default_rng(0))
+    assert design.min() == 0 and design.max() == 1
+    steps = np.diff(design.reshape(200, 5, 4), axis=1)
+    # Each step moves one parameter by delta, and each parameter once per trajectory
+    assert ((steps != 0).sum(axis=2) == 1).all()
+    assert ((steps != 0).sum(axis=1) == 1).all()
+    moves = steps[steps != 0]
+    assert np.allclose(np.abs(moves), 2 / 3)
+    assert 0.4 < (moves > 0).mean() < 0.6
+
+
+@pytest.mark.parametrize("method", ["sobol", "morris"])
+def test_interrupted_analysis_resumes(tmp_path, method):
+    ranges = {"external_risk": (0.05, 1.0), "fentanyl_prob": (0.0, 0.5)}
+    settings = dict(method=method, ranges=ranges, samples=8, params=PARAMS, seed=3)
+    uninterrupted = SensitivityAnalysis(str(tmp_path / "uninterrupted"), **settings)
+    assert uninterrupted.run(workers=1) == len(uninterrupted.design)
+
+    path = str(tmp_path / "interrupted")
+    interrupted = SensitivityAnalysis(path, **settings)
+    assert interrupted.run(workers=1, limit=13) == 13
+    # An interruption while a row was being written
+    with open(interrupted.results_file, "ab") as f:
+        f.write(b"\0" * 20)
+    resumed = SensitivityAnalysis(path)
+    assert resumed.completed == 13
+    assert resumed.run(workers=1) == len(resumed.design)
+    assert np.array_equal(resumed.results(), uninterrupted.results())
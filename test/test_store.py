@@ -0,0 +1,86 @@
+from vou.store import SUFFIX, ResultStore
+
+import os
+
+import numpy as np
+import pytest
+
+
+def test_round_trip(tmp_path):
+    store = ResultStore(str(tmp_path))
+    key = store.key({"days": 100}, 0)
+    assert key not in store
+    assert store.get(key) is None
+    value = {"doses": [1, 2, 3], "habit": np.arange(5.0)}
+    store.put(key, value)
+    assert key in store
+    stored = store.get(key)
+    assert stored["doses"] == value["doses"]
+    assert np.array_equal(stored["habit"], value["habit"])
+    assert len(store) == 1
+
+
+def test_key_includes_defaults_seed_and_context(tmp_path):
+    store = ResultStore(str(tmp_path))
+    key = store.key({"days": 100}, 0)
+    assert store.key({"days": 100, "engine": "fast"}, 0) == key
+    assert store.key({"days": 101}, 0) != key
+    assert store.key({"days": 100}, 1) != key
+    assert store.key({"days": 100}, 0, record="summary") != key
+    seed = np.random.SeedSequence(0)
+    assert store.key({}, seed) == store.key({}, np.random.SeedSequence(0))
+    with pytest.raises(TypeError):
+        store.key({"no_such_argument": 1}, 0)
+
+
+def test_corrupt_result_reads_as_missing(tmp_path):
+    store = ResultStore(str(tmp_path))
+    key = store.key({}, 0)
+    store.put(key, [1, 2, 3])
+    with open(store.file(key), "wb") as f:
+        f.write(b"not a result")
+    assert store.get(key, "missing") == "missing"
+
+
+def test_evicts_least_recently_used(tmp_path):
+    # Incompressible results of about 10 kB, in a store that fits about three
+    values = [np.random.default_rng(i).bytes(10_000) for i in range(5)]
+    store = ResultStore(str(tmp_path), max_bytes=35_000)
+    keys = [store.key({}, i) for i in range(5)]
+    for i, (key, value) in enumerate(zip(keys[:3], values)):
+        store.put(key, value)
+        os.utime(store.file(key), (i, i))
+    # Reading the oldest result makes it the most recently used
+    assert store.get(keys[0]) == values[0]
+    store.put(keys[3], values[3])
+    assert keys[1] not in store
+    assert all(key in store for key in (keys[0], keys[2], keys[3]))
+    assert store.size <= store.max_bytes
+
+    # Evicting goes down to 90% of max_bytes
+    store.put(keys[4], values[4])
+    assert store.size <= 0.9 * store.max_bytes
+    assert keys[2] not in store
+    assert keys[4] in store
+
+
+def test_removes_stale_temporary_files(tmp_path):
+    store = ResultStore(str(tmp_path))
+    key = store.key({}, 0)
+    store.put(key, 1)
+    shard = os.path.dirname(store.file(key))
+    stale = os.path.join(shard, "interrupted.tmp")
+    open(stale, "wb").close()
+    os.utime(stale, (0, 0))
+    assert [file for *_, file in store.entries()] == [store.file(key)]
+    assert not os.path.exists(stale)
+    assert store.file(key).endswith(SUFFIX)
+
+
+def test_unwritable_store_does_not_fail(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_bytes(b"")
+    store = ResultStore(str(blocker / "results"))
+    key = store.key({}, 0)
+    store.put(key, 1)
+    assert store.get(key) is None
@@ -0,0 +1,87 @@
+from vou.person import OverdoseType, Person
+from vou.simulation import Simulation
+
+from random import Random
+
+import numpy as np
+import pytest
+
+
+SERIES = ("concentration", "habit", "effect", "desperation")
+
+# Settings under which some runs end with a fatal overdose (seed 5 here)
+RISKY = dict(external_risk=0.9, internal_risk=0.9, starting_dose=700)
+SEEDS = (0, 1, 5)
+
+
+def build(seed: int, engine: str = "fast"):
+    rng = Random(seed)
+    person = Person(rng=rng, **RISKY)
+    return Simulation(person, rng, days=100, fentanyl_prob=0.2, engine=engine)
+
+
+def simulated(seed: int, engine: str = "fast"):
+    simulation = build(seed, engine)
+    simulation.simulate()
+    return simulation.person
+
+
+@pytest.mark.parametrize("engine", ["fast", "step", "event"])
+@pytest.mark.parametrize("keep_history", [True, False])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_blocks_match_simulate(seed, keep_history, engine):
+    person = simulated(seed, engine)
+    # Without history, a block's series are only valid until the next block
+    blocks = [
+        block._replace(**{name: getattr(block, name).copy() for name in SERIES})
+        for block in build(seed, engine).iter_blocks(300, keep_history=keep_history)
+    ]
+    assert [block.start for block in blocks] == list(range(0, 300 * len(blocks), 300))
+    for name in SERIES:
+        series = np.concatenate([getattr(block, name) for block in blocks])
+        assert np.array_equal(series, getattr(person, name).values)
+    assert [t for block in blocks for t in block.doses] == person.took_dose
+    assert [t for block in blocks for t in block.overdoses] == person.overdoses
+    fatal = len(person.concentration) < 100 * 100
+    assert [block.fatal for block in blocks] == [False] * (len(blocks) - 1) + [fatal]
+
+
+@pytest.mark.parametrize("engine", ["fast", "step", "event"])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_steps_match_simulate(seed, engine):
+    # iter_steps() goes through step() whatever the engine, which is what the "step"
+    # engine simulates
+    person = simulated(seed, "step")
+    steps = list(build(seed, engine).iter_steps())
+    assert [step.t for step in steps] == list(range(len(person.concentration)))
+    for name in SERIES:
+        series = [getattr(step, name) for step in steps]
+        if series[-1] is None:
+            # A fatal overdose, at which desperation isn't computed
+            series.pop()
+        assert np.array_equal(series, getattr(person, name).values)
+    assert [step.t for step in steps if step.dose_taken] == person.took_dose
+    overdoses = [step.t for step in steps if step.overdose is not None]
+    assert overdoses == person.overdoses
+    fatal = [step.t for step in steps if step.overdose is OverdoseType.FATAL]
+    assert fatal == (person.overdoses[-1:] if len(steps) < 100 * 100 else [])
+
+
+def test_runs_cover_fatal_overdoses():
+    # The comparisons above should include runs that end early
+    assert any(len(simulated(seed).concentration) < 100 * 100 for seed in SEEDS)
+
+
+def test_iterating_without_history_discards_it():
+    simulation = build(0)
+    person = simulation.person
+    for block in simulation.iter_blocks(500, keep_history=False):
+        assert len(person.concentration) <= 502
+        assert person.concentration.discarded == max(block.start - 2, 0)
+        assert len(person.took_dose) == len(block.doses)
+    simulation = build(0)
+    person = simulation.person
+    for step in simulation.iter_steps(keep_history=False):
+        assert len(person.concentration) <= 102
+        assert len(person.took_dose) <= 100
+    assert person.concentration.discarded > 0
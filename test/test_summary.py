@@ -0,0 +1,79 @@
+from vou.person import Person
+from vou.simulation import SUMMARY_BLOCK, Simulation
+from vou.summary import Moments
+
+from random import Random
+import tracemalloc
+
+import numpy as np
+import pytest
+
+
+# Settings under which some runs end with a fatal overdose
+RISKY = dict(external_risk=0.9, internal_risk=0.9, starting_dose=700)
+
+
+def simulate(seed: int, record: str, engine: str = "fast"):
+    rng = Random(seed)
+    person = Person(rng=rng, **RISKY)
+    simulation = Simulation(
+        person, rng, days=100, fentanyl_prob=0.2, engine=engine, record=record
+    )
+    simulation.simulate()
+    return simulation
+
+
+def test_moments_match_numpy():
+    values = np.random.default_rng(0).normal(5, 2, size=10_000)
+    moments = Moments()
+    for block in np.array_split(values, [1, 10, 10, 3_000, 7_777]):
+        moments.update(block)
+    assert moments.count == len(values)
+    assert moments.mean == pytest.approx(values.mean())
+    assert moments.variance == pytest.approx(values.var())
+    assert moments.max == values.max()
+
+
+@pytest.mark.parametrize("engine", ["fast", "step", "event"])
+@pytest.mark.parametrize("seed", range(6))
+def test_summary_matches_full_record(seed, engine):
+    full = simulate(seed, "traces", engine)
+    summary = simulate(seed, "summary", engine).summary
+    person = full.person
+    length = len(person.concentration)
+    fatal = length < full.days * 100
+    assert summary.days == (length + 99) // 100
+    assert summary.overdoses == tuple(person.overdoses)
+    assert summary.fatal_overdose == (person.overdoses[-1] if fatal else None)
+    assert summary.doses_taken == len(person.took_dose)
+    assert summary.total_amount_taken == pytest.approx(full.total_amount_taken)
+    assert summary.final_dose == person.dose
+    assert summary.peak_dose == person.peak_dose
+    assert summary.dose_increases == person.dose_increases
+    days_available = sum(1 for t in person.took_dose if t % 100 == 0)
+    assert summary.days_unavailable == summary.days - days_available
+    for name in ("concentration", "habit", "effect", "desperation"):
+        values = getattr(person, name).values
+        moments = getattr(summary, name)
+        assert moments.count == len(values)
+        assert moments.mean == pytest.approx(values.mean())
+        assert moments.variance == pytest.approx(values.var())
+        assert moments.max == values.max()
+
+
+def test_summaries_cover_fatal_overdoses():
+    # The comparisons above should include runs that end early
+    assert any(simulate(seed, "summary").summary.fatal_overdose for seed in range(6))
+
+
+def test_summary_mode_only_allocates_a_block():
+    simulation = simulate(0, "summary")
+    for trace in simulation.traces():
+        assert len(trace.buffer) <= SUMMARY_BLOCK + 3
+    peaks = {}
+    for record in ("traces", "summary"):
+        tracemalloc.start()
+        simulate(1, record)
+        peaks[record] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    assert peaks["summary"] < peaks["traces"] / 5
@@ -0,0 +1,20 @@
+from vou.surrogate import Surrogate
+
+
+def test_point_scales_ranges_to_the_unit_cube():
+    surrogate = Surrogate(ranges={"external_risk": (0.0, 1.0), "days": (100, 300)})
+    point = surrogate.point({"external_risk": 0.25, "days": 150})
+    assert point.tolist() == [[0.25, 0.25]]
+    assert surrogate.point({"external_risk": 1.5}) is None
+
+
+def test_point_accepts_fixed_parameters_at_their_defaults():
+    surrogate = Surrogate()
+    assert surrogate.point({"days": 730, "engine": "fast"}) is not None
+    assert surrogate.point({"days": 365}) is None
+
+
+def test_point_compares_fixed_parameters_with_params():
+    surrogate = Surrogate(params={"days": 365})
+    assert surrogate.point({"days": 365}) is not None
+    assert surrogate.point({"days": 730}) is None
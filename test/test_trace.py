@@ -0,0 +1,40 @@
+from vou.person import BehaviorWhenResumingUse, Person
+from vou.simulation import Simulation
+
+from random import Random
+
+import numpy as np
+import pytest
+
+
+def simulate(trace_dtype, seed: int):
+    # A pause with a lower dose on resuming, which reads the maximum of habit
+    rng = Random(seed)
+    person = Person(
+        rng=rng,
+        external_risk=0.9,
+        starting_dose=150,
+        behavior_when_resuming_use=BehaviorWhenResumingUse.LOWER_DOSE,
+    )
+    simulation = Simulation(
+        person,
+        rng,
+        days=300,
+        stop_use_day=150,
+        resume_use_day=200,
+        trace_dtype=trace_dtype,
+    )
+    simulation.simulate()
+    return person
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_float32_traces_match_float64(seed):
+    full = simulate(np.float64, seed)
+    half = simulate(np.float32, seed)
+    assert half.concentration.dtype == np.float32
+    assert half.habit.dtype == np.float64
+    assert half.took_dose == full.took_dose
+    assert half.overdoses == full.overdoses
+    assert half.dose == full.dose
+    assert np.array_equal(half.habit.values, full.habit.values)
@@ -0,0 +1,19 @@
+from vou.utils import exponential_decay, habit_parameters
+
+import math
+
+import pytest
+
+
+@pytest.mark.parametrize("k", [0.0594, 0.5])
+def test_exponential_decay_matches_math_exp(k):
+    decay = exponential_decay(k, 1_001)
+    assert decay.tolist() == [math.exp(-k * t) for t in range(1_001)]
+    assert exponential_decay(k, 1_001) is decay
+    with pytest.raises(ValueError):
+        decay[0] = 0
+
+
+def test_caches_are_bounded():
+    for function in (exponential_decay, habit_parameters):
+        assert function.cache_info().maxsize == 4_096
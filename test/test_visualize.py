@@ -0,0 +1,34 @@
+from vou.visualize import downsample
+
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("length", [1, 5, 9, 10])
+def test_short_series_are_unchanged(length):
+    # Up to two points per bucket are already as few as downsampling would keep
+    values = np.random.default_rng(length).normal(size=length)
+    indices, kept = downsample(values, 5)
+    assert indices.tolist() == list(range(length))
+    assert kept is values
+
+
+@pytest.mark.parametrize(
+    "length, buckets",
+    [(11, 5), (1_000, 5), (1_000, 64), (1_001, 64), (4_099, 64), (4_096, 64)],
+)
+def test_every_bucket_keeps_its_extremes_in_time_order(length, buckets):
+    values = np.random.default_rng(length).normal(size=length)
+    values[length // 3] = 100
+    values[length // 2] = -100
+    indices, kept = downsample(values, buckets)
+    assert np.array_equal(kept, values[indices])
+    assert (np.diff(indices) >= 0).all()
+    assert len(indices) <= 2 * buckets
+    width = -(-length // buckets)
+    for start in range(0, length, width):
+        bucket = values[start : start + width]
+        within = indices[(indices >= start) & (indices < start + width)]
+        expected = sorted([start + bucket.argmin(), start + bucket.argmax()])
+        assert within.tolist() == expected
+    assert length // 3 in indices and length // 2 in indices
@@ -0,0 +1,117 @@
+from vou.batch import iter_batch, keep_summary
+from vou.summary import BINARY_OUTCOMES, Moments, OUTCOMES
+
+from itertools import islice, repeat
+from typing import Collection, Mapping, NamedTuple
+import math
+
+import numpy as np
+
+
+class Estimate(NamedTuple):
+    """
+    The estimated mean of an outcome over replications of a configuration, with the
+    half-width of its confidence interval.
+    """
+
+    mean: float
+    standard_error: float
+    half_width: float
+    replications: int
+
+    def interval(self):
+        return self.mean - self.half_width, self.mean + self.half_width
+
+
+class Replication(NamedTuple):
+    """
+    The result of replicate(): the Estimate of each outcome by name, the number of
+    replications run, and whether every target was met within the budget.
+    """
+
+    estimates: dict
+    replications: int
+    converged: bool
+
+
+def estimate(moments: Moments, successes: float, binary: bool, z: float):
+    """
+    Estimates the mean of an outcome from the Moments of its values. The half-width is
+    z standard errors. For binary outcomes (e.g. whether a fatal overdose occurred),
+    it is the half-width of the Agresti-Coull interval instead, which doesn't collapse
+    to zero when no (or every) replication had the event, so that rare events aren't
+    declared precise after a handful of replications without one.
+    """
+    n = moments.count
+    standard_error = math.sqrt(moments.m2 / (n - 1) / n) if n > 1 else math.inf
+    if binary:
+        adjusted = n + z * z
+        p = (successes + z * z / 2) / adjusted
+        half_width = z * math.sqrt(p * (1 - p) / adjusted)
+    else:
+        half_width = z * standard_error
+    return Estimate(moments.mean, standard_error, half_width, n)
+
+
+def replicate(
+    params: Mapping,
+    targets: Mapping[str, float],
+    seed=None,
+    outcomes: Mapping = OUTCOMES,
+    binary: Collection[str] = BINARY_OUTCOMES,
+    z: float = 1.96,
+    min_replications: int = 30,
+    max_replications: int = 10_000,
+    batch: int = 50,
+    workers: int = None,
+    chunksize: int = 1,
+) -> Replication:
+    """
+    Runs replications of a configuration (a mapping of Person and Simulation keyword
+    arguments, as in vou.batch tasks) until the confidence interval of every outcome
+    in targets is narrower than its target half-width, or max_replications have run.
+
+        replicate(dict(availability=0.75), {"fatal_overdose": 0.005, "final_dose": 5})
+
+    Replications run in parallel with vou.batch.iter_batch() and record="summary".
+    The targets are checked after every batch replications (and not before
+    min_replications), so the number of replications, like the results, depends only
+    on the seed and not on the number of workers. Replications already in flight when
+    the targets are met are cancelled or discarded.
+
+    z sets the confidence level (1.96 for 95%). Outcomes are functions of a run's
+    Summary (see vou.summary.OUTCOMES); estimates are returned for every outcome, not
+    only the targeted ones. The outcomes named in binary are estimated as proportions
+    (see estimate()); whether an outcome is binary is declared rather than inferred
+    from its values, as a count that happened to be 0 or 1 in every replication so
+    far would otherwise be estimated as one.
+    """
+    unknown = set(targets) - set(outcomes)
+    if unknown:
+        raise ValueError(f"No outcome named {', '.join(sorted(unknown))}")
+    moments = {name: Moments() for name in outcomes}
+    successes = dict.fromkeys(outcomes, 0.0)
+    tasks = repeat(dict(params, record="summary"), max_replications)
+    summaries = iter_batch(tasks, seed, workers, chunksize, keep_summary)
+
+    n = 0
+    converged = False
+    try:
+        while n < max_replications:
+            size = max(batch, min_replications - n) if n < min_replications else batch
+            block = list(islice(summaries, size))
+            n += len(block)
+            for name, outcome in outcomes.items():
+                values = np.array([outcome(summary) for summary in block], dtype=float)
+                moments[name].update(values)
+                successes[name] += values.sum()
+            estimates = {
+                name: estimate(moments[name], successes[name], name in binary, z)
+                for name in outcomes
+            }
+            if all(estimates[name].half_width <= targets[name] for name in targets):
+                converged = True
+                break
+    finally:
+        summaries.close()
+    return Replication(estimates, n, converged)
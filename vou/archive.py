@@ -0,0 +1,236 @@
+from vou.simulation import Simulation
+
+from typing import Mapping
+import json
+import os
+import tempfile
+
+import numpy as np
+
+
+SERIES = ("concentration", "habit", "effect", "desperation")
+EVENTS = ("overdoses", "doses")
+
+
+def _json_default(value):
+    # Parameters may be NumPy scalars
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot store parameter {value!r} in a trace archive")
+
+
+class ArchiveWriter:
+    def __init__(self, path: str, length: int = None, dtype=np.float64):
+        """
+        Writes the traces of many simulation runs to a trace archive, a directory that
+        stores each measure of every run in one columnar file. See TraceArchive for the
+        layout. Runs are appended to the files as they are added, so the archive can be
+        written from a stream of simulations in constant memory.
+
+        length is the number of time points stored per run. Runs that end early (due to
+        a fatal overdose) are padded with NaN. It defaults to the length of the first
+        run added. If the archive already exists, runs are appended to it and length and
+        dtype are read from it.
+
+        The archive's index, which counts its complete runs, is replaced (through a
+        temporary file that is then renamed) after each run is added, so a writer that
+        is interrupted leaves an archive of the runs it completed. Whatever it wrote of
+        an incomplete run is dropped when the archive is opened for writing again.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.runs = 0
+        index = os.path.join(path, "index.json")
+        if os.path.exists(index):
+            with open(index) as f:
+                meta = json.load(f)
+            length = meta["length"]
+            dtype = meta["dtype"]
+            # Archives written before the index counted runs were only indexed once
+            # complete
+            self.runs = meta.get("runs", self._size("lengths") // 8)
+        self.length = length
+        self.dtype = np.dtype(dtype)
+        self._truncate()
+        self.files = {
+            name: open(self._file(name), "ab")
+            for name in SERIES
+            + EVENTS
+            + tuple(f"{event}_ends" for event in EVENTS)
+            + ("lengths", "params", "params_ends")
+        }
+        self.event_ends = {event: self._last_end(f"{event}_ends") for event in EVENTS}
+        self.params_end = self._last_end("params_ends")
+
+    def _file(self, name: str):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _size(self, name: str):
+        file = self._file(name)
+        return os.path.getsize(file) if os.path.exists(file) else 0
+
+    def _last_end(self, name: str):
+        # The end offset of the last complete run in an index of end offsets
+        if not self.runs:
+            return 0
+        with open(self._file(name), "rb") as f:
+            f.seek((self.runs - 1) * 8)
+            return int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+
+    def _truncate(self):
+        # Drops what an interrupted writer wrote beyond the last complete run
+        row = 0 if self.length is None else self.length * self.dtype.itemsize
+        sizes = {name: self.runs * row for name in SERIES}
+        for name in ("lengths", "params_ends") + tuple(f"{e}_ends" for e in EVENTS):
+            sizes[name] = self.runs * 8
+        for event in EVENTS:
+            sizes[event] = self._last_end(f"{event}_ends") * 8
+        sizes["params"] = self._last_end("params_ends")
+        for name, size in sizes.items():
+            if self._size(name) > size:
+                os.truncate(self._file(name), size)
+
+    def _write_index(self):
+        for file in self.files.values():
+            file.flush()
+        meta = {"length": self.length, "dtype": self.dtype.str, "runs": self.runs}
+        handle, temporary = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as f:
+                json.dump(meta, f)
+            os.replace(temporary, os.path.join(self.path, "index.json"))
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def append(self, simulation: Simulation, params: Mapping = None):
+        """
+        Adds a completed simulation run with traces, along with the parameters it was
+        run with (any JSON-serializable mapping, e.g. a vou.batch task).
+        """
+        person = simulation.person
+        n = len(person.concentration)
+        if self.length is None:
+            self.length = n
+        if n > self.length:
+            raise ValueError(
+                f"Run has {n} time points but the archive stores {self.length}"
+            )
+        for name in SERIES:
+            values = np.full(self.length, np.nan, dtype=self.dtype)
+            trace = getattr(person, name)
+            values[: len(trace)] = trace.values
+            self.files[name].write(values.tobytes())
+        events = (("overdoses", person.overdoses), ("doses", person.took_dose))
+        for event, times in events:
+            self.files[event].write(np.asarray(times, dtype=np.int64).tobytes())
+            self.event_ends[event] += len(times)
+            self.files[f"{event}_ends"].write(
+                np.int64(self.event_ends[event]).tobytes()
+            )
+        self.files["lengths"].write(np.int64(n).tobytes())
+        line = (json.dumps(dict(params or {}), default=_json_default) + "\n").encode()
+        self.files["params"].write(line)
+        self.params_end += len(line)
+        self.files["params_ends"].write(np.int64(self.params_end).tobytes())
+        self.runs += 1
+        self._write_index()
+
+    def close(self):
+        self._write_index()
+        for file in self.files.values():
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TraceArchive:
+    def __init__(self, path: str):
+        """
+        Reads a trace archive written by ArchiveWriter without loading it into memory.
+
+        Each measure (concentration, habit, effect, desperation) is stored in its own
+        file as a row per run and a column per time point. The files are memory-mapped,
+        so selecting a run or a window of time points across all runs is a view of the
+        file and only the pages that are actually read are loaded. Overdose and dose
+        times are stored as one array per event type, with the end offset of each run's
+        events in an index array. Run parameters are stored as JSON lines.
+
+        Only the runs counted in the archive's index are read, so an archive can be
+        read while it is being written, or after its writer was interrupted.
+        """
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            meta = json.load(f)
+        self.length = meta["length"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.runs = meta.get("runs")
+        self.lengths = self._map("lengths", np.int64, self.runs)
+        self.runs = len(self.lengths)
+        self.series = {
+            name: self._map(name, self.dtype, self.runs * self.length).reshape(
+                self.runs, self.length
+            )
+            for name in SERIES
+        }
+        self.event_ends = {
+            event: self._map(f"{event}_ends", np.int64, self.runs) for event in EVENTS
+        }
+        self.events = {
+            event: self._map(event, np.int64, self._last(self.event_ends[event]))
+            for event in EVENTS
+        }
+        self.params_ends = self._map("params_ends", np.int64, self.runs)
+
+    @staticmethod
+    def _last(ends: np.ndarray):
+        return int(ends[-1]) if len(ends) else 0
+
+    def _map(self, name: str, dtype, count: int = None):
+        # The first count values of a file (all of them by default)
+        file = os.path.join(self.path, f"{name}.bin")
+        if not os.path.getsize(file) or count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(file, dtype=dtype, mode="r")[:count]
+
+    def __len__(self):
+        return self.runs
+
+    def window(self, name: str, start: int, stop: int):
+        """
+        A (runs, stop - start) view of a measure over time points start to stop of
+        every run. Time points after a run ended are NaN.
+        """
+        return self.series[name][:, start:stop]
+
+    def event_times(self, event: str, run: int):
+        """
+        A view of the time points of a run's overdoses or doses.
+        """
+        ends = self.event_ends[event]
+        start = ends[run - 1] if run else 0
+        return self.events[event][start : ends[run]]
+
+    def params(self, run: int):
+        """
+        The parameters stored with a run.
+        """
+        start = self.params_ends[run - 1] if run else 0
+        with open(os.path.join(self.path, "params.bin"), "rb") as f:
+            f.seek(start)
+            return json.loads(f.read(self.params_ends[run] - start))
+
+    def run(self, run: int):
+        """
+        Every stored record of a run: views of its measures (trimmed to the time points
+        it was simulated for) and event times, and its parameters.
+        """
+        n = self.lengths[run]
+        record = {name: self.series[name][run, :n] for name in SERIES}
+        record.update({event: self.event_times(event, run) for event in EVENTS})
+        record["params"] = self.params(run)
+        return record
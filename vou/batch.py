@@ -0,0 +1,216 @@
+from vou.person import Person
+from vou.simulation import Simulation
+from vou.store import ResultStore
+from vou.streams import RandomStreams
+
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from inspect import signature
+from itertools import count, islice
+from random import Random
+from typing import Callable, Iterable, Iterator, Mapping
+import os
+
+import numpy as np
+
+
+PERSON_ARGS = frozenset(signature(Person).parameters) - {"rng"}
+SIMULATION_ARGS = frozenset(signature(Simulation).parameters) - {"person", "rng"}
+
+# Marks a result that isn't in the store, since None may be a result
+MISSING = object()
+
+
+def task_seed(root: np.random.SeedSequence, index: int):
+    """
+    Returns the seed sequence for the task at index. Equivalent to
+    root.spawn(index + 1)[index], but doesn't depend on how many children have already
+    been spawned, so each task's seed only depends on the root seed and its position.
+    """
+    return np.random.SeedSequence(
+        entropy=root.entropy, spawn_key=root.spawn_key + (index,)
+    )
+
+
+def task_rng(seed: np.random.SeedSequence):
+    """
+    Creates the random.Random instance shared by a task's Person and Simulation from
+    its seed sequence.
+    """
+    return Random(int.from_bytes(seed.generate_state(4).tobytes(), "little"))
+
+
+def task_streams(seed: np.random.SeedSequence):
+    """
+    Creates the RandomStreams shared by a task's Person and Simulation from its seed
+    sequence, with one independent substream per purpose.
+    """
+    return RandomStreams(seed)
+
+
+def build_simulation(params: Mapping, rng: Random):
+    """
+    Instantiates a Person and Simulation from a single mapping of keyword arguments.
+    Keys are routed to Person or Simulation by name.
+    """
+    unknown = set(params) - PERSON_ARGS - SIMULATION_ARGS
+    if unknown:
+        raise TypeError(f"Unknown Person/Simulation arguments: {sorted(unknown)}")
+    person = Person(rng=rng, **{k: v for k, v in params.items() if k in PERSON_ARGS})
+    return Simulation(
+        person=person,
+        rng=rng,
+        **{k: v for k, v in params.items() if k in SIMULATION_ARGS},
+    )
+
+
+def keep_simulation(simulation: Simulation):
+    """
+    Default result of a batch task: the simulation itself, including its person.
+    """
+    return simulation
+
+
+def keep_summary(simulation: Simulation):
+    """
+    Result of a batch task that only needs the simulation's outcomes: its Summary. Use
+    with record="summary" in the tasks, so that traces are never stored.
+    """
+    return simulation.summary
+
+
+def run_task(
+    params: Mapping,
+    seed: np.random.SeedSequence,
+    collect: Callable[[Simulation], object] = keep_simulation,
+    streams: bool = False,
+    store: ResultStore = None,
+):
+    """
+    Runs a single simulation and returns collect(simulation). With a store, the result
+    is read from the store if it has been computed before, and stored otherwise.
+    """
+    if store is not None:
+        name = f"{collect.__module__}.{collect.__qualname__}"
+        if "<" in name:
+            raise ValueError("collect must be a module-level function to use a store")
+        key = store.key(params, seed, collect=name, streams=streams)
+        result = store.get(key, MISSING)
+        if result is not MISSING:
+            return result
+    rng = task_streams(seed) if streams else task_rng(seed)
+    simulation = build_simulation(params, rng)
+    simulation.simulate()
+    result = collect(simulation)
+    if store is not None:
+        store.put(key, result)
+    return result
+
+
+def run_chunk(
+    chunk: list,
+    root: np.random.SeedSequence,
+    collect: Callable,
+    streams: bool,
+    store: ResultStore,
+):
+    """
+    Runs a chunk of (index, params) tasks in a worker process.
+    """
+    return [
+        run_task(params, task_seed(root, i), collect, streams, store)
+        for i, params in chunk
+    ]
+
+
+def iter_batch(
+    tasks: Iterable[Mapping],
+    seed=None,
+    workers: int = None,
+    chunksize: int = 1,
+    collect: Callable[[Simulation], object] = keep_simulation,
+    streams: bool = False,
+    start: int = 0,
+    store: ResultStore = None,
+) -> Iterator:
+    """
+    Runs one simulation per task and yields collect(simulation) for each, in the order
+    the tasks were given. Each task is a mapping of Person and Simulation keyword
+    arguments (other than person and rng).
+
+    Every task gets its own random number generator, seeded from a seed sequence
+    spawned from the root seed by the task's position. Results therefore depend only on
+    the root seed and the tasks, not on the number of workers or the chunk size. With
+    streams=True, the generator is a RandomStreams with a substream per purpose rather
+    than a single random.Random. start is the position of the first task, so that a
+    batch that was interrupted can be resumed with its remaining tasks and the same
+    seeds.
+
+    With a store (see vou.store.ResultStore), each task's result is read from the store
+    if the same task, seed, and collect have run before, and stored otherwise, so
+    repeated sweeps only simulate what's new. collect must then be a module-level
+    function, and its results picklable.
+
+    Tasks are sent to a pool of worker processes in chunks of chunksize. Only a few
+    chunks per worker are in flight at a time, so tasks may be a lazy iterator of any
+    length and results can be consumed as they arrive. With workers=1, tasks run in the
+    current process. collect must be picklable (e.g. a module-level function) when
+    using worker processes.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    indexed = zip(count(start), tasks)
+    yield from map_chunks(
+        run_chunk, indexed, workers, chunksize, seed, collect, streams, store
+    )
+
+
+def map_chunks(
+    function: Callable, items: Iterable, workers: int, chunksize: int, *args
+) -> Iterator:
+    """
+    Calls function(chunk, *args) on consecutive chunks of chunksize items and yields
+    the elements of the lists it returns, in order. Chunks are sent to a pool of
+    workers worker processes (all CPUs if None), with only a few chunks per worker in
+    flight at a time. With workers=1, chunks run in the current process.
+    """
+    workers = os.cpu_count() if workers is None else workers
+    items = iter(items)
+    chunks = iter(lambda: list(islice(items, chunksize)), [])
+
+    if workers == 1:
+        for chunk in chunks:
+            yield from function(chunk, *args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for chunk in chunks:
+                pending.append(executor.submit(function, chunk, *args))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # Don't run the remaining chunks if the consumer stops early
+            for future in pending:
+                future.cancel()
+
+
+def run_batch(
+    tasks: Iterable[Mapping],
+    seed=None,
+    workers: int = None,
+    chunksize: int = 1,
+    collect: Callable[[Simulation], object] = keep_simulation,
+    streams: bool = False,
+    store: ResultStore = None,
+) -> list:
+    """
+    Runs one simulation per task and returns the list of results in the order the
+    tasks were given. See iter_batch().
+    """
+    return list(
+        iter_batch(tasks, seed, workers, chunksize, collect, streams, store=store)
+    )
@@ -0,0 +1,265 @@
+from vou.batch import build_simulation, map_chunks, task_seed
+from vou.constants import Constants
+from vou.rare import ForcedOverdoseStream, overdose_risks
+from vou.store import MODEL_VERSION
+from vou.streams import RandomStreams
+
+from typing import Mapping, NamedTuple
+import csv
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+
+DASGUPTA_RATES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "inputs",
+    "dasgupta2016_OD_rates.csv",
+)
+
+
+class Evaluation(NamedTuple):
+    """
+    The simulated target statistics of a set of constants and their distance to the
+    observed statistics.
+    """
+
+    constants: Constants
+    statistics: tuple
+    distance: float
+
+
+class DoseBandODRates:
+    def __init__(
+        self, path: str = DASGUPTA_RATES, days: int = 365, fatal_share: float = 1 / 8.5
+    ):
+        """
+        A calibration target: the overdose rate per person-day of persons using doses in
+        each dose band of Dasgupta et al (2016).
+
+        The observed rates are fatal overdoses per 10,000 person-years, converted to
+        overdoses per day with the share of overdoses that are fatal, as in
+        notebooks/od_risk_curve.ipynb. Each band is simulated at its midpoint dose (650
+        MME for the highest band, per the paper) without dose increases, and the
+        simulated rate of a run is its expected number of overdoses per day: the sum of
+        the overdose risk of every dose it took, with overdoses suppressed (see
+        vou.rare), which is much less noisy than counting overdoses.
+        """
+        with open(path) as f:
+            rows = list(csv.DictReader(f))
+        self.days = days
+        self.doses = []
+        observed = []
+        for row in rows:
+            lower, upper = float(row["dose_lower"]), float(row["dose_upper"])
+            dose = 650 if upper >= 5000 else math.ceil((lower + upper) / 2)
+            self.doses.append(dose)
+            per_day = float(row["rate_per_10k_py"]) / 10_000 / 365.25
+            observed.append(per_day / fatal_share)
+        self.observed = np.array(observed)
+        self.key = {"target": "dose_band_od_rates", "days": days, "rows": rows}
+
+    def tasks(self):
+        """
+        The Person and Simulation keyword arguments of each run of a replication.
+        """
+        return [
+            dict(starting_dose=dose, dose_increase=0, days=self.days)
+            for dose in self.doses
+        ]
+
+    @staticmethod
+    def measure(simulation):
+        """
+        The statistic of a completed run (simulated with its overdoses suppressed).
+        """
+        constants = simulation.constants or Constants()
+        risks = overdose_risks(simulation.person, x0=constants.OD_X0, k=constants.OD_K)
+        return float(risks.sum()) / simulation.days
+
+    def distance(self, statistics: np.ndarray):
+        """
+        The root mean square log ratio of simulated to observed rates.
+        """
+        ratio = np.log(np.maximum(statistics, 1e-12) / self.observed)
+        return float(np.sqrt(np.mean(ratio**2)))
+
+
+def run_evaluations(
+    chunk: list, root: np.random.SeedSequence, target, tasks: list, candidates: list
+):
+    """
+    Runs a chunk of (candidate, task, replication) runs in a worker process and returns
+    the target's statistic of each. Replications are seeded by task and replication
+    only, so every candidate is evaluated with common random numbers.
+    """
+    results = []
+    for candidate, task, replication in chunk:
+        streams = RandomStreams(task_seed(task_seed(root, task), replication))
+        streams.overdose = ForcedOverdoseStream(streams.overdose)
+        params = dict(tasks[task], constants=candidates[candidate])
+        simulation = build_simulation(params, streams)
+        simulation.simulate()
+        results.append(target.measure(simulation))
+    return results
+
+
+class Calibration:
+    def __init__(
+        self,
+        path: str,
+        priors: Mapping[str, tuple],
+        target=None,
+        replications: int = 8,
+        seed: int = 0,
+        constants: Constants = Constants(),
+    ):
+        """
+        Calibrates the model's constants (see vou.constants.Constants) to a target:
+        an object with the observed statistics, the runs of a replication (tasks()),
+        the statistic of a run (measure()), and a distance between simulated and
+        observed statistics (distance()). The target defaults to DoseBandODRates.
+
+        priors maps the names of the constants to calibrate to (low, high) bounds of a
+        uniform prior. Other constants are kept at their values in constants. Each
+        candidate is evaluated with replications replications of the target's runs.
+
+        Evaluations run in parallel and are memoized on disk in the directory path, by
+        the candidate constants, the target, replications, seed, and the version of the
+        model (see vou.store.MODEL_VERSION). Repeating or resuming an interrupted
+        calibration only runs the evaluations it doesn't have.
+
+            calibration = Calibration("od-calibration", {"OD_X0": (800, 1600)})
+            best = calibration.abc(samples=200)[0]
+        """
+        unknown = set(priors) - set(Constants._fields)
+        if unknown:
+            raise ValueError(f"Unknown constants: {', '.join(sorted(unknown))}")
+        self.path = path
+        self.priors = dict(priors)
+        self.target = DoseBandODRates() if target is None else target
+        self.replications = replications
+        self.seed = seed
+        self.constants = constants
+        os.makedirs(path, exist_ok=True)
+        self.cache_file = os.path.join(path, "evaluations.jsonl")
+        self.cache = {}
+        if os.path.exists(self.cache_file):
+            with open(self.cache_file) as f:
+                lines = f.read().split("\n")
+            for line in lines[:-1]:
+                record = json.loads(line)
+                self.cache[record["key"]] = record
+            if lines[-1]:
+                # Drop a line cut off by an interruption
+                with open(self.cache_file, "w") as f:
+                    f.writelines(line + "\n" for line in lines[:-1])
+
+    def key(self, constants: Constants):
+        settings = {
+            "constants": constants._asdict(),
+            "target": self.target.key,
+            "replications": self.replications,
+            "seed": self.seed,
+            "version": MODEL_VERSION,
+        }
+        encoded = json.dumps(settings, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def evaluate(self, candidates: list, workers: int = None, chunksize: int = 1):
+        """
+        Evaluates each candidate set of constants and returns their Evaluations in
+        order. Runs of candidates that aren't memoized run in parallel with
+        vou.batch.map_chunks(), and each candidate is saved as soon as its runs are
+        done.
+        """
+        keys = [self.key(candidate) for candidate in candidates]
+        # Candidates that aren't memoized, without duplicates
+        missing = {}
+        for key, candidate in zip(keys, candidates):
+            if key not in self.cache:
+                missing[key] = candidate
+        missing = list(missing.items())
+        tasks = self.target.tasks()
+        runs = [
+            (candidate, task, replication)
+            for candidate in range(len(missing))
+            for task in range(len(tasks))
+            for replication in range(self.replications)
+        ]
+        results = map_chunks(
+            run_evaluations,
+            runs,
+            workers,
+            chunksize,
+            np.random.SeedSequence(self.seed),
+            self.target,
+            tasks,
+            [constants for _, constants in missing],
+        )
+        per_candidate = len(tasks) * self.replications
+        with open(self.cache_file, "a") as f:
+            values = []
+            done = 0
+            for value in results:
+                values.append(value)
+                if len(values) < per_candidate:
+                    continue
+                key, constants = missing[done]
+                statistics = np.reshape(values, (len(tasks), self.replications)).mean(1)
+                record = {
+                    "key": key,
+                    "constants": constants._asdict(),
+                    "statistics": statistics.tolist(),
+                    "distance": self.target.distance(statistics),
+                }
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                self.cache[key] = record
+                values = []
+                done += 1
+        return [
+            Evaluation(
+                Constants(**self.cache[key]["constants"]),
+                tuple(self.cache[key]["statistics"]),
+                self.cache[key]["distance"],
+            )
+            for key in keys
+        ]
+
+    def sample(self, samples: int):
+        """
+        Draws candidate constants from the priors. The draws only depend on the seed,
+        and the first draws don't depend on samples, so a repeated or extended
+        calibration evaluates the same (memoized) candidates first.
+        """
+        rng = np.random.default_rng(np.random.SeedSequence(self.seed))
+        draws = rng.random((samples, len(self.priors)))
+        candidates = []
+        for draw in draws:
+            values = {
+                name: float(low + x * (high - low))
+                for (name, (low, high)), x in zip(self.priors.items(), draw)
+            }
+            candidates.append(self.constants._replace(**values))
+        return candidates
+
+    def abc(
+        self,
+        samples: int,
+        accept: float = 0.1,
+        workers: int = None,
+        chunksize: int = 1,
+    ):
+        """
+        Rejection approximate Bayesian computation: evaluates samples candidates drawn
+        from the priors and returns the accepted share with the smallest distances,
+        ordered by distance. They approximate the posterior of the constants, and the
+        first is the best fit.
+        """
+        evaluations = self.evaluate(self.sample(samples), workers, chunksize)
+        evaluations.sort(key=lambda evaluation: evaluation.distance)
+        return evaluations[: max(1, math.ceil(accept * samples))]
@@ -0,0 +1,551 @@
+from vou.person import BehaviorWhenResumingUse
+from vou.utils import logistic
+
+from typing import Sequence
+
+import numpy as np
+
+
+# Every per-person array of a CohortSimulation. While simulating, they only hold the rows
+# of the persons who are still alive (see CohortSimulation.compact()).
+PER_PERSON = (
+    "dose",
+    "dose_increase",
+    "threshold",
+    "tolerance_window",
+    "external_risk",
+    "internal_risk",
+    "behavioral_variability",
+    "dose_variability",
+    "availability",
+    "fentanyl_prob",
+    "counterfeit_prob",
+    "active",
+    "downward_pressure",
+    "risk_logit",
+    "threshold_multiplier",
+    "post_OD_use_pause",
+    "last_overdose",
+    "last_dose_increase",
+    "habit",
+    "max_habit",
+    "effect",
+    "desperation",
+    "previous_desperation",
+    "tolerance_input",
+    "tolerance_input_sum",
+    "recent_effects",
+    "recent_effects_count",
+    "concentration",
+    "time_since_dose",
+    "last_amount_taken",
+    "conc_when_dose_taken",
+    "opioid_available",
+    "integralA",
+    "integralB",
+    "integralC",
+    "integralD",
+    "doses_taken",
+    "dose_increases",
+    "fatal_overdose_time",
+)
+
+
+class CohortSimulation:
+    def __init__(
+        self,
+        size: int,
+        rng: np.random.Generator,
+        days: int = 730,
+        starting_dose=50,
+        dose_increase=25,
+        base_threshold=0.001,
+        tolerance_window=3_000,
+        external_risk=0.5,
+        internal_risk=0.5,
+        behavioral_variability=0.1,
+        behavior_when_resuming_use: BehaviorWhenResumingUse = None,
+        stop_use_day: int = None,
+        resume_use_day: int = None,
+        dose_variability=0.1,
+        availability=0.9,
+        fentanyl_prob=0.0001,
+        counterfeit_prob=0.1,
+        trace_persons: Sequence[int] = (),
+    ):
+        """
+        Simulates the opioid use behavior of a cohort of persons in lockstep. Each
+        person follows the same model as a Person run through Simulation.simulate(), but
+        every per-person state variable is stored as a NumPy array and each time step is
+        computed with masked array operations across the whole cohort.
+
+        Person and simulation parameters accept either a scalar shared by the whole
+        cohort or an array with one value per person. The stop/resume schedule is shared
+        by the whole cohort.
+
+        Random draws come from a NumPy Generator and are made for the whole cohort at
+        once, so a cohort member does not reproduce the exact trajectory of a scalar
+        Simulation with the same seed, but its statistical behavior is the same.
+
+        Full traces are only recorded for the persons listed in trace_persons, since
+        storing every series for every person is rarely affordable at cohort scale.
+        """
+        self.size = size
+        self.rng = rng
+        self.days = days
+        self.stop_use_time = None if stop_use_day is None else stop_use_day * 100
+        self.resume_use_time = None if resume_use_day is None else resume_use_day * 100
+        self.behavior_when_resuming_use = behavior_when_resuming_use
+
+        def per_person(value, dtype=float):
+            return np.array(np.broadcast_to(value, size), dtype=dtype)
+
+        # Person parameters
+        self.dose = per_person(starting_dose)
+        self.dose_increase = per_person(dose_increase)
+        self.threshold = per_person(base_threshold)
+        self.tolerance_window = per_person(tolerance_window, dtype=int)
+        self.external_risk = per_person(external_risk)
+        self.internal_risk = per_person(internal_risk)
+        self.behavioral_variability = per_person(behavioral_variability)
+
+        # Simulation parameters
+        self.dose_variability = per_person(dose_variability)
+        self.availability = per_person(availability)
+        self.fentanyl_prob = per_person(fentanyl_prob)
+        self.counterfeit_prob = per_person(counterfeit_prob)
+
+        # Person state
+        self.active = np.ones(size, dtype=bool)
+        self.downward_pressure = np.empty(size)
+        self.update_downward_pressure(self.active)
+        self.set_risk_logit()
+        self.post_OD_use_pause = np.zeros(size)
+        self.last_overdose = np.full(size, -1)
+        self.last_dose_increase = np.zeros(size, dtype=int)
+        self.habit = np.zeros(size)
+        self.max_habit = np.zeros(size)
+        self.effect = np.zeros(size)
+        self.desperation = np.zeros(size)
+        self.previous_desperation = np.zeros(size)
+        self.tolerance_input = np.zeros((size, self.tolerance_window.max()))
+        self.tolerance_input_sum = np.zeros(size)
+
+        # Effects of the doses taken since the last dose increase, most recent
+        # effect_window of them, used in deciding whether to increase dose.
+        self.effect_window = 20
+        self.recent_effects = np.zeros((size, self.effect_window))
+        self.recent_effects_count = np.zeros(size, dtype=int)
+
+        # Simulation state
+        self.concentration = np.zeros(size)
+        self.time_since_dose = np.zeros(size)
+        self.last_amount_taken = np.zeros(size)
+        self.conc_when_dose_taken = np.zeros(size)
+        self.opioid_available = np.ones(size, dtype=bool)
+        self.integralA = np.zeros(size)
+        self.integralB = np.zeros(size)
+        self.integralC = np.zeros(size)
+        self.integralD = np.zeros(size)
+
+        # Outcomes
+        self.doses_taken = np.zeros(size, dtype=int)
+        self.dose_increases = np.zeros(size, dtype=int)
+        self.overdoses = [[] for _ in range(size)]
+        self.fatal_overdose_time = np.full(size, -1)
+
+        # Traces for selected persons
+        self.trace_persons = np.asarray(trace_persons, dtype=int)
+        self.traces = {
+            name: np.zeros((len(self.trace_persons), days * 100))
+            for name in ("concentration", "habit", "effect", "desperation")
+        }
+        self.trace_length = np.zeros(len(self.trace_persons), dtype=int)
+
+        # The person of each row of the per-person arrays, the rows of those arrays, and
+        # the row of each traced person (-1 once they have died and been removed)
+        self.ids = np.arange(size)
+        self._rows = np.arange(size)
+        self.trace_rows = self.trace_persons.copy()
+
+    def update_downward_pressure(
+        self, mask: np.ndarray, midpoint_min: int = 100, midpoint_max: int = 1_000
+    ):
+        """
+        Vectorized Person.update_downward_pressure() for the persons in mask.
+        """
+        midpoint_range = midpoint_max - midpoint_min
+        midpoint = (self.internal_risk[mask] * midpoint_range) + midpoint_min
+        baseline_dp = 1 - self.external_risk[mask]
+        self.downward_pressure[mask] = baseline_dp + (
+            (1 - baseline_dp) / (1 + np.exp(-0.005 * (self.dose[mask] - midpoint)))
+        )
+
+    def set_risk_logit(self):
+        """
+        Vectorized Person.set_risk_logit(). Also converts the risk logit into the
+        multiplier applied to each person's threshold in compute_threshold().
+        """
+        avg_risk = (self.external_risk + self.internal_risk) / 2
+        self.risk_logit = np.log(avg_risk / (1 - avg_risk)) / 0.25
+        self.threshold_multiplier = np.ones(self.size)
+        low = self.risk_logit <= -5
+        high = self.risk_logit >= 5
+        self.threshold_multiplier[low] = 1 / np.abs(self.risk_logit[low])
+        self.threshold_multiplier[high] = self.risk_logit[high]
+
+    def simulate(self):
+        """
+        Simulates the cohort for the number of days specified at instantiation. Follows
+        the same sequence of steps as Simulation.simulate() at each time point. Persons
+        who suffer a fatal overdose drop out of the active mask and their rows are
+        removed from the per-person arrays (see compact()), so their state stays as it
+        was at their death and later time points cost nothing for them. Every row is
+        restored once the simulation ends. Stops early if every person in the cohort
+        has died.
+        """
+        full = {name: getattr(self, name) for name in PER_PERSON}
+        try:
+            for t in range(self.days * 100):
+                self.step(t)
+                if not self.active.all():
+                    self.compact(full)
+                    if not self.ids.size:
+                        break
+        finally:
+            self.expand(full)
+
+    def compact(self, full: dict):
+        """
+        Removes the rows of the persons who have died from every per-person array (see
+        PER_PERSON), after storing their final state in full, the arrays of the whole
+        cohort by name.
+        """
+        alive = self.active
+        dead = self.ids[~alive]
+        for name in PER_PERSON:
+            values = getattr(self, name)
+            full[name][dead] = values[~alive]
+            setattr(self, name, values[alive])
+        self.ids = self.ids[alive]
+        self._rows = np.arange(self.ids.size)
+        rows = np.full(self.size, -1)
+        rows[self.ids] = self._rows
+        self.trace_rows = rows[self.trace_persons]
+
+    def expand(self, full: dict):
+        """
+        Stores the state of the remaining rows in full, the arrays of the whole cohort
+        by name, and makes those the per-person arrays again, with one row per person.
+        """
+        for name in PER_PERSON:
+            full[name][self.ids] = getattr(self, name)
+            setattr(self, name, full[name])
+        self.ids = np.arange(self.size)
+        self._rows = np.arange(self.size)
+        self.trace_rows = self.trace_persons.copy()
+
+    def step(self, t: int):
+        """
+        Conducts every step of a single time point for the whole cohort.
+        """
+        # Add to time since last dose and compute concentration
+        self.time_since_dose += 1
+        self.concentration = self.compute_concentration()
+
+        # Add concentration to tolerance input
+        position = t % self.tolerance_window
+        self.tolerance_input_sum += (
+            self.concentration - self.tolerance_input[self._rows, position]
+        )
+        self.tolerance_input[self._rows, position] = self.concentration
+
+        self.update_availability(t)
+
+        # Check which persons will take another dose
+        dose_taken = (
+            self.active
+            & self.opioid_available
+            & (self.will_take_dose(t) | (t % 100 == 0))
+        )
+        if dose_taken.any():
+            self.record_dose_taken(dose_taken, position)
+
+        self.habit = self.compute_habit(t)
+        np.maximum(self.max_habit, self.habit, out=self.max_habit)
+        self.effect = self.compute_effect()
+
+        if dose_taken.any():
+            fatal = self.check_overdoses(dose_taken, t)
+            self.check_dose_increases(dose_taken & ~fatal, t)
+
+        self.compute_concentration_integrals()
+        self.previous_desperation = self.desperation
+        self.desperation = self.compute_desperation()
+        self.threshold = self.compute_threshold()
+
+        self.record_traces(t)
+
+    def compute_concentration(self, k: float = 0.0594):
+        """
+        Vectorized Simulation.compute_concentration().
+        """
+        return (self.conc_when_dose_taken + self.last_amount_taken) * np.exp(
+            -k * self.time_since_dose
+        )
+
+    def compute_effect(self, k: float = 0.0594):
+        """
+        Vectorized Simulation.compute_effect().
+        """
+        return np.maximum(
+            (self.conc_when_dose_taken + self.last_amount_taken - self.habit)
+            * np.exp(-k * self.time_since_dose),
+            0,
+        )
+
+    def update_availability(self, t: int):
+        """
+        Vectorized Simulation.update_availability(). Availability is drawn once per
+        day for each person, adjusted by their desperation, and overridden during the
+        cohort's stop use period.
+        """
+        if t % 100 == 0:
+            rand = self.rng.random(self._rows.size)
+            if t > 0:
+                # previous_desperation holds desperation[-2] relative to this step,
+                # since desperation for t-1 is stored in self.desperation.
+                desperate = self.previous_desperation > 1
+                rand[desperate] /= self.previous_desperation[desperate]
+            self.opioid_available = rand < self.availability
+        if self.stop_use_time:
+            if self.resume_use_time:
+                if self.stop_use_time <= t < self.resume_use_time:
+                    self.opioid_available[:] = False
+                elif t == self.resume_use_time:
+                    if (
+                        self.behavior_when_resuming_use
+                        == BehaviorWhenResumingUse.LOWER_DOSE
+                    ):
+                        self.lower_dose_after_pause(self.active)
+            elif t >= self.stop_use_time:
+                self.opioid_available[:] = False
+
+    def lower_dose_after_pause(self, mask: np.ndarray):
+        """
+        Vectorized Person.lower_dose_after_pause() for the persons in mask.
+        """
+        self.dose[mask] = self.dose_increase[mask] * np.round(
+            self.max_habit[mask] / self.dose_increase[mask]
+        )
+        self.update_downward_pressure(mask)
+
+    def will_take_dose(self, t: int):
+        """
+        Vectorized Person.will_take_dose(). Returns a boolean mask of the persons who
+        want another dose and are not held back by downward pressure or a recent
+        overdose.
+        """
+        pausing = (self.last_overdose >= 0) & (
+            t < self.last_overdose + self.post_OD_use_pause
+        )
+        wants_dose = ~pausing & (self.concentration <= self.threshold)
+        draws = self.rng.random(self._rows.size)
+        return wants_dose & (draws >= self.downward_pressure)
+
+    def record_dose_taken(self, mask: np.ndarray, position: np.ndarray):
+        """
+        Vectorized Simulation.record_dose_taken() for the persons in mask.
+        """
+        self.doses_taken[mask] += 1
+        self.conc_when_dose_taken[mask] = self.concentration[mask]
+        self.time_since_dose[mask] = 0
+        self.last_amount_taken[mask] = self.compute_amount_taken(mask)
+        new_conc = self.conc_when_dose_taken[mask] + self.last_amount_taken[mask]
+        self.concentration[mask] = new_conc
+        rows = self._rows[mask]
+        self.tolerance_input_sum[mask] += new_conc - self.tolerance_input[
+            rows, position[mask]
+        ]
+        self.tolerance_input[rows, position[mask]] = new_conc
+
+    def compute_amount_taken(self, mask: np.ndarray):
+        """
+        Vectorized Simulation.compute_amount_taken() for the persons in mask.
+        """
+        n = np.count_nonzero(mask)
+        behavioral_variability = self.behavioral_variability[mask]
+        modified_dose = self.dose[mask] * self.rng.uniform(
+            1 - behavioral_variability, 1 + behavioral_variability, n
+        )
+        counterfeit = self.rng.random(n) < self.counterfeit_prob[mask]
+        dose_variability = self.dose_variability[mask]
+        modified_dose *= np.where(
+            counterfeit,
+            self.rng.uniform(1 - dose_variability, 1 + dose_variability, n),
+            1,
+        )
+        fentanyl = counterfeit & (self.rng.random(n) < self.fentanyl_prob[mask])
+        modified_dose *= np.where(fentanyl, 1 + self.rng.exponential(0.25, n), 1)
+        return modified_dose
+
+    def compute_habit(
+        self,
+        t: int,
+        conc_multiplier: int = 1.85,
+        L1: float = 1.0275,
+        L2: float = 0.58,
+        K1: float = 0.2,
+        K2: float = 0.0002,
+        X1: float = 0.175,
+    ):
+        """
+        Vectorized Simulation.compute_habit().
+        """
+        if t == 0:
+            return np.zeros(self._rows.size)
+        rolling_concentration = (
+            self.tolerance_input_sum / self.tolerance_window
+        ) * conc_multiplier
+        return logistic(
+            x=rolling_concentration,
+            L=(self.dose ** L1) * L2,
+            k=K1 - (self.dose * K2),
+            x0=self.dose * X1,
+        )
+
+    def check_overdoses(
+        self,
+        mask: np.ndarray,
+        t: int,
+        x0: float = 1243.6936832876,
+        k: float = 0.0143710866,
+    ):
+        """
+        Vectorized Person.did_overdose() and Person.overdose() for the persons in mask.
+        Returns a boolean mask of the persons who suffered a fatal overdose, who are
+        removed from the active mask.
+        """
+        dose = self.concentration[mask]
+        tolerance = np.maximum(1, self.habit[mask])
+        tolerance_adjusted_OD_risk = logistic(x=dose, L=1, k=k, x0=x0) * (
+            ((dose / tolerance) - 1) ** 2
+        )
+        overdose = np.zeros(self._rows.size, dtype=bool)
+        overdose[mask] = self.rng.random(dose.size) < tolerance_adjusted_OD_risk
+        fatal = np.zeros(self._rows.size, dtype=bool)
+        if not overdose.any():
+            return fatal
+
+        n = np.count_nonzero(overdose)
+        for i in np.flatnonzero(overdose):
+            self.overdoses[self.ids[i]].append(t)
+        self.last_overdose[overdose] = t
+        combined_risk = self.internal_risk[overdose] + self.external_risk[overdose]
+        # Person.compute_OD_use_pause()
+        self.post_OD_use_pause[overdose] = (
+            (60 * 100 * (1 - 0.999) ** combined_risk) * self.rng.uniform(0.5, 1.5, n)
+        )
+        # Person.compute_OD_dose_reduction()
+        dose_reduction = (combined_risk * 0.25 + 0.5) * self.rng.uniform(0.5, 1.5, n)
+        self.dose[overdose] *= np.minimum(dose_reduction, 1)
+
+        fatal[overdose] = self.rng.random(n) < (1 / 8.5)
+        self.fatal_overdose_time[fatal] = t
+        self.active &= ~fatal
+        return fatal
+
+    def check_dose_increases(
+        self, mask: np.ndarray, t: int, increase_threshold: float = 0.4
+    ):
+        """
+        Vectorized Person.will_increase_dose() and Person.increase_dose() for the
+        persons in mask. Averages the effects of the last effect_window doses taken
+        since each person's last dose increase.
+        """
+        # Doses taken at the time of the last increase don't count towards the average
+        recorded = mask & (t > self.last_dose_increase)
+        rows = self._rows[recorded]
+        self.recent_effects[
+            rows, self.recent_effects_count[recorded] % self.effect_window
+        ] = self.effect[recorded]
+        self.recent_effects_count[recorded] += 1
+
+        count = np.minimum(self.recent_effects_count, self.effect_window)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_effect = self.recent_effects.sum(axis=1) / count
+        candidates = (
+            mask
+            & (self.dose < 2_000)
+            & (count > 0)
+            & (mean_effect < self.dose * increase_threshold)
+        )
+        draws = self.rng.random(self._rows.size)
+        increase = candidates & (draws > self.downward_pressure)
+        if increase.any():
+            self.dose[increase] += self.dose_increase[increase]
+            self.last_dose_increase[increase] = t
+            self.dose_increases[increase] += 1
+            self.recent_effects[increase] = 0
+            self.recent_effects_count[increase] = 0
+            self.update_downward_pressure(increase)
+
+    def compute_concentration_integrals(
+        self,
+        ALPHA1=0.99,
+        BETA1=1,
+        ALPHA2=0.999,
+        BETA2=2000,
+        ALPHA3=0.9998,
+        BETA3=15000,
+        ALPHA4=0.99995,
+        BETA4=10000,
+    ):
+        """
+        Vectorized Simulation.compute_concentration_integrals().
+        """
+        self.integralA = ALPHA1 * self.integralA + BETA1 * self.concentration
+        self.integralB = ALPHA2 * self.integralB + self.integralA / BETA2
+        self.integralC = ALPHA3 * self.integralC + self.integralB / BETA3
+        self.integralD = ALPHA4 * self.integralD + self.integralC / BETA4
+
+    def compute_threshold(self, B1=0.001, B2=0.01, B3=0.5):
+        """
+        Vectorized Simulation.compute_threshold().
+        """
+        thresh = (B1 * self.integralB + B2 * self.integralC) / (
+            1 + B3 * self.integralA
+        )
+        return thresh * self.threshold_multiplier
+
+    def compute_desperation(self):
+        """
+        Vectorized Simulation.compute_desperation().
+        """
+        return np.maximum(
+            self.integralD
+            * (self.threshold - self.concentration)
+            / (self.concentration + 1),
+            0,
+        )
+
+    def record_traces(self, t: int):
+        """
+        Stores the key measures at t for the persons listed in trace_persons who are
+        still alive (or died at t).
+        """
+        if not self.trace_persons.size:
+            return
+        rows = self.trace_rows
+        recording = rows >= 0
+        alive = recording.copy()
+        alive[recording] = self.active[rows[recording]]
+        recording[recording] = alive[recording] | (
+            self.fatal_overdose_time[rows[recording]] == t
+        )
+        self.traces["concentration"][recording, t] = self.concentration[rows[recording]]
+        self.traces["habit"][recording, t] = self.habit[rows[recording]]
+        self.traces["effect"][recording, t] = self.effect[rows[recording]]
+        self.trace_length[recording] = t + 1
+        # As in Simulation.simulate(), desperation isn't recorded at a fatal overdose
+        self.traces["desperation"][alive, t] = self.desperation[rows[alive]]
@@ -0,0 +1,146 @@
+from vou.batch import build_simulation, map_chunks, task_seed
+from vou.streams import RandomStreams
+from vou.summary import Summary, OUTCOMES
+
+from typing import Callable, Iterable, Iterator, Mapping, NamedTuple
+import math
+
+import numpy as np
+
+
+class Difference(NamedTuple):
+    """
+    The estimated difference in the mean of an outcome between two scenarios
+    (alternative - baseline). variance_reduction is the variance of the difference had
+    the scenarios been run with independent random numbers divided by its variance
+    with common random numbers (and antithetic pairs), i.e. roughly how many times more
+    replications independent runs would need for the same standard error.
+    """
+
+    baseline: float
+    alternative: float
+    difference: float
+    standard_error: float
+    variance_reduction: float
+    replications: int
+
+    def interval(self, z: float = 1.96):
+        """
+        The normal approximation confidence interval of the difference (95% by
+        default).
+        """
+        margin = z * self.standard_error
+        return self.difference - margin, self.difference + margin
+
+
+def run_replications(
+    chunk: list, root: np.random.SeedSequence, scenarios: tuple, antithetic: bool
+):
+    """
+    Runs a chunk of replication indices in a worker process. Every scenario of a
+    replication is run with the same seed, and so with common random numbers. With
+    antithetic, they are run again with the antithetic streams of that seed.
+    """
+    results = []
+    for i in chunk:
+        seed = task_seed(root, i)
+        summaries = []
+        for flipped in (False, True) if antithetic else (False,):
+            for params in scenarios:
+                rng = RandomStreams(seed, antithetic=flipped)
+                simulation = build_simulation(dict(params, record="summary"), rng)
+                simulation.simulate()
+                summaries.append(simulation.summary)
+        results.append(tuple(summaries))
+    return results
+
+
+def iter_pairs(
+    baseline: Mapping,
+    alternative: Mapping,
+    replications: int,
+    seed=None,
+    antithetic: bool = False,
+    workers: int = None,
+    chunksize: int = 1,
+) -> Iterator[tuple]:
+    """
+    Runs each of two scenarios (mappings of Person and Simulation keyword arguments,
+    as in vou.batch tasks) replications times with common random numbers, and yields
+    the Summary of each run for each replication: (baseline, alternative), or
+    (baseline, alternative, antithetic baseline, antithetic alternative) with
+    antithetic=True.
+
+    Both scenarios of a replication are given RandomStreams from the same seed, so
+    every purpose (e.g. the daily availability draw or overdose checks) draws the same
+    random numbers in both as long as the scenarios make the same draws for it.
+    Results depend only on the root seed, not on the number of workers.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    scenarios = (dict(baseline), dict(alternative))
+    yield from map_chunks(
+        run_replications,
+        range(replications),
+        workers,
+        chunksize,
+        seed,
+        scenarios,
+        antithetic,
+    )
+
+
+def estimate(pairs: Iterable[tuple], outcome: Callable[[Summary], float]):
+    """
+    Estimates the difference in the mean of an outcome from the Summaries yielded by
+    iter_pairs(). An antithetic pair of replications counts as one replication whose
+    outcomes are the means of the pair.
+    """
+    values = np.array([[outcome(summary) for summary in pair] for pair in pairs])
+    n, runs = values.shape
+    baseline = values[:, 0::2]
+    alternative = values[:, 1::2]
+    differences = (alternative - baseline).mean(axis=1)
+    variance = float(differences.var(ddof=1)) if n > 1 else math.nan
+    # Variance of the difference of a replication's means with independent runs
+    independent = float(baseline.var(ddof=1) + alternative.var(ddof=1)) / (runs // 2)
+    # Without variance in either case (e.g. no overdoses at all), there is nothing to
+    # reduce
+    reduction = math.inf if independent else math.nan
+    return Difference(
+        baseline=float(baseline.mean()),
+        alternative=float(alternative.mean()),
+        difference=float(differences.mean()),
+        standard_error=math.sqrt(variance / n),
+        variance_reduction=independent / variance if variance else reduction,
+        replications=n,
+    )
+
+
+def compare(
+    baseline: Mapping,
+    alternative: Mapping,
+    replications: int,
+    seed=None,
+    antithetic: bool = False,
+    outcomes: Mapping[str, Callable[[Summary], float]] = OUTCOMES,
+    workers: int = None,
+    chunksize: int = 1,
+) -> dict:
+    """
+    Compares two scenarios with common random numbers (see iter_pairs()) and returns
+    the estimated Difference in each outcome, by name.
+
+    Because both scenarios of a replication share their random numbers, their outcomes
+    are positively correlated and the variance of the paired difference is smaller than
+    with independent seeds, so the same standard error needs fewer replications. The
+    reduction is reported in each Difference.
+
+        compare(dict(availability=0.75), dict(availability=0.9), replications=200)
+    """
+    pairs = list(
+        iter_pairs(
+            baseline, alternative, replications, seed, antithetic, workers, chunksize
+        )
+    )
+    return {name: estimate(pairs, outcome) for name, outcome in outcomes.items()}
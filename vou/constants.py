@@ -0,0 +1,40 @@
+from typing import NamedTuple
+
+
+class Constants(NamedTuple):
+    """
+    The model's calibrated constants, named as the keyword arguments of
+    vou.kernel.run_kernel(). The defaults are the values the model has been calibrated
+    with, which are also the defaults of the Simulation and Person methods that use
+    them:
+
+    - conc_multiplier, L1, L2, K1, K2, X1: Simulation.compute_habit()
+    - ALPHA1-4, BETA1-4: Simulation.compute_concentration_integrals()
+    - B1-B3: Simulation.compute_threshold()
+    - increase_threshold: Person.will_increase_dose()
+    - OD_X0, OD_K: x0 and k of Person.did_overdose()
+
+    Pass to Simulation(constants=...) to simulate with other values, e.g. when
+    recalibrating them (see vou.calibration).
+    """
+
+    conc_multiplier: float = 1.85
+    L1: float = 1.0275
+    L2: float = 0.58
+    K1: float = 0.2
+    K2: float = 0.0002
+    X1: float = 0.175
+    ALPHA1: float = 0.99
+    BETA1: float = 1
+    ALPHA2: float = 0.999
+    BETA2: float = 2000
+    ALPHA3: float = 0.9998
+    BETA3: float = 15000
+    ALPHA4: float = 0.99995
+    BETA4: float = 10000
+    B1: float = 0.001
+    B2: float = 0.01
+    B3: float = 0.5
+    increase_threshold: float = 0.4
+    OD_X0: float = 1243.6936832876
+    OD_K: float = 0.0143710866
@@ -0,0 +1,287 @@
+from vou.person import BehaviorWhenResumingUse, OverdoseType
+from vou.utils import exponential_decay, habit_parameters
+
+import math
+
+
+def run_kernel(
+    simulation,
+    t: int,
+    end: int,
+    k: float = 0.0594,
+    conc_multiplier: int = 1.85,
+    L1: float = 1.0275,
+    L2: float = 0.58,
+    K1: float = 0.2,
+    K2: float = 0.0002,
+    X1: float = 0.175,
+    ALPHA1=0.99,
+    BETA1=1,
+    ALPHA2=0.999,
+    BETA2=2000,
+    ALPHA3=0.9998,
+    BETA3=15000,
+    ALPHA4=0.99995,
+    BETA4=10000,
+    B1=0.001,
+    B2=0.01,
+    B3=0.5,
+    OD_X0: float = 1243.6936832876,
+    OD_K: float = 0.0143710866,
+    increase_threshold: float = 0.4,
+):
+    """
+    Runs the time points from t up to end of a simulation with the "fast" engine.
+    Returns OverdoseType.FATAL if the person suffered a fatal overdose, which ends the
+    simulation.
+
+    Conducts exactly the same steps as Simulation.step(), in the same order and with the
+    same floating-point operations, so results are identical. It is faster because the
+    whole loop runs on local variables:
+
+    - Simulation and Person state is read into locals before the loop and written back
+      afterwards, instead of going through attribute lookups on every step.
+    - Values derived from constants, dose or risk (e.g. habit's logistic parameters and
+      the threshold's risk adjustment) are only recomputed when their inputs change.
+    - Concentration decay is read from a table of exp(-k * t) values instead of being
+      computed at every step.
+    - Traces are written through memoryviews of their buffers.
+
+    Steps that only happen when a dose is taken (computing the amount taken, overdose
+    consequences, dose increases) still go through the Simulation and Person methods.
+
+    The calibrated parameters are the same as those of the Simulation and Person methods
+    (OD_X0 and OD_K are x0 and k of Person.did_overdose()), see vou.constants.Constants.
+    """
+    person = simulation.person
+    # Draws that Person.will_take_dose() and Person.did_overdose() make come from the
+    # person's streams, which may differ from the simulation's
+    availability_random = simulation.streams.availability.random
+    pressure_random = person.streams.downward_pressure.random
+    overdose_random = person.streams.overdose.random
+    exp = math.exp
+
+    # Traces. Concentration, habit, effect and desperation have one value per time
+    # point, the integrals have one extra leading value. Values before the traces'
+    # discarded offsets have been dropped (see Trace.discard()).
+    traces = simulation.traces()
+    for trace in traces[:4]:
+        trace.reserve(end - trace.discarded)
+    for trace in traces[4:]:
+        trace.reserve(end + 1 - trace.discarded)
+    offset = person.concentration.discarded
+    integral_offset = simulation.integralA.discarded
+    conc_out, habit_out, effect_out, desp_out, A_out, B_out, C_out, D_out = [
+        memoryview(trace.buffer) for trace in traces
+    ]
+
+    # Simulation state
+    time_since_dose = simulation.time_since_dose
+    # Only convert the part of the decay table that these time points can reach, since
+    # the kernel may be run on short blocks of time points (see iter_blocks())
+    decay = exponential_decay(k, max(end, simulation.days * 100) + 1)
+    decay = decay[: time_since_dose + end - t + 1].tolist()
+    conc_when_dose_taken = simulation.conc_when_dose_taken
+    last_amount_taken = simulation.last_amount_taken
+    total_amount_taken = simulation.total_amount_taken
+    amount = conc_when_dose_taken + last_amount_taken
+    opioid_available = simulation.opioid_available
+    integralA = simulation.integralA.last
+    integralB = simulation.integralB.last
+    integralC = simulation.integralC.last
+    integralD = simulation.integralD.last
+    availability = simulation.availability
+    stop_use_time = simulation.stop_use_time
+    resume_use_time = simulation.resume_use_time
+    lower_dose_on_resume = (
+        person.behavior_when_resuming_use == BehaviorWhenResumingUse.LOWER_DOSE
+    )
+
+    # Person state
+    threshold = person.threshold
+    tolerance_input = person.tolerance_input
+    tolerance_input_sum = person.tolerance_input_sum
+    tolerance_window = person.tolerance_window
+    took_dose = person.took_dose
+    record_dose_effect = person.record_dose_effect
+    overdoses = person.overdoses
+    desperation = person.desperation.last
+    previous_desperation = person.desperation.previous
+    habit = person.habit.last
+    effect = person.effect.last
+    conc = person.concentration.last
+
+    # The threshold is adjusted by the person's risk logit, which never changes
+    risk_logit = person.risk_logit
+    risk_adjusted = not -5 < risk_logit < 5
+    risk_divisor = abs(risk_logit) if risk_logit < 0 else None
+
+    def dose_dependent():
+        # Downward pressure and the logistic parameters of habit only change with dose
+        L, k, x0 = habit_parameters(person.dose, L1, L2, K1, K2, X1)
+        return person.downward_pressure, L, -k, x0
+
+    downward_pressure, habit_L, habit_neg_k, habit_x0 = dose_dependent()
+    pause_end = overdoses[-1] + person.post_OD_use_pause if overdoses else -1
+
+    # Dividing by a float gives the same result as dividing by the equivalent int, but
+    # is cheaper
+    BETA2 = float(BETA2)
+    BETA3 = float(BETA3)
+    BETA4 = float(BETA4)
+
+    fatal = None
+    dose_taken = simulation.dose_taken_at_t
+    size = t
+    for t in range(t, end):
+        dose_taken = False
+        time_since_dose += 1
+        i = t - offset
+        new_day = t % 100 == 0
+
+        # Compute the person's concentration of opioid using pharmacokinetic model
+        conc = amount * decay[time_since_dose]
+
+        # Add concentration to tolerance input
+        tolerance_input_sum -= tolerance_input.popleft()
+        tolerance_input_sum += conc
+        tolerance_input.append(conc)
+
+        # Update opioid availability
+        if new_day:
+            rand = availability_random()
+            if size:
+                if previous_desperation > 1:
+                    rand = rand / previous_desperation
+            opioid_available = rand < availability
+        if stop_use_time:
+            if resume_use_time:
+                if t >= stop_use_time and t < resume_use_time:
+                    opioid_available = False
+                elif t == resume_use_time and lower_dose_on_resume:
+                    person.habit.size = size - offset
+                    person.lower_dose_after_pause()
+                    downward_pressure, habit_L, habit_neg_k, habit_x0 = (
+                        dose_dependent()
+                    )
+            elif t >= stop_use_time:
+                opioid_available = False
+
+        # Check if the person will take another dose
+        if opioid_available:
+            if t < pause_end:
+                wants_dose = False
+            elif conc > threshold:
+                wants_dose = False
+            elif pressure_random() < downward_pressure:
+                wants_dose = False
+            else:
+                wants_dose = True
+            if wants_dose or new_day:
+                dose_taken = True
+                took_dose.append(t)
+                conc_when_dose_taken = conc
+                time_since_dose = 0
+                simulation.last_amount_taken = last_amount_taken = (
+                    simulation.compute_amount_taken()
+                )
+                total_amount_taken += last_amount_taken
+                amount = conc_when_dose_taken + last_amount_taken
+                conc = amount * decay[0]
+                tolerance_input_sum -= tolerance_input.pop()
+                tolerance_input_sum += conc
+                tolerance_input.append(conc)
+        conc_out[i] = conc
+
+        # Compute the person's opioid use habit at t
+        if t == 0:
+            habit = 0
+        else:
+            rolling_concentration = (
+                tolerance_input_sum / tolerance_window
+            ) * conc_multiplier
+            try:
+                habit = habit_L / (
+                    1 + exp(habit_neg_k * (rolling_concentration - habit_x0))
+                )
+            except OverflowError:
+                habit = 0.0
+        habit_out[i] = habit
+
+        # Compute the opioid's effect on the person (concentration - habit)
+        effect = (amount - habit) * decay[time_since_dose]
+        if effect < 0:
+            effect = 0
+        effect_out[i] = effect
+        size = t + 1
+
+        if dose_taken:
+            # Check for overdose (Person.did_overdose())
+            tolerance = habit if habit > 1 else 1
+            baseline_OD_risk = 1 / (1 + exp(-OD_K * (conc - OD_X0)))
+            excess = ((conc / tolerance) - 1) ** 2
+            if overdose_random() < baseline_OD_risk * excess:
+                if person.overdose(t) == OverdoseType.FATAL:
+                    fatal = OverdoseType.FATAL
+                    break
+                pause_end = overdoses[-1] + person.post_OD_use_pause
+                downward_pressure, habit_L, habit_neg_k, habit_x0 = dose_dependent()
+            record_dose_effect(t, effect)
+            if person.will_increase_dose(increase_threshold):
+                person.increase_dose(t)
+                downward_pressure, habit_L, habit_neg_k, habit_x0 = dose_dependent()
+
+        # Compute integrals of concentration, desperation, and threshold
+        integralA = ALPHA1 * integralA + BETA1 * conc
+        integralB = ALPHA2 * integralB + integralA / BETA2
+        integralC = ALPHA3 * integralC + integralB / BETA3
+        integralD = ALPHA4 * integralD + integralC / BETA4
+        j = size - integral_offset
+        A_out[j] = integralA
+        B_out[j] = integralB
+        C_out[j] = integralC
+        D_out[j] = integralD
+
+        previous_desperation = desperation
+        desperation = integralD * (threshold - conc) / (conc + 1)
+        if desperation < 0:
+            desperation = 0
+        desp_out[i] = desperation
+
+        threshold = (B1 * integralB + B2 * integralC) / (1 + B3 * integralA)
+        if risk_adjusted:
+            if risk_divisor is not None:
+                threshold = threshold / risk_divisor
+            else:
+                threshold = threshold * risk_logit
+
+    # Write state back
+    recorded = size if fatal is None else size - 1
+    for trace in traces[:3]:
+        trace.size = size - trace.discarded
+    person.desperation.size = recorded - person.desperation.discarded
+    for trace in traces[4:]:
+        trace.size = recorded + 1 - trace.discarded
+    for trace in traces:
+        if trace.size:
+            trace.last = trace.buffer.item(trace.size - 1)
+        if trace.size > 1:
+            trace.previous = trace.buffer.item(trace.size - 2)
+    person.concentration.last = conc
+    person.habit.last = habit
+    person.effect.last = effect
+    if fatal is None:
+        person.desperation.last = desperation
+        person.desperation.previous = previous_desperation
+        simulation.integralA.last = integralA
+        simulation.integralB.last = integralB
+        simulation.integralC.last = integralC
+        simulation.integralD.last = integralD
+    simulation.time_since_dose = time_since_dose
+    simulation.conc_when_dose_taken = conc_when_dose_taken
+    simulation.total_amount_taken = total_amount_taken
+    simulation.opioid_available = opioid_available
+    simulation.dose_taken_at_t = dose_taken
+    person.threshold = threshold
+    person.tolerance_input_sum = tolerance_input_sum
+    return fatal
@@ -1,6 +1,9 @@
+from vou.trace import Trace
 from vou.utils import logistic
+from vou.streams import as_streams
 
 from random import Random
+from functools import lru_cache
 from enum import IntEnum, unique
 from itertools import repeat
 from collections import deque
@@ -8,6 +11,44 @@ from collections import deque
 import numpy as np
 
 
+# Number of most recent doses whose effects are averaged in deciding whether to increase
+# dose. A calibrated parameter, not intended to be varied.
+EFFECT_WINDOW = 20
+
+
+@lru_cache(maxsize=4_096)
+def downward_pressure(
+    dose: float,
+    external_risk: float,
+    internal_risk: float,
+    midpoint_min: int = 100,
+    midpoint_max: int = 1_000,
+):
+    """
+    Computes downward pressure for a dose and risk levels, see
+    Person.update_downward_pressure(). Dose only changes at dose increases, overdoses,
+    and pauses, and mostly along the same ladder of doses, so values are cached in a
+    bounded cache shared by every person in the process.
+    """
+    # Person's internal risk is a value from 0 to 1. We use this in its raw
+    # form, but also need to convert it to the sigmoid midpoint parameter for the
+    # downward pressure logistic function. This function takes an internal risk from
+    # 0 to 1 and scales it to a midpoint in the specified range.
+    midpoint_range = midpoint_max - midpoint_min
+    midpoint = (internal_risk * midpoint_range) + midpoint_min
+
+    # External risk is quantified as 0=good, 1=bad for intuitiveness. However,
+    # in the logistic function for downward pressure, 0 is bad and 1 is good,
+    # since higher values lead to more downward pressure. Therefore, we invert
+    # external risk to get the user's downward pressure baseline.
+    baseline_dp = 1 - external_risk
+
+    # Main logistic function
+    return baseline_dp + (
+        (1 - baseline_dp) / (1 + np.exp(-0.005 * (dose - midpoint)))
+    )
+
+
 @unique
 class BehaviorWhenResumingUse(IntEnum):
     SAME_DOSE = 0
@@ -21,6 +62,35 @@ class OverdoseType(IntEnum):
 
 
 class Person:
+    __slots__ = (
+        "rng",
+        "streams",
+        "dose",
+        "dose_increase",
+        "threshold",
+        "tolerance_window",
+        "external_risk",
+        "internal_risk",
+        "behavioral_variability",
+        "downward_pressure",
+        "risk_logit",
+        "behavior_when_resuming_use",
+        "post_OD_use_pause",
+        "last_dose_increase",
+        "dose_increases",
+        "peak_dose",
+        "concentration",
+        "tolerance_input",
+        "tolerance_input_sum",
+        "desperation",
+        "habit",
+        "effect",
+        "overdoses",
+        "dose_effects",
+        "dose_effects_sum",
+        "took_dose",
+    )
+
     def __init__(
         self,
         rng: Random,
@@ -35,6 +105,8 @@ class Person:
     ):
         # Parameters
         self.rng = rng
+        # rng may also be a RandomStreams, with an independent substream per purpose
+        self.streams = as_streams(rng)
         self.dose = starting_dose
         self.dose_increase = dose_increase
         self.threshold = base_threshold
@@ -47,18 +119,30 @@ class Person:
         self.behavior_when_resuming_use = behavior_when_resuming_use
         self.post_OD_use_pause = None
         self.last_dose_increase = 0
+        self.dose_increases = 0
+        self.peak_dose = starting_dose
 
-        # A bunch of empty lists to store data during simulation
-        self.concentration = []
-        self.tolerance_input = deque(repeat(0, self.tolerance_window))
+        # A bunch of empty traces and lists to store data during simulation
+        self.concentration = Trace()
+        self.tolerance_input = deque(
+            repeat(0, self.tolerance_window), maxlen=self.tolerance_window
+        )
         self.tolerance_input_sum = 0
-        self.desperation = []
-        self.habit = []
-        self.effect = []
+        self.desperation = Trace()
+        self.habit = Trace()
+        self.effect = Trace()
         self.overdoses = []
-        self.effect_record = {}
+        # Time points at which doses were taken. The model no longer reads them while
+        # simulating, but they are outputs of a run (e.g. of trace archives, Block
+        # records and rare event estimates), so they are kept for as long as the traces,
+        # which grow about a hundred times faster, and discard_history() clears both.
         self.took_dose = []
 
+        # Effects of the most recent doses taken since the last dose increase, and their
+        # sum, used in deciding whether to increase dose
+        self.dose_effects = deque(maxlen=EFFECT_WINDOW)
+        self.dose_effects_sum = 0
+
     def update_downward_pressure(
         self, midpoint_min: int = 100, midpoint_max: int = 1_000
     ):
@@ -75,23 +159,15 @@ class Person:
         - Person's internal risk: transformed and used as the midpoint of the logistic
           curve
         - Person's current dose: used as the X value
+
+        Values are cached by dose and risk (see downward_pressure()).
         """
-        # Person's internal risk is a value from 0 to 1. We use this in its raw
-        # form, but also need to convert it to the sigmoid midpoint parameter for the
-        # downward pressure logistic function. This function takes an internal risk from
-        # 0 to 1 and scales it to a midpoint in the specified range.
-        midpoint_range = midpoint_max - midpoint_min
-        midpoint = (self.internal_risk * midpoint_range) + midpoint_min
-
-        # External risk is quantified as 0=good, 1=bad for intuitiveness. However,
-        # in the logistic function for downward pressure, 0 is bad and 1 is good,
-        # since higher values lead to more downward pressure. Therefore, we invert
-        # external risk to get the user's downward pressure baseline.
-        baseline_dp = 1 - self.external_risk
-
-        # Main logistic function
-        self.downward_pressure = baseline_dp + (
-            (1 - baseline_dp) / (1 + np.exp(-0.005 * (self.dose - midpoint)))
+        self.downward_pressure = downward_pressure(
+            self.dose,
+            self.external_risk,
+            self.internal_risk,
+            midpoint_min,
+            midpoint_max,
         )
 
     def set_risk_logit(self):
@@ -109,7 +185,8 @@ class Person:
         increment of their dose increase amount.
         Also updates their downward pressure since dose has changed.
         """
-        self.dose = self.dose_increase * round(max(self.habit) / self.dose_increase)
+        self.dose = self.dose_increase * round(self.habit.max() / self.dose_increase)
+        self.peak_dose = max(self.peak_dose, self.dose)
         self.update_downward_pressure()
 
     def will_take_dose(self, t: int):
@@ -123,10 +200,10 @@ class Person:
         if self.overdoses and t < self.overdoses[-1] + self.post_OD_use_pause:
             return False
         # Does the person want another dose?
-        elif self.concentration[-1] > self.threshold:
+        elif self.concentration.last > self.threshold:
             return False
         # Does downward pressure prevent person from taking dose when they want one?
-        elif self.rng.random() < self.downward_pressure:
+        elif self.streams.downward_pressure.random() < self.downward_pressure:
             return False
         else:
             return True
@@ -150,8 +227,8 @@ class Person:
         roughly equals 2. We define "excess" as (dose / tolerance) - 1, or roughly 1 at
         steady state. We multiply the person's baseline OD risk by this excess squared.
         """
-        dose = self.concentration[-1]
-        tolerance = self.habit[-1]
+        dose = self.concentration.last
+        tolerance = self.habit.last
 
         # bound extremely low tolerance values to avoid huge excess values
         tolerance = max(1, tolerance)
@@ -163,7 +240,7 @@ class Person:
 
         tolerance_adjusted_OD_risk = baseline_OD_risk * excess
 
-        if self.rng.random() < tolerance_adjusted_OD_risk:
+        if self.streams.overdose.random() < tolerance_adjusted_OD_risk:
             # Overdose occurred
             return True
 
@@ -183,7 +260,7 @@ class Person:
         self.dose = self.dose * self.compute_OD_dose_reduction()
         # Check if overdose caused death. Per Dunn et al 2010, about 1 in every 8.5
         # ODs is fatal.
-        if self.rng.random() < (1 / 8.5):
+        if self.streams.fatality.random() < (1 / 8.5):
             return OverdoseType.FATAL
         else:
             return OverdoseType.NON_FATAL
@@ -197,7 +274,7 @@ class Person:
         """
         maximum = 60 * 100
         rate = -0.999
-        rand = self.rng.uniform(0.5, 1.5)
+        rand = self.streams.overdose.uniform(0.5, 1.5)
         combined_risk = self.internal_risk + self.external_risk
         pause = (maximum * (1 + rate) ** combined_risk) * rand
         return pause
@@ -211,7 +288,7 @@ class Person:
         """
         intercept = 0.5
         slope = 0.25
-        rand = self.rng.uniform(0.5, 1.5)
+        rand = self.streams.overdose.uniform(0.5, 1.5)
         combined_risk = self.internal_risk + self.external_risk
         dose_reduction = (combined_risk * slope + intercept) * rand
         if dose_reduction > 1:
@@ -219,31 +296,42 @@ class Person:
         else:
             return dose_reduction
 
-    def will_increase_dose(
-        self, effect_window: int = 20, increase_threshold: float = 0.4,
-    ):
+    def record_dose_effect(self, t: int, effect: float):
+        """
+        Records the effect of a dose taken at t, to be used in determining when the
+        person increases their dose. Only the effects of the last EFFECT_WINDOW doses
+        taken after the last dose increase are kept, along with their running sum.
+        """
+        if t > self.last_dose_increase:
+            effects = self.dose_effects
+            if len(effects) == EFFECT_WINDOW:
+                self.dose_effects_sum -= effects[0]
+            effects.append(effect)
+            self.dose_effects_sum += effect
+
+    def will_increase_dose(self, increase_threshold: float = 0.4):
         """
         Checks whether the person will increase their dose. Based on a comparison of
-        the average of past dose effects to the person's desired dose. Effect window
-        and increase threshold are calibrated parameters and not intended to be varied
-        during simulation.
-        """
-        if self.dose < 2_000:
-            last_n_dose_effects = [
-                self.effect_record[d]
-                for d in self.took_dose[-effect_window:]
-                if d > self.last_dose_increase
-            ]
-            if np.mean(last_n_dose_effects) < (self.dose * increase_threshold):
-                if self.rng.random() > self.downward_pressure:
+        the average effect of the person's recent doses (see record_dose_effect()) to
+        their desired dose. Increase threshold is a calibrated parameter and not
+        intended to be varied during simulation.
+        """
+        if self.dose < 2_000 and self.dose_effects:
+            mean_effect = self.dose_effects_sum / len(self.dose_effects)
+            if mean_effect < (self.dose * increase_threshold):
+                if self.streams.downward_pressure.random() > self.downward_pressure:
                     return True
 
     def increase_dose(self, t: int):
         """
         Takes the necessary steps when the person increases their dose. Updates dose,
-        records the current time as the last time of dose increase, and updates the
-        person's downward pressure for the new dose.
+        records the current time as the last time of dose increase, counts the increase
+        and the peak dose, and updates the person's downward pressure for the new dose.
         """
         self.dose += self.dose_increase
         self.last_dose_increase = t
+        self.dose_effects.clear()
+        self.dose_effects_sum = 0
+        self.dose_increases += 1
+        self.peak_dose = max(self.peak_dose, self.dose)
         self.update_downward_pressure()
@@ -0,0 +1,116 @@
+from vou.streams import PURPOSES, RandomStreams
+
+from time import perf_counter
+
+
+# Phases of a time step, in the order Simulation.profiled_step() conducts them
+PHASES = (
+    "concentration",
+    "availability",
+    "will_take_dose",
+    "record_dose",
+    "habit",
+    "effect",
+    "overdose",
+    "will_increase_dose",
+    "integrals",
+    "desperation",
+    "threshold",
+    "fast_forward",
+)
+
+COUNTERS = ("time_points", "rng_draws", "doses", "dose_increases", "overdoses")
+
+
+class Profiler:
+    __slots__ = ("seconds", "calls", "counters", "draws", "last")
+
+    def __init__(self):
+        """
+        Accumulates the wall time spent in and the number of calls to each phase of a
+        simulation's time steps, along with counters of time points simulated, random
+        draws, doses, dose increases, and overdoses, and the number of random draws for
+        each purpose (see vou.streams.PURPOSES). See Simulation(profile=True).
+        """
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.draws = dict.fromkeys(PURPOSES, 0)
+        self.last = None
+
+    def start(self):
+        self.last = perf_counter()
+
+    def lap(self, phase: str):
+        """
+        Attributes the time since the previous lap (or start()) to phase.
+        """
+        now = perf_counter()
+        self.seconds[phase] += now - self.last
+        self.calls[phase] += 1
+        self.last = now
+
+    def report(self):
+        """
+        Returns the accumulated measurements as a dict with the time, call count, mean
+        time per call, and share of the total time of each phase that was called, the
+        counters, and the draws for each purpose.
+        """
+        total = sum(self.seconds.values())
+        phases = {
+            phase: {
+                "seconds": self.seconds[phase],
+                "calls": self.calls[phase],
+                "mean": self.seconds[phase] / self.calls[phase],
+                "share": self.seconds[phase] / total if total else 0.0,
+            }
+            for phase in PHASES
+            if self.calls[phase]
+        }
+        return {
+            "seconds": total,
+            "phases": phases,
+            "counters": dict(self.counters),
+            "draws": dict(self.draws),
+        }
+
+    def count(self, streams: RandomStreams):
+        """
+        Streams that count the draws of each purpose of streams (see CountingRandom).
+        Purposes that share a stream still draw from it in the same order.
+        """
+        return RandomStreams.from_streams(
+            {
+                purpose: CountingRandom(getattr(streams, purpose), self, purpose)
+                for purpose in PURPOSES
+            }
+        )
+
+
+class CountingRandom:
+    def __init__(self, rng, profiler: Profiler, purpose: str = None):
+        """
+        Stands in for a random.Random instance while a simulation is profiled, counting
+        every call to its methods (e.g. random() or uniform()) as one draw, and as one
+        draw for purpose if given. The draws come from rng itself, so profiling doesn't
+        change the simulation's results.
+        """
+        self.rng = rng
+        self.profiler = profiler
+        self.purpose = purpose
+
+    def __getattr__(self, name):
+        attr = getattr(self.rng, name)
+        if not callable(attr):
+            return attr
+        counters = self.profiler.counters
+        draws = self.profiler.draws
+        purpose = self.purpose
+
+        def counted(*args, **kwargs):
+            counters["rng_draws"] += 1
+            if purpose is not None:
+                draws[purpose] += 1
+            return attr(*args, **kwargs)
+
+        return counted
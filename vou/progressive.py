@@ -0,0 +1,123 @@
+from vou.person import Person
+from vou.simulation import Simulation
+
+from copy import deepcopy
+from threading import Condition, Event, Thread
+from typing import Callable, Iterator, NamedTuple
+
+
+class Progress(NamedTuple):
+    """
+    A published state of a BackgroundSimulation: a snapshot of the person simulated up
+    to day, and whether the simulation is complete (all days, or up to a fatal
+    overdose).
+    """
+
+    person: Person
+    day: int
+    complete: bool
+
+
+class BackgroundSimulation:
+    def __init__(
+        self,
+        simulation: Simulation,
+        chunk_days: int = 30,
+        on_complete: Callable[[Simulation], None] = None,
+    ):
+        """
+        Runs a simulation in a background thread, chunk_days days at a time (see
+        Simulation.simulate()'s until_day), and publishes a snapshot of the person
+        after each chunk, so that a caller can show the first days of a simulation
+        while the rest is running:
+
+            job = BackgroundSimulation(simulation)
+            for progress in job.updates():
+                plot(progress.person, progress.day)
+
+        Chunks give the same results as simulating all days at once. Snapshots are
+        copies, so they can be read while the simulation continues. on_complete is
+        called with the simulation in the background thread once every day has been
+        simulated, e.g. to store the result, before the complete Progress is published.
+
+        cancel() stops the simulation after the chunk in progress, e.g. when its
+        parameters are no longer wanted.
+        """
+        if simulation.record != "traces":
+            raise ValueError("Only simulations with record='traces' can be published")
+        self.simulation = simulation
+        self.chunk_days = chunk_days
+        self.on_complete = on_complete
+        self.progress = None
+        self.error = None
+        self.version = 0
+        self.cancelled = Event()
+        self.finished = False
+        self.condition = Condition()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        simulation = self.simulation
+        end = simulation.days * 100
+        try:
+            while not self.cancelled.is_set():
+                day = min(simulation.t // 100 + self.chunk_days, simulation.days)
+                simulation.simulate(until_day=day)
+                complete = simulation.t >= end
+                # Completion is only published once on_complete has run, so a caller
+                # that sees it can rely on its effects (e.g. a stored result)
+                if complete and self.on_complete is not None:
+                    self.on_complete(simulation)
+                self.publish(Progress(deepcopy(simulation.person), day, complete))
+                if complete:
+                    break
+        except Exception as error:
+            self.error = error
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def publish(self, progress: Progress):
+        with self.condition:
+            self.progress = progress
+            self.version += 1
+            self.condition.notify_all()
+
+    def cancel(self):
+        """
+        Stops the simulation after the chunk in progress.
+        """
+        self.cancelled.set()
+
+    @property
+    def complete(self):
+        return self.progress is not None and self.progress.complete
+
+    def updates(self, timeout: float = None) -> Iterator[Progress]:
+        """
+        Yields the latest Progress each time a chunk is published, until the
+        simulation is complete or cancelled. Chunks published while the caller was busy
+        with the previous one are skipped, so a slow caller (e.g. one that plots every
+        update) always gets the latest state and never falls behind. Raises any error
+        of the simulation, and TimeoutError if nothing is published within timeout
+        seconds.
+        """
+        seen = 0
+        while True:
+            with self.condition:
+                if not self.condition.wait_for(
+                    lambda: self.version > seen or self.finished, timeout
+                ):
+                    raise TimeoutError("No progress was published within the timeout")
+                progress, version = self.progress, self.version
+            if self.error is not None:
+                raise self.error
+            if version == seen:
+                # Cancelled
+                return
+            seen = version
+            yield progress
+            if progress.complete:
+                return
@@ -0,0 +1,235 @@
+from vou.archive import SERIES, TraceArchive
+from vou.person import Person
+
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Envelope(NamedTuple):
+    """
+    A series over a window of time points, reduced to buckets of consecutive time
+    points: the first time point of each bucket and the one after its last, the
+    minimum, maximum, and mean of the series in each bucket, and the time points at
+    which the minimum and maximum first occur.
+    """
+
+    start: np.ndarray
+    stop: np.ndarray
+    low: np.ndarray
+    high: np.ndarray
+    mean: np.ndarray
+    low_at: np.ndarray
+    high_at: np.ndarray
+
+    def points(self):
+        """
+        The minimum and maximum of every bucket as points to draw a line through, at
+        the time points where they occur, in time order (as vou.visualize.downsample()
+        returns them): every peak and trough of the series appears in the line.
+        """
+        low_first = self.low_at <= self.high_at
+        times = np.stack(
+            (
+                np.minimum(self.low_at, self.high_at),
+                np.maximum(self.low_at, self.high_at),
+            ),
+            axis=1,
+        ).ravel()
+        values = np.stack(
+            (
+                np.where(low_first, self.low, self.high),
+                np.where(low_first, self.high, self.low),
+            ),
+            axis=1,
+        ).ravel()
+        return times, values
+
+
+class Pyramid:
+    def __init__(self, values):
+        """
+        An index of a series for queries of its minimum, maximum, and mean over windows
+        at a given resolution, e.g. to plot a window of a 73,000 time point trace at
+        one bucket per pixel.
+
+        Level k of the pyramid holds the minimum, maximum, and sum of every aligned
+        block of 2**k values, each computed from pairs of blocks of level k - 1, so
+        building it takes a single pass over the series and about three times its
+        memory. Level 0 is values itself, which is only read through views, so it can
+        be a memory-mapped trace of a TraceArchive.
+        """
+        values = np.asarray(values)
+        self.values = values
+        self.lows = [values]
+        self.highs = [values]
+        self.sums = [values.astype(np.float64, copy=False)]
+        while len(self.lows[-1]) >= 2:
+            n = len(self.lows[-1]) // 2 * 2
+            low, high, total = self.lows[-1], self.highs[-1], self.sums[-1]
+            self.lows.append(np.fmin(low[0:n:2], low[1:n:2]))
+            self.highs.append(np.fmax(high[0:n:2], high[1:n:2]))
+            self.sums.append(total[0:n:2] + total[1:n:2])
+
+    def __len__(self):
+        return len(self.values)
+
+    def max(self):
+        if not len(self.values):
+            raise ValueError("max() of an empty series")
+        return self._range(0, len(self.values))[1]
+
+    def _range(self, start: int, stop: int):
+        # Minimum, maximum, and sum of values start to stop, from the largest aligned
+        # blocks that fit, so at most two blocks per level, and the time points at which
+        # the minimum and maximum first occur
+        start, stop = int(start), int(stop)
+        low, high, total = np.nan, np.nan, 0.0
+        low_at = high_at = (0, start)
+        while start < stop:
+            top = len(self.lows) - 1
+            level = min((start & -start).bit_length() - 1, top) if start else top
+            while start + (1 << level) > stop:
+                level -= 1
+            block = start >> level
+            value = self.lows[level][block]
+            if value < low or (np.isnan(low) and not np.isnan(value)):
+                low, low_at = value, (level, block)
+            value = self.highs[level][block]
+            if value > high or (np.isnan(high) and not np.isnan(value)):
+                high, high_at = value, (level, block)
+            total += self.sums[level][block]
+            start += 1 << level
+        level, block = low_at
+        low_at = int(self._locate(self.lows, level, [block], np.array([low]))[0])
+        level, block = high_at
+        high_at = int(self._locate(self.highs, level, [block], np.array([high]))[0])
+        return low, high, total, low_at, high_at
+
+    @staticmethod
+    def _locate(extremes: list, level: int, blocks, values: np.ndarray):
+        # The time points at which values, the minima or maxima (extremes is lows or
+        # highs) of blocks at level, first occur, by descending to the first child
+        # block that holds each value
+        blocks = np.asarray(blocks, dtype=np.int64)
+        for level in range(level, 0, -1):
+            left = 2 * blocks
+            blocks = np.where(extremes[level - 1][left] == values, left, left + 1)
+        return blocks
+
+    def query(self, start: int, stop: int, buckets: int) -> Envelope:
+        """
+        The Envelope of time points start to stop (clipped to the series) in at most
+        buckets buckets of about equal width, e.g. one per pixel of a plot. Takes time
+        proportional to buckets, not to the width of the window: each bucket is read
+        from the level whose blocks are the largest that fit in it, with its ends
+        adjusted to that level's block boundaries. The first and last buckets end
+        exactly at start and stop.
+        """
+        stop = min(int(stop), len(self.values))
+        start = max(int(start), 0)
+        if stop <= start:
+            empty = np.empty(0)
+            times = empty.astype(np.int64)
+            return Envelope(times, times, empty, empty, empty, times, times)
+        n = stop - start
+        if n <= buckets:
+            values = self.values[start:stop]
+            times = np.arange(start, stop)
+            return Envelope(
+                times, times + 1, values, values, self.sums[0][start:stop], times, times
+            )
+
+        level = min((n // buckets).bit_length() - 1, len(self.lows) - 1)
+        size = 1 << level
+        edges = start + np.arange(buckets + 1) * n // buckets
+        # Inner edges snap to the nearest block boundary. Buckets are at least one
+        # block wide, so they stay in order.
+        edges[1:-1] = (edges[1:-1] + size // 2) // size * size
+        low = np.empty(buckets, dtype=self.lows[0].dtype)
+        high = np.empty(buckets, dtype=self.highs[0].dtype)
+        total = np.empty(buckets)
+        low_at = np.empty(buckets, dtype=np.int64)
+        high_at = np.empty(buckets, dtype=np.int64)
+        for bucket in (0, buckets - 1):
+            (
+                low[bucket],
+                high[bucket],
+                total[bucket],
+                low_at[bucket],
+                high_at[bucket],
+            ) = self._range(edges[bucket], edges[bucket + 1])
+        if buckets > 2:
+            blocks = edges[1:-1] // size
+            first, last = blocks[0], blocks[-1]
+            offsets = blocks[:-1] - first
+            lows = self.lows[level][first:last]
+            highs = self.highs[level][first:last]
+            low[1:-1] = np.fmin.reduceat(lows, offsets)
+            high[1:-1] = np.fmax.reduceat(highs, offsets)
+            total[1:-1] = np.add.reduceat(self.sums[level][first:last], offsets)
+            # The first block of each bucket that holds its minimum and maximum (its
+            # first block if it is all NaN), and then the time point within it
+            widths = np.diff(blocks)
+            indices = np.arange(first, last)
+            for extremes, values, at, block_values in (
+                (self.lows, low[1:-1], low_at, lows),
+                (self.highs, high[1:-1], high_at, highs),
+            ):
+                hits = np.where(
+                    block_values == np.repeat(values, widths), indices, last
+                )
+                found = np.minimum.reduceat(hits, offsets)
+                found = np.where(found == last, blocks[:-1], found)
+                at[1:-1] = self._locate(extremes, level, found, values)
+        return Envelope(
+            edges[:-1], edges[1:], low, high, total / np.diff(edges), low_at, high_at
+        )
+
+
+class TraceIndex:
+    def __init__(self, series: dict):
+        """
+        Pyramids (see Pyramid) of a run's concentration, habit, effect, and desperation,
+        by name, for fast queries of windows of its traces at any resolution.
+
+            index = TraceIndex.from_person(person)
+            envelopes = index.window(start_day=100, duration=30, buckets=1_000)
+            envelopes["concentration"].high
+
+        Build it once per run and reuse it for every query, e.g. every zoomed plot.
+        """
+        self.series = {name: Pyramid(values) for name, values in series.items()}
+
+    @classmethod
+    def from_person(cls, person: Person):
+        """
+        The index of a simulated person's traces.
+        """
+        return cls({name: getattr(person, name).values for name in SERIES})
+
+    @classmethod
+    def from_archive(cls, archive: TraceArchive, run: int):
+        """
+        The index of a run of a trace archive. Its memory-mapped traces are read once
+        to build the pyramids, and queries at full resolution read from the archive.
+        """
+        record = archive.run(run)
+        return cls({name: record[name] for name in SERIES})
+
+    def __getitem__(self, name: str) -> Pyramid:
+        return self.series[name]
+
+    def window(
+        self, start_day: float = 0, duration: float = None, buckets: int = 1_000
+    ):
+        """
+        The Envelope of every series from start_day for duration days (to the end of
+        the run by default), in at most buckets buckets.
+        """
+        start = int(start_day * 100)
+        stop = None if duration is None else start + int(duration * 100)
+        return {
+            name: pyramid.query(start, len(pyramid) if stop is None else stop, buckets)
+            for name, pyramid in self.series.items()
+        }
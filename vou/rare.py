@@ -0,0 +1,194 @@
+from vou.batch import build_simulation, map_chunks, task_seed
+from vou.constants import Constants
+from vou.person import Person
+from vou.streams import RandomStreams, PURPOSES
+from vou.summary import Summary
+from vou.utils import logistic
+
+from inspect import signature
+from typing import Mapping, NamedTuple
+import math
+
+import numpy as np
+
+
+OVERDOSE_RISK = signature(Person.did_overdose).parameters
+
+
+class ForcedOverdoseStream:
+    __slots__ = ("stream", "forced", "calls")
+
+    def __init__(self, stream, forced: int = None):
+        """
+        Wraps the overdose stream of a run to control its overdose checks. Until the
+        first overdose, the overdose stream is only drawn from to check whether a dose
+        caused an overdose, once per dose. Each check still draws from stream, so the
+        rest of the run is unchanged, but the check of the dose with index forced
+        returns 0 (an overdose) and every earlier check returns 1 (no overdose). With
+        forced=None, the run has no overdoses at all. Draws after the forced overdose
+        (e.g. the pause in use it causes) come from stream unchanged.
+        """
+        self.stream = stream
+        self.forced = forced
+        self.calls = 0
+
+    def random(self):
+        u = self.stream.random()
+        call = self.calls
+        self.calls = call + 1
+        if self.forced is None or call < self.forced:
+            return 1.0
+        if call == self.forced:
+            return 0.0
+        return u
+
+    def uniform(self, a: float, b: float):
+        return a + (b - a) * self.random()
+
+
+class RareEstimate(NamedTuple):
+    """
+    An estimate of the probability of an event within a run, with its standard error.
+    relative_error is the standard error divided by the probability. hits is the
+    number of replications in which the event occurred after the forced overdose.
+    """
+
+    probability: float
+    standard_error: float
+    relative_error: float
+    hits: int
+    replications: int
+
+
+def fatal_overdose(summary: Summary):
+    return summary.fatal_overdose is not None
+
+
+def non_fatal_overdose(summary: Summary):
+    return len(summary.overdoses) > (summary.fatal_overdose is not None)
+
+
+def any_overdose(summary: Summary):
+    return bool(summary.overdoses)
+
+
+EVENTS = {
+    "fatal_overdose": fatal_overdose,
+    "non_fatal_overdose": non_fatal_overdose,
+    "any_overdose": any_overdose,
+}
+
+
+def overdose_risks(
+    person: Person,
+    x0: float = OVERDOSE_RISK["x0"].default,
+    k: float = OVERDOSE_RISK["k"].default,
+):
+    """
+    The probability of an overdose after each dose a person took, as computed by
+    Person.did_overdose(), from their traces.
+    """
+    times = np.asarray(person.took_dose, dtype=np.int64)
+    dose = np.asarray(person.concentration)[times]
+    tolerance = np.maximum(1, np.asarray(person.habit)[times])
+    baseline_OD_risk = logistic(x=dose, L=1, k=k, x0=x0)
+    excess = ((dose / tolerance) - 1) ** 2
+    return np.minimum(1, baseline_OD_risk * excess)
+
+
+def run_conditioned(chunk: list, root: np.random.SeedSequence, params: Mapping):
+    """
+    Runs a chunk of replication indices in a worker process. Returns the probability
+    of any overdose and the Summary of the run with a forced first overdose (or None
+    if the probability is 0) of each.
+    """
+    results = []
+    for i in chunk:
+        seed = task_seed(root, i)
+        streams = RandomStreams(seed)
+        streams.overdose = ForcedOverdoseStream(streams.overdose)
+        simulation = build_simulation(dict(params, record="traces"), streams)
+        simulation.simulate()
+        # The run's overdoses were drawn with its constants' risk curve, which
+        # may be calibrated away from did_overdose()'s defaults
+        constants = simulation.constants or Constants()
+        risks = overdose_risks(simulation.person, x0=constants.OD_X0, k=constants.OD_K)
+        # Probability that the first overdose follows each dose
+        survival = np.concatenate(([1.0], np.cumprod(1 - risks)))
+        first = risks * survival[:-1]
+        probability = 1 - survival[-1]
+        if probability <= 0:
+            results.append((0.0, None))
+            continue
+
+        # Sample the dose of the first overdose and rerun with it forced. The rerun
+        # draws the same random numbers up to that dose, so it follows the same path.
+        # The choice is drawn from a child of the replication's seed after those of
+        # the RandomStreams purposes, which the model doesn't use.
+        choice = np.random.default_rng(task_seed(seed, len(PURPOSES)))
+        forced = int(choice.choice(len(first), p=first / first.sum()))
+        streams = RandomStreams(seed)
+        streams.overdose = ForcedOverdoseStream(streams.overdose, forced)
+        simulation = build_simulation(dict(params, record="summary"), streams)
+        simulation.simulate()
+        results.append((float(probability), simulation.summary))
+    return results
+
+
+def estimate_overdose_probabilities(
+    params: Mapping,
+    replications: int,
+    seed=None,
+    events: Mapping = EVENTS,
+    workers: int = None,
+    chunksize: int = 1,
+) -> dict:
+    """
+    Estimates the probability of each event (by default, a fatal overdose, a
+    non-fatal overdose, and any overdose within the simulated days) for a
+    configuration (a mapping of Person and Simulation keyword arguments, as in
+    vou.batch tasks), and returns a RareEstimate for each by name. Events must not
+    occur in runs without overdoses.
+
+        estimate_overdose_probabilities(dict(external_risk=0.1), replications=500)
+
+    For persons with a low overdose risk per dose, plain Monte Carlo needs enormous
+    numbers of runs to see any overdoses. Instead, each replication is first run with
+    every overdose check suppressed, which is the path of the run up to its first
+    overdose, and the overdose risk of each dose on that path gives the exact
+    probability p that an overdose occurs. The run is then repeated with its first
+    overdose forced at a dose sampled in proportion to the probability that the first
+    overdose follows it, and an event that occurs in that run counts as p rather than
+    1 (conditional Monte Carlo). The estimates are unbiased, every replication
+    contributes information about the event, and the variance from whether the
+    overdose occurs at all is removed. Each replication costs two runs.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    results = list(
+        map_chunks(
+            run_conditioned, range(replications), workers, chunksize, seed, params
+        )
+    )
+    estimates = {}
+    for name, event in events.items():
+        hits = np.array(
+            [summary is not None and bool(event(summary)) for _, summary in results]
+        )
+        values = np.array([probability for probability, _ in results]) * hits
+        probability = values.mean()
+        standard_error = (
+            values.std(ddof=1) / math.sqrt(replications)
+            if replications > 1
+            else math.inf
+        )
+        estimates[name] = RareEstimate(
+            probability=float(probability),
+            standard_error=float(standard_error),
+            relative_error=(
+                float(standard_error / probability) if probability else math.inf
+            ),
+            hits=int(hits.sum()),
+            replications=replications,
+        )
+    return estimates
@@ -0,0 +1,363 @@
+from vou.batch import PERSON_ARGS, SIMULATION_ARGS, iter_batch, keep_summary
+from vou.person import Person
+from vou.simulation import Simulation
+from vou.summary import OUTCOMES
+
+from inspect import signature
+from typing import Mapping, NamedTuple
+import json
+import os
+
+import numpy as np
+
+
+METHODS = ("sobol", "morris")
+
+# Ranges of the inputs that drive overdose and escalation outcomes, from the app's
+# inputs (tolerance_window isn't in the app)
+DEFAULT_RANGES = {
+    "external_risk": (0.05, 1.0),
+    "internal_risk": (0.05, 1.0),
+    "behavioral_variability": (0.0, 1.0),
+    "availability": (0.1, 1.0),
+    "counterfeit_prob": (0.0, 0.5),
+    "dose_variability": (0.1, 0.75),
+    "fentanyl_prob": (0.0, 0.5),
+    "starting_dose": (5, 200),
+    "dose_increase": (10, 50),
+    "tolerance_window": (1_000, 6_000),
+}
+
+# Arguments that are rounded to integers when sampled
+INTEGER_ARGS = frozenset(
+    name
+    for cls in (Person, Simulation)
+    for name, parameter in signature(cls).parameters.items()
+    if parameter.annotation is int
+)
+
+
+class SobolIndex(NamedTuple):
+    """
+    The first order and total Sobol indices of a parameter for an outcome, with the
+    bounds of their bootstrap confidence intervals.
+    """
+
+    first: float
+    first_low: float
+    first_high: float
+    total: float
+    total_low: float
+    total_high: float
+
+
+class MorrisIndex(NamedTuple):
+    """
+    The Morris screening measures of a parameter for an outcome: the mean, mean
+    absolute value (with the bounds of its bootstrap confidence interval), and
+    standard deviation of its elementary effects, in outcome units per parameter range.
+    """
+
+    mu: float
+    mu_star: float
+    mu_star_low: float
+    mu_star_high: float
+    sigma: float
+
+
+def sobol_design(parameters: int, samples: int, rng: np.random.Generator):
+    """
+    The Saltelli design for Sobol indices in the unit cube: matrices A and B of samples
+    random points, then for each parameter i, A with column i taken from B, stacked
+    into samples * (parameters + 2) rows.
+    """
+    a = rng.random((samples, parameters))
+    b = rng.random((samples, parameters))
+    blocks = [a, b]
+    for i in range(parameters):
+        ab = a.copy()
+        ab[:, i] = b[:, i]
+        blocks.append(ab)
+    return np.concatenate(blocks)
+
+
+def morris_design(
+    parameters: int, trajectories: int, rng: np.random.Generator, levels: int = 4
+):
+    """
+    The Morris design in the unit cube: trajectories of parameters + 1 points on a grid
+    of levels values per parameter, each point after the first moving one parameter
+    (in random order) by delta = levels / (2 * (levels - 1)), stacked into
+    trajectories * (parameters + 1) rows.
+
+    Trajectories start anywhere on the grid and each parameter moves up by delta, or
+    down if that would leave the cube, as in Morris (1991), so that elementary effects
+    are measured in both directions and from every level.
+    """
+    grid = np.arange(levels) / (levels - 1)
+    delta = levels / (2 * (levels - 1))
+    rows = []
+    for _ in range(trajectories):
+        point = rng.choice(grid, size=parameters)
+        rows.append(point.copy())
+        for i in rng.permutation(parameters):
+            point[i] += delta if point[i] + delta <= 1 + 1e-9 else -delta
+            rows.append(point.copy())
+    return np.array(rows)
+
+
+def scale_point(point: np.ndarray, ranges: Mapping, params: Mapping = None):
+    """
+    The keyword arguments for a point in the unit cube, with a coordinate per parameter
+    in ranges (in order), added to params. Integer arguments are rounded.
+    """
+    task = dict(params or {})
+    for (name, (low, high)), x in zip(ranges.items(), point):
+        value = low + x * (high - low)
+        task[name] = int(round(value)) if name in INTEGER_ARGS else float(value)
+    return task
+
+
+def bootstrap_interval(
+    statistic, n: int, resamples: int, confidence: float, rng: np.random.Generator
+):
+    """
+    The percentile bootstrap confidence interval of statistic(indices), a statistic of
+    the n samples at indices.
+    """
+    values = np.array([statistic(rng.integers(0, n, n)) for _ in range(resamples)])
+    if np.isnan(values).all():
+        return float("nan"), float("nan")
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.nanpercentile(values, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+class SensitivityAnalysis:
+    def __init__(
+        self,
+        path: str,
+        method: str = None,
+        ranges: Mapping = None,
+        samples: int = None,
+        params: Mapping = None,
+        seed: int = None,
+        outcomes: Mapping = OUTCOMES,
+    ):
+        """
+        A global sensitivity analysis of outcomes (functions of a run's Summary, see
+        vou.summary.OUTCOMES) to the parameters in ranges (a mapping of Person and
+        Simulation keyword arguments to (low, high) bounds, by default DEFAULT_RANGES).
+        Other arguments are fixed to params.
+
+        With method="sobol" (the default), samples is the number of base samples of the
+        Saltelli design, which takes samples * (parameters + 2) runs. With
+        method="morris", it is the number of trajectories, which take
+        samples * (parameters + 1) runs. It defaults to 1,000.
+
+        The analysis is checkpointed in the directory path: its settings and design
+        when created, and the outcomes of each run as it completes. Creating an analysis
+        with an existing path resumes it, and run() only runs the remaining design
+        points. Settings given when resuming must match the saved ones.
+
+            analysis = SensitivityAnalysis("sobol-study", samples=2_000)
+            analysis.run()
+            analysis.indices()["fatal_overdose"]["fentanyl_prob"]
+        """
+        self.path = path
+        self.outcomes = dict(outcomes)
+        given = {
+            "method": method,
+            "ranges": (
+                None if ranges is None else {k: list(v) for k, v in ranges.items()}
+            ),
+            "samples": samples,
+            "params": None if params is None else dict(params),
+            "seed": seed,
+        }
+        settings_file = os.path.join(path, "settings.json")
+        if os.path.exists(settings_file):
+            with open(settings_file) as f:
+                settings = json.load(f)
+            for name, value in given.items():
+                if value is not None and value != settings[name]:
+                    raise ValueError(f"{name} differs from the saved analysis")
+            if settings["outcomes"] != list(self.outcomes):
+                raise ValueError("outcomes differ from the saved analysis")
+        else:
+            defaults = {
+                "method": "sobol",
+                "ranges": {k: list(v) for k, v in DEFAULT_RANGES.items()},
+                "samples": 1_000,
+                "params": {},
+                "seed": np.random.SeedSequence().entropy,
+            }
+            settings = {
+                name: defaults[name] if value is None else value
+                for name, value in given.items()
+            }
+            settings["outcomes"] = list(self.outcomes)
+            if settings["method"] not in METHODS:
+                raise ValueError(f"method must be one of {', '.join(METHODS)}")
+            unknown = set(settings["ranges"]) - PERSON_ARGS - SIMULATION_ARGS
+            if unknown:
+                raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+            os.makedirs(path, exist_ok=True)
+            with open(settings_file, "w") as f:
+                json.dump(settings, f, indent=2)
+
+        self.method = settings["method"]
+        self.ranges = {k: tuple(v) for k, v in settings["ranges"].items()}
+        self.samples = settings["samples"]
+        self.params = settings["params"]
+        self.seed = settings["seed"]
+        self.names = list(self.ranges)
+
+        design_file = os.path.join(path, "design.npy")
+        if os.path.exists(design_file):
+            self.design = np.load(design_file)
+        else:
+            # Runs are seeded from children of the seed sequence, so the design is
+            # drawn from the root
+            rng = np.random.default_rng(np.random.SeedSequence(self.seed))
+            if self.method == "sobol":
+                self.design = sobol_design(len(self.names), self.samples, rng)
+            else:
+                self.design = morris_design(len(self.names), self.samples, rng)
+            np.save(design_file, self.design)
+        self.results_file = os.path.join(path, "results.bin")
+
+    def task(self, point: np.ndarray):
+        """
+        The batch task for a point of the design in the unit cube.
+        """
+        return scale_point(point, self.ranges, dict(self.params, record="summary"))
+
+    @property
+    def completed(self):
+        """
+        The number of design points whose outcomes have been saved.
+        """
+        if not os.path.exists(self.results_file):
+            return 0
+        row = 8 * len(self.outcomes)
+        return os.path.getsize(self.results_file) // row
+
+    def run(self, workers: int = None, chunksize: int = 1, limit: int = None):
+        """
+        Runs the remaining design points (at most limit of them) in parallel with
+        vou.batch.iter_batch(), saving the outcomes of each run as it arrives. An
+        interrupted run loses at most the runs in flight. Each design point's seed
+        depends only on the analysis seed and its position, so resuming gives the same
+        results as running without interruption.
+        """
+        start = self.completed
+        row = 8 * len(self.outcomes)
+        stop = (
+            len(self.design) if limit is None else min(len(self.design), start + limit)
+        )
+        tasks = (self.task(point) for point in self.design[start:stop])
+        results = iter_batch(
+            tasks,
+            np.random.SeedSequence(self.seed),
+            workers,
+            chunksize,
+            keep_summary,
+            start=start,
+        )
+        with open(self.results_file, "ab") as f:
+            # Drop a partially written row left by an interruption
+            f.truncate(start * row)
+            for summary in results:
+                values = [outcome(summary) for outcome in self.outcomes.values()]
+                f.write(np.array(values, dtype=np.float64).tobytes())
+                f.flush()
+        return self.completed
+
+    def results(self):
+        """
+        The saved outcomes, as an array with a row per completed design point and a
+        column per outcome.
+        """
+        if not self.completed:
+            return np.empty((0, len(self.outcomes)))
+        values = np.fromfile(self.results_file, dtype=np.float64)
+        return values[: self.completed * len(self.outcomes)].reshape(
+            -1, len(self.outcomes)
+        )
+
+    def indices(
+        self, resamples: int = 1_000, confidence: float = 0.95, seed: int = None
+    ) -> dict:
+        """
+        Computes the sensitivity indices of each parameter for each outcome, as
+        {outcome: {parameter: SobolIndex or MorrisIndex}}, with bootstrap confidence
+        intervals from resamples resamples of the base samples or trajectories.
+
+        Sobol indices use the estimators of Saltelli et al. (2010) for first order
+        indices and Jansen (1999) for total indices.
+        """
+        results = self.results()
+        if len(results) < len(self.design):
+            raise ValueError(
+                f"Only {len(results)} of {len(self.design)} design points have run"
+            )
+        rng = np.random.default_rng(seed)
+        compute = self._sobol if self.method == "sobol" else self._morris
+        return {
+            name: compute(results[:, k], resamples, confidence, rng)
+            for k, name in enumerate(self.outcomes)
+        }
+
+    def _sobol(self, y, resamples, confidence, rng):
+        n = self.samples
+        f_a, f_b = y[:n], y[n : 2 * n]
+        indices = {}
+        for i, name in enumerate(self.names):
+            f_ab = y[(i + 2) * n : (i + 3) * n]
+
+            def first(j):
+                variance = np.var(np.concatenate((f_a[j], f_b[j])))
+                return np.mean(f_b[j] * (f_ab[j] - f_a[j])) / variance
+
+            def total(j):
+                variance = np.var(np.concatenate((f_a[j], f_b[j])))
+                return 0.5 * np.mean((f_a[j] - f_ab[j]) ** 2) / variance
+
+            everything = np.arange(n)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                indices[name] = SobolIndex(
+                    float(first(everything)),
+                    *bootstrap_interval(first, n, resamples, confidence, rng),
+                    float(total(everything)),
+                    *bootstrap_interval(total, n, resamples, confidence, rng),
+                )
+        return indices
+
+    def _morris(self, y, resamples, confidence, rng):
+        steps = len(self.names) + 1
+        points = self.design.reshape(self.samples, steps, -1)
+        outcomes = y.reshape(self.samples, steps)
+        moves = np.diff(points, axis=1)
+        # The parameter moved at each step of each trajectory, and by how much
+        moved = np.abs(moves).argmax(axis=2)
+        delta = np.take_along_axis(moves, moved[..., None], axis=2)[..., 0]
+        effects = np.empty((self.samples, len(self.names)))
+        rows = np.arange(self.samples)[:, None]
+        effects[rows, moved] = np.diff(outcomes, axis=1) / delta
+        indices = {}
+        for i, name in enumerate(self.names):
+            column = effects[:, i]
+            indices[name] = MorrisIndex(
+                float(column.mean()),
+                float(np.abs(column).mean()),
+                *bootstrap_interval(
+                    lambda j: np.abs(column[j]).mean(),
+                    self.samples,
+                    resamples,
+                    confidence,
+                    rng,
+                ),
+                float(column.std(ddof=1)) if self.samples > 1 else float("nan"),
+            )
+        return indices
@@ -1,16 +1,103 @@
 from vou.person import Person, BehaviorWhenResumingUse, OverdoseType
-from vou.utils import logistic
+from vou.kernel import run_kernel
+from vou.constants import Constants
+from vou.summary import Moments, Summary
+from vou.profiling import Profiler
+from vou.streams import as_streams
+from vou.trace import Trace
+from vou.utils import logistic, exponential_decay, habit_parameters, linear_recurrence
 
 
 import math
 from random import Random
-from itertools import repeat
-from copy import copy
+from itertools import repeat, islice
+from copy import copy, deepcopy
+from typing import Iterator, NamedTuple, Optional
 
 import numpy as np
 
 
+# "fast" runs every time point through an optimized loop (see vou.kernel). "step"
+# computes every time point in turn with the Simulation and Person methods. "event"
+# jumps from one time point at which something stochastic can happen to the next (see
+# Simulation.fast_forward()).
+ENGINES = ("fast", "step", "event")
+
+# "traces" keeps every measure at every time point on the Person. "summary" only keeps
+# online aggregates of the outcomes, see Simulation.summarize().
+RECORD_MODES = ("traces", "summary")
+
+# Time points simulated at a time by default with record="summary", for which the
+# traces only hold a block (see Simulation.summarize())
+SUMMARY_BLOCK = 1_000
+
+
+class Step(NamedTuple):
+    """
+    The measures recorded at a single time point, as yielded by
+    Simulation.iter_steps(). desperation is None at the time point of a fatal
+    overdose, since the simulation ends before it is computed.
+    """
+
+    t: int
+    concentration: float
+    habit: float
+    effect: float
+    desperation: Optional[float]
+    dose_taken: bool
+    overdose: Optional[OverdoseType]
+
+
+class Block(NamedTuple):
+    """
+    The measures recorded over a block of time points starting at start, as yielded by
+    Simulation.iter_blocks(). The series are arrays with one value per time point
+    (desperation lacks the last one if the block ends in a fatal overdose). doses and
+    overdoses are the time points in the block at which a dose was taken or an overdose
+    occurred.
+    """
+
+    start: int
+    concentration: np.ndarray
+    habit: np.ndarray
+    effect: np.ndarray
+    desperation: np.ndarray
+    doses: list
+    overdoses: list
+    fatal: bool
+
+
 class Simulation:
+    __slots__ = (
+        "person",
+        "rng",
+        "streams",
+        "days",
+        "stop_use_time",
+        "resume_use_time",
+        "dose_variability",
+        "availability",
+        "fentanyl_prob",
+        "counterfeit_prob",
+        "trace_dtype",
+        "engine",
+        "record",
+        "summary",
+        "profiler",
+        "constants",
+        "t",
+        "time_since_dose",
+        "last_amount_taken",
+        "total_amount_taken",
+        "conc_when_dose_taken",
+        "dose_taken_at_t",
+        "opioid_available",
+        "integralA",
+        "integralB",
+        "integralC",
+        "integralD",
+    )
+
     def __init__(
         self,
         person: Person,
@@ -22,10 +109,17 @@ class Simulation:
         availability: float = 0.9,
         fentanyl_prob: float = 0.0001,
         counterfeit_prob: float = 0.1,
+        trace_dtype=np.float64,
+        engine: str = "fast",
+        record: str = "traces",
+        profile: bool = False,
+        constants: Constants = None,
     ):
         # Parameters
         self.person = person
         self.rng = rng
+        # rng may also be a RandomStreams, with an independent substream per purpose
+        self.streams = as_streams(rng)
         self.days = days
         self.stop_use_time = None if stop_use_day is None else stop_use_day * 100
         self.resume_use_time = None if resume_use_day is None else resume_use_day * 100
@@ -33,19 +127,52 @@ class Simulation:
         self.availability = availability
         self.fentanyl_prob = fentanyl_prob
         self.counterfeit_prob = counterfeit_prob
+        self.trace_dtype = trace_dtype
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}, not {engine!r}")
+        self.engine = engine
+        if record not in RECORD_MODES:
+            raise ValueError(f"record must be one of {RECORD_MODES}, not {record!r}")
+        self.record = record
+        self.summary = None
+        # Per-phase timings and counters, see vou.profiling. Profiling runs every time
+        # point through profiled_step(), even with the "fast" engine, since its fused
+        # loop has no phases to measure.
+        self.profiler = Profiler() if profile else None
+        # Calibrated constants other than the defaults (see vou.constants) are passed to
+        # the "fast" engine's kernel, so only that engine supports them
+        if constants is not None and (engine != "fast" or profile):
+            raise ValueError(
+                "constants are only supported by the 'fast' engine without profiling"
+            )
+        self.constants = constants
 
-        # Variables used in simulation
+        # Variables used in simulation. t is the next time point to simulate.
+        self.t = 0
         self.time_since_dose = 0
         self.last_amount_taken = 0
+        self.total_amount_taken = 0
         self.conc_when_dose_taken = 0
         self.dose_taken_at_t = False
         self.opioid_available = True
-        self.integralA = [0]
-        self.integralB = [0]
-        self.integralC = [0]
-        self.integralD = [0]
-
-    def simulate(self):
+        # Traces are preallocated for the whole simulation, or with record="summary",
+        # which discards them after each block, for a block and the two values kept
+        capacity = self.days * 100 if record == "traces" else SUMMARY_BLOCK + 2
+        self.integralA = Trace(capacity + 1, trace_dtype)
+        self.integralB = Trace(capacity + 1, trace_dtype)
+        self.integralC = Trace(capacity + 1, trace_dtype)
+        self.integralD = Trace(capacity + 1, trace_dtype)
+        for integral in self.traces()[4:]:
+            integral.append(0)
+
+        # trace_dtype may be set to np.float32 to nearly halve the traces' memory use.
+        # Habit is always stored at full precision, since lower_dose_after_pause() reads
+        # its maximum.
+        for trace in self.traces()[:4]:
+            dtype = np.float64 if trace is self.person.habit else trace_dtype
+            trace.reserve(capacity, dtype)
+
+    def simulate(self, until_day: int = None):
         """
         The main function to conduct a simulation. Simulates the opioid use behavior of a
         single person. The simulation loops through time points (100 time points per day,
@@ -53,62 +180,554 @@ class Simulation:
         several steps at each time point to simulate the person's opioid use behavior.
         Records the key measures (opioid concentration, habit, effect, desperation, and
         overdoses) over time.
+
+        If until_day is given, the simulation stops before that day, and a later call
+        continues from there (see fork()). A fatal overdose ends the simulation.
+
+        The "fast" engine (the default) conducts the same steps as step() in an
+        optimized loop, see vou.kernel.run_kernel(), and gives identical results.
+
+        With the "event" engine, stretches of time points in which nothing stochastic
+        can happen are advanced in vectorized blocks by fast_forward(), and step() is
+        only called at time points where the person could take a dose. It draws the
+        same random numbers at the same time points as the other engines, so it produces
+        the same trajectories, up to floating-point rounding in the vectorized blocks.
+
+        With record="summary", the traces are not kept and the outcomes are stored as a
+        Summary in the summary attribute instead, see summarize().
+        """
+        if self.record == "summary":
+            self.summary = self.summarize()
+            return
+        end = self.days * 100
+        stop = end if until_day is None else min(until_day * 100, end)
+        if self.t < stop and self.run(self.t, stop) is OverdoseType.FATAL:
+            # The simulation ended early due to a fatal overdose
+            for trace in self.traces():
+                trace.trim()
+
+    def run(self, t: int, end: int):
+        """
+        Runs the time points from t up to end with the simulation's engine. Returns
+        OverdoseType.FATAL if the person suffered a fatal overdose, which ends the
+        simulation.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            return self.run_profiled(t, end)
+        outcome = None
+        if self.engine == "fast":
+            if self.constants is None:
+                outcome = run_kernel(self, t, end)
+            else:
+                outcome = run_kernel(self, t, end, **self.constants._asdict())
+        elif self.engine == "event":
+            while t < end:
+                skipped = self.fast_forward(t, end)
+                if skipped:
+                    t += skipped
+                elif self.step(t) is OverdoseType.FATAL:
+                    outcome = OverdoseType.FATAL
+                    break
+                else:
+                    t += 1
+        else:
+            for t in range(t, end):
+                if self.step(t) is OverdoseType.FATAL:
+                    outcome = OverdoseType.FATAL
+                    break
+        self.t = self.days * 100 if outcome is OverdoseType.FATAL else end
+        return outcome
+
+    def run_profiled(self, t: int, end: int):
+        """
+        Runs the time points from t up to end like run(), through profiled_step() and,
+        with the "event" engine, fast_forward(), and adds the time spent in each phase
+        and the counters to the profiler.
+        """
+        profiler = self.profiler
+        person = self.person
+        counters = profiler.counters
+        start = t
+        doses = len(person.took_dose)
+        dose_increases = person.dose_increases
+        overdoses = len(person.overdoses)
+        # The person and the simulation may have their own streams
+        streams, person_streams = self.streams, person.streams
+        self.streams = profiler.count(streams)
+        if person_streams is streams:
+            person.streams = self.streams
+        else:
+            person.streams = profiler.count(person_streams)
+        outcome = None
+        try:
+            while t < end:
+                if self.engine == "event":
+                    profiler.start()
+                    skipped = self.fast_forward(t, end)
+                    if skipped:
+                        profiler.lap("fast_forward")
+                        t += skipped
+                        continue
+                if self.profiled_step(t) is OverdoseType.FATAL:
+                    outcome = OverdoseType.FATAL
+                    t += 1
+                    break
+                t += 1
+        finally:
+            self.streams, person.streams = streams, person_streams
+        counters["time_points"] += t - start
+        counters["doses"] += len(person.took_dose) - doses
+        counters["dose_increases"] += person.dose_increases - dose_increases
+        counters["overdoses"] += len(person.overdoses) - overdoses
+        self.t = self.days * 100 if outcome is OverdoseType.FATAL else end
+        return outcome
+
+    def iter_steps(self, keep_history: bool = True) -> Iterator[Step]:
+        """
+        Simulates the person's opioid use one time point at a time, like simulate(),
+        and yields a Step record for each time point. Stops after the last day or a
+        fatal overdose, or whenever the consumer stops iterating.
+
+        Every time point goes through step(), whatever the engine, unless the
+        simulation has calibrated constants, which only the "fast" engine's kernel
+        supports: then every time point goes through run(). With keep_history=False,
+        the person's traces are cut back once a day with discard_history(), so the
+        simulation runs in constant memory and results are only available through the
+        yielded records.
+        """
+        person = self.person
+        overdoses = person.overdoses
+        for t in range(self.t, self.days * 100):
+            n_overdoses = len(overdoses)
+            if self.constants is None:
+                outcome = self.step(t)
+                self.t = self.days * 100 if outcome is OverdoseType.FATAL else t + 1
+            else:
+                outcome = self.run(t, t + 1)
+            overdose = None
+            if len(overdoses) > n_overdoses:
+                overdose = outcome or OverdoseType.NON_FATAL
+            yield Step(
+                t,
+                person.concentration.last,
+                person.habit.last,
+                person.effect.last,
+                None if outcome is OverdoseType.FATAL else person.desperation.last,
+                self.dose_taken_at_t,
+                overdose,
+            )
+            if outcome is OverdoseType.FATAL:
+                return
+            if not keep_history and t % 100 == 99:
+                self.discard_history()
+
+    def iter_blocks(
+        self, size: int = 100, keep_history: bool = True
+    ) -> Iterator[Block]:
+        """
+        Simulates the person's opioid use in blocks of size time points with the
+        simulation's engine, and yields a Block record for each. Stops after the last
+        day or a fatal overdose, or whenever the consumer stops iterating.
+
+        The series in each record are views of the person's traces. With
+        keep_history=False, the traces are cut back with discard_history() after each
+        block, so the simulation runs in constant memory, but each record's series are
+        only valid until the next block is requested.
+        """
+        person = self.person
+        end = self.days * 100
+        for start in range(self.t, end, size):
+            n_doses = len(person.took_dose)
+            n_overdoses = len(person.overdoses)
+            fatal = self.run(start, min(start + size, end)) is OverdoseType.FATAL
+            first = start - person.concentration.discarded
+            yield Block(
+                start,
+                person.concentration.values[first:],
+                person.habit.values[first:],
+                person.effect.values[first:],
+                person.desperation.values[first:],
+                person.took_dose[n_doses:],
+                person.overdoses[n_overdoses:],
+                fatal,
+            )
+            if fatal:
+                return
+            if not keep_history:
+                self.discard_history()
+
+    def summarize(self, block: int = SUMMARY_BLOCK) -> Summary:
+        """
+        Simulates the person's opioid use in blocks of time points without keeping
+        history (see iter_blocks()), and returns a Summary of the outcomes, updated
+        online as each block is simulated. A Summary is small and cheap to pickle, which
+        makes it a good result to send back from worker processes.
+
+        Opioids are available on a day exactly when the person takes a dose at its first
+        time point (see step()), so days without availability are counted from the
+        doses taken.
+        """
+        person = self.person
+        moments = [Moments() for _ in range(4)]
+        start = self.t
+        doses_taken = 0
+        days_available = 0
+        fatal_overdose = None
+        for record in self.iter_blocks(block, keep_history=False):
+            series = (
+                record.concentration,
+                record.habit,
+                record.effect,
+                record.desperation,
+            )
+            for measure, values in zip(moments, series):
+                measure.update(values)
+            doses_taken += len(record.doses)
+            days_available += sum(1 for t in record.doses if t % 100 == 0)
+            if record.fatal:
+                fatal_overdose = person.overdoses[-1]
+        time_points = moments[0].count
+        days = (start % 100 + time_points + 99) // 100
+        days_unavailable = days - days_available
+        return Summary(
+            days=days,
+            overdoses=tuple(person.overdoses),
+            fatal_overdose=fatal_overdose,
+            doses_taken=doses_taken,
+            total_amount_taken=self.total_amount_taken,
+            final_dose=person.dose,
+            peak_dose=person.peak_dose,
+            dose_increases=person.dose_increases,
+            days_unavailable=days_unavailable,
+            concentration=moments[0],
+            habit=moments[1],
+            effect=moments[2],
+            desperation=moments[3],
+        )
+
+    def snapshot(self):
+        """
+        Returns a copy of the simulation's full state, including the person's state and
+        traces and the random number generator, which can be continued independently.
+        """
+        return deepcopy(self)
+
+    def fork(self, **changes):
+        """
+        Returns a snapshot of the simulation with some parameters changed, to continue
+        a simulation from the current time point under several scenarios (e.g.
+        different stop_use_day, resume_use_day, or behavior_when_resuming_use) while
+        only simulating the shared history once:
+
+            simulation.simulate(until_day=360)
+            scenarios = [simulation.fork(stop_use_day=day) for day in (360, 400)]
+            for scenario in scenarios:
+                scenario.simulate()
+
+        Simulation parameters and the person's behavior_when_resuming_use,
+        behavioral_variability, dose_increase, external_risk, and internal_risk can be
+        changed. Changes only affect the time points not yet simulated.
+        """
+        simulation = self.snapshot()
+        person = simulation.person
+        for name, value in changes.items():
+            if name in ("stop_use_day", "resume_use_day"):
+                time = None if value is None else value * 100
+                setattr(simulation, name.replace("day", "time"), time)
+            elif name in (
+                "days",
+                "dose_variability",
+                "availability",
+                "fentanyl_prob",
+                "counterfeit_prob",
+            ):
+                setattr(simulation, name, value)
+            elif name in (
+                "behavior_when_resuming_use",
+                "behavioral_variability",
+                "dose_increase",
+                "external_risk",
+                "internal_risk",
+            ):
+                setattr(person, name, value)
+                if name.endswith("risk"):
+                    person.update_downward_pressure()
+                    person.set_risk_logit()
+            else:
+                raise ValueError(f"{name} can't be changed in a fork")
+        if simulation.days * 100 < simulation.t:
+            raise ValueError("days can't end before the current time point")
+        return simulation
+
+    def discard_history(self):
+        """
+        Drops the recorded history that the model no longer needs to continue the
+        simulation: all but the two most recent values of every trace (see
+        Trace.discard()), and the times at which doses were taken.
+        """
+        for trace in self.traces():
+            trace.discard()
+        self.person.took_dose.clear()
+
+    def step(self, t: int):
+        """
+        Conducts every step of a single time point. Returns OverdoseType.FATAL if the
+        person suffered a fatal overdose at t, which ends the simulation.
+        """
+        if self.profiler is not None:
+            return self.profiled_step(t)
+        # Reset dose taken indicator for next iteration
+        self.dose_taken_at_t = False
+
+        # Add to time since last dose
+        self.time_since_dose += 1
+
+        # Compute the person's concentration of opioid using pharmacokinetic model
+        conc = self.compute_concentration()
+        self.person.concentration.append(conc)
+
+        # Add concentration to tolerance input
+        self.person.tolerance_input_sum -= self.person.tolerance_input.popleft()
+        self.person.tolerance_input_sum += conc
+        self.person.tolerance_input.append(conc)
+
+        # Update opioid availability
+        self.update_availability(t)
+
+        # Check if the person will take another dose
+        if self.opioid_available is True:
+            # if self.person.will_take_dose(t) is True:
+            if self.person.will_take_dose(t) is True or t % 100 == 0:
+                self.record_dose_taken(t)
+
+        # Compute the person's opioid use habit at t
+        self.person.habit.append(self.compute_habit(t))
+
+        # Compute the opioid's effect on the person (concentration - habit)
+        self.person.effect.append(self.compute_effect())
+
+        # Now that effect has been calculated, conduct other steps that happen
+        # each time the person takes a dose.
+        if self.dose_taken_at_t is True:
+            # Check for overdose.
+            if self.person.did_overdose() is True:
+                overdose = self.person.overdose(t)
+                if overdose == OverdoseType.FATAL:
+                    return overdose
+            # Record the dose's effect (to be used in determining when the person
+            # increases their dose.)
+            self.person.record_dose_effect(t, self.person.effect.last)
+            # Check if the person will increase their dose.
+            if self.person.will_increase_dose():
+                self.person.increase_dose(t)
+
+        # Compute the person's threshold and desperation
+        # First, compute integrals of concentration to be used in calculating
+        # threshold and desperation
+        self.compute_concentration_integrals()
+        # Next, compute the person's desperation at t
+        self.person.desperation.append(self.compute_desperation())
+        # Finally, update the person's threshold for the next iteration
+        self.person.threshold = self.compute_threshold()
+
+    def profiled_step(self, t: int):
+        """
+        Conducts the same steps as step(), timing each phase with the profiler.
         """
-        for t in range(self.days * 100):
-
-            # Reset dose taken indicator for next iteration
-            self.dose_taken_at_t = False
-
-            # Add to time since last dose
-            self.time_since_dose += 1
-
-            # Compute the person's concentration of opioid using pharmacokinetic model
-            conc = self.compute_concentration()
-            self.person.concentration.append(conc)
-
-            # Add concentration to tolerance input
-            self.person.tolerance_input_sum -= self.person.tolerance_input.popleft()
-            self.person.tolerance_input_sum += conc
-            self.person.tolerance_input.append(conc)
-
-            # Update opioid availability
-            self.update_availability(t)
-
-            # Check if the person will take another dose
-            if self.opioid_available is True:
-                # if self.person.will_take_dose(t) is True:
-                if self.person.will_take_dose(t) is True or t % 100 == 0:
-                    self.record_dose_taken(t)
-
-            # Compute the person's opioid use habit at t
-            self.person.habit.append(self.compute_habit(t))
-
-            # Compute the opioid's effect on the person (concentration - habit)
-            self.person.effect.append(self.compute_effect())
-
-            # Now that effect has been calculated, conduct other steps that happen
-            # each time the person takes a dose.
-            if self.dose_taken_at_t is True:
-                # Check for overdose.
-                if self.person.did_overdose() is True:
-                    overdose = self.person.overdose(t)
-                    if overdose == OverdoseType.FATAL:
-                        break
-                # Store effect in a dict of effects at time of taking doses (to be
-                # used in determining when the person increases their dose.)
-                self.person.effect_record[t] = self.person.effect[-1]
-                # Check if the person will increase their dose.
-                if self.person.will_increase_dose():
-                    self.person.increase_dose(t)
-
-            # Compute the person's threshold and desperation
-            # First, compute integrals of concentration to be used in calculating
-            # threshold and desperation
-            self.compute_concentration_integrals()
-            # Next, compute the person's desperation at t
-            self.person.desperation.append(self.compute_desperation())
-            # Finally, update the person's threshold for the next iteration
-            self.person.threshold = self.compute_threshold()
+        profiler = self.profiler
+        person = self.person
+        profiler.start()
+
+        self.dose_taken_at_t = False
+        self.time_since_dose += 1
+        conc = self.compute_concentration()
+        person.concentration.append(conc)
+        person.tolerance_input_sum -= person.tolerance_input.popleft()
+        person.tolerance_input_sum += conc
+        person.tolerance_input.append(conc)
+        profiler.lap("concentration")
+
+        self.update_availability(t)
+        profiler.lap("availability")
+
+        if self.opioid_available is True:
+            wants_dose = person.will_take_dose(t)
+            profiler.lap("will_take_dose")
+            if wants_dose is True or t % 100 == 0:
+                self.record_dose_taken(t)
+                profiler.lap("record_dose")
+
+        person.habit.append(self.compute_habit(t))
+        profiler.lap("habit")
+
+        person.effect.append(self.compute_effect())
+        profiler.lap("effect")
+
+        if self.dose_taken_at_t is True:
+            if person.did_overdose() is True:
+                overdose = person.overdose(t)
+                profiler.lap("overdose")
+                if overdose == OverdoseType.FATAL:
+                    return overdose
+            else:
+                profiler.lap("overdose")
+            person.record_dose_effect(t, person.effect.last)
+            if person.will_increase_dose():
+                person.increase_dose(t)
+            profiler.lap("will_increase_dose")
+
+        self.compute_concentration_integrals()
+        profiler.lap("integrals")
+
+        person.desperation.append(self.compute_desperation())
+        profiler.lap("desperation")
+
+        person.threshold = self.compute_threshold()
+        profiler.lap("threshold")
+
+    def fast_forward(
+        self,
+        t: int,
+        end: int,
+        k: float = 0.0594,
+        conc_multiplier: int = 1.85,
+        L1: float = 1.0275,
+        L2: float = 0.58,
+        K1: float = 0.2,
+        K2: float = 0.0002,
+        X1: float = 0.175,
+        ALPHA1=0.99,
+        BETA1=1,
+        ALPHA2=0.999,
+        BETA2=2000,
+        ALPHA3=0.9998,
+        BETA3=15000,
+        ALPHA4=0.99995,
+        BETA4=10000,
+        B1=0.001,
+        B2=0.01,
+        B3=0.5,
+    ):
+        """
+        Advances the simulation from t through the following time points at which
+        nothing stochastic can happen, and returns the number of time points advanced.
+        Returns zero if the person could take a dose at t.
+
+        Outside of the daily availability draw (every 100 time points), the only random
+        draw at a time point is the downward pressure check in Person.will_take_dose(),
+        which only happens if opioids are available, the person isn't pausing use after
+        an overdose, and their concentration is at or below their threshold. Until then,
+        concentration decays exponentially, the integrals follow linear recurrences, and
+        habit, effect, desperation, and threshold follow from those, so the whole
+        stretch up to the next day can be computed with array operations.
+
+        The calibrated parameters are the same as those of compute_concentration(),
+        compute_habit(), compute_concentration_integrals(), and compute_threshold().
+        """
+        if t % 100 == 0:
+            return 0
+        person = self.person
+        may_use = self.opioid_available
+        pause_end = 0
+        if person.overdoses:
+            pause_end = person.overdoses[-1] + person.post_OD_use_pause
+        amount = self.conc_when_dose_taken + self.last_amount_taken
+        decay = exponential_decay(k, self.days * 100 + 1)
+
+        # Check t on its own first, since the person often keeps wanting a dose for
+        # several time points before downward pressure lets them take one.
+        if may_use and t >= pause_end:
+            if amount * decay[self.time_since_dose + 1] <= person.threshold:
+                return 0
+
+        # Compute the rest of the day as if no dose will be taken
+        n = min(end, t - t % 100 + 100) - t
+        time_since_dose = self.time_since_dose + 1
+        decay = decay[time_since_dose : time_since_dose + n]
+        conc = amount * decay
+
+        integralA = linear_recurrence(ALPHA1, self.integralA.last, BETA1 * conc)
+        integralB = linear_recurrence(ALPHA2, self.integralB.last, integralA / BETA2)
+        integralC = linear_recurrence(ALPHA3, self.integralC.last, integralB / BETA3)
+        integralD = linear_recurrence(ALPHA4, self.integralD.last, integralC / BETA4)
+
+        threshold = (B1 * integralB + B2 * integralC) / (1 + B3 * integralA)
+        if not -5 < person.risk_logit < 5:
+            if person.risk_logit < 0:
+                threshold = threshold / abs(person.risk_logit)
+            else:
+                threshold = threshold * person.risk_logit
+        previous_threshold = np.concatenate(([person.threshold], threshold[:-1]))
+
+        # Stop at the first time point at which the person could take a dose
+        if may_use:
+            wants_dose = conc <= previous_threshold
+            if pause_end > t:
+                wants_dose &= np.arange(t, t + n) >= pause_end
+            candidates = np.flatnonzero(wants_dose)
+            if candidates.size:
+                n = candidates[0]
+                if n == 0:
+                    return 0
+                conc = conc[:n]
+                decay = decay[:n]
+                integralA = integralA[:n]
+                integralB = integralB[:n]
+                integralC = integralC[:n]
+                integralD = integralD[:n]
+                threshold = threshold[:n]
+                previous_threshold = previous_threshold[:n]
+
+        # Add concentrations to tolerance input. Each pushes out the oldest input of the
+        # window, which is the block's own earlier input once the window is shorter
+        # than the block.
+        queued = min(n, person.tolerance_window)
+        removed = np.fromiter(islice(person.tolerance_input, queued), float, queued)
+        if queued < n:
+            removed = np.concatenate((removed, conc[: n - queued]))
+        tolerance_input_sum = person.tolerance_input_sum + np.cumsum(conc - removed)
+        person.tolerance_input.extend(conc.tolist())
+        person.tolerance_input_sum = tolerance_input_sum.item(-1)
+
+        rolling_concentration = (
+            tolerance_input_sum / person.tolerance_window
+        ) * conc_multiplier
+        L, k, x0 = habit_parameters(person.dose, L1, L2, K1, K2, X1)
+        habit = logistic(x=rolling_concentration, L=L, k=k, x0=x0)
+        effect = np.maximum((amount - habit) * decay, 0)
+        desperation = np.maximum(
+            integralD * (previous_threshold - conc) / (conc + 1), 0
+        )
+
+        person.concentration.extend(conc)
+        person.habit.extend(habit)
+        person.effect.extend(effect)
+        person.desperation.extend(desperation)
+        self.integralA.extend(integralA)
+        self.integralB.extend(integralB)
+        self.integralC.extend(integralC)
+        self.integralD.extend(integralD)
+        person.threshold = threshold.item(-1)
+        self.time_since_dose += n
+        self.dose_taken_at_t = False
+        return n
+
+    def traces(self):
+        """
+        Returns every trace recorded during the simulation: the person's concentration,
+        habit, effect, and desperation, followed by integrals A-D.
+        """
+        return (
+            self.person.concentration,
+            self.person.habit,
+            self.person.effect,
+            self.person.desperation,
+            self.integralA,
+            self.integralB,
+            self.integralC,
+            self.integralD,
+        )
 
     def compute_concentration(
         self, k: float = 0.0594,
@@ -142,10 +761,9 @@ class Simulation:
         
         k is a calibrated parameter. See docstring for compute_concentration for details.
         """
+        amount = self.conc_when_dose_taken + self.last_amount_taken
         return max(
-            (self.conc_when_dose_taken + self.last_amount_taken - self.person.habit[-1])
-            * math.exp(-k * self.time_since_dose),
-            0,
+            (amount - self.person.habit.last) * math.exp(-k * self.time_since_dose), 0,
         )
 
     def update_availability(self, t: int):
@@ -164,12 +782,12 @@ class Simulation:
         """
         # Step 1
         if t % 100 == 0:
-            rand = self.rng.random()
+            rand = self.streams.availability.random()
             # Adjust availability by desperation - more desperate user seeks drug
             # more aggressively.
             if self.person.desperation:
-                if self.person.desperation[-2] > 1:
-                    rand = rand / self.person.desperation[-2]
+                if self.person.desperation.previous > 1:
+                    rand = rand / self.person.desperation.previous
             if rand < self.availability:
                 self.opioid_available = True
             else:
@@ -200,11 +818,12 @@ class Simulation:
         self.person.took_dose.append(t)
         # Update the variable storing the person's concentration when the dose was
         # taken to be used for later concentration calculations.
-        self.conc_when_dose_taken = self.person.concentration[-1]
+        self.conc_when_dose_taken = self.person.concentration.last
         # Reset the time since dose indicator to zero for concentration calculations.
         self.time_since_dose = 0
         # Update the variable storing the last amount taken for concentration calcs.
         self.last_amount_taken = self.compute_amount_taken()
+        self.total_amount_taken += self.last_amount_taken
         # Recalculate the person's concentration for this time step
         new_conc = self.compute_concentration()
         self.person.concentration[-1] = new_conc
@@ -235,18 +854,21 @@ class Simulation:
         1 + a random draw from an exponential distribution with mean 0.25 (the 
         lambd parameter in random.expovariate is 1 divided by the mean).
         """
-        modified_dose = self.person.dose * self.rng.uniform(
+        streams = self.streams
+        modified_dose = self.person.dose * streams.dose.uniform(
             1 - self.person.behavioral_variability,
             1 + self.person.behavioral_variability,
         )
 
-        if self.rng.random() < self.counterfeit_prob:
+        if streams.counterfeit.random() < self.counterfeit_prob:
 
-            modified_dose = modified_dose * self.rng.uniform(
+            modified_dose = modified_dose * streams.dose.uniform(
                 1 - self.dose_variability, 1 + self.dose_variability
             )
-            if self.rng.random() < self.fentanyl_prob:
-                modified_dose = modified_dose * (1 + self.rng.expovariate(1 / 0.25))
+            if streams.counterfeit.random() < self.fentanyl_prob:
+                modified_dose = modified_dose * (
+                    1 + streams.counterfeit.expovariate(1 / 0.25)
+                )
 
         return modified_dose
 
@@ -300,12 +922,10 @@ class Simulation:
         # X1 is a calibrated parameter used to vary the rolling concentration value at the
         # logistic curve's midpoint by dose. This allows us to obtain a similarly-shaped
         # curve at a wide range of doses.
-        return logistic(
-            x=rolling_concentration,
-            L=(self.person.dose ** L1) * L2,
-            k=K1 - (self.person.dose * K2),
-            x0=self.person.dose * X1,
-        )
+        #
+        # These parameters only change with dose, so they are cached by dose.
+        L, k, x0 = habit_parameters(self.person.dose, L1, L2, K1, K2, X1)
+        return logistic(x=rolling_concentration, L=L, k=k, x0=x0)
 
     def compute_concentration_integrals(
         self,
@@ -331,11 +951,17 @@ class Simulation:
         during simulation.
         """
         self.integralA.append(
-            ALPHA1 * self.integralA[-1] + BETA1 * self.person.concentration[-1]
+            ALPHA1 * self.integralA.last + BETA1 * self.person.concentration.last
+        )
+        self.integralB.append(
+            ALPHA2 * self.integralB.last + self.integralA.last / BETA2
+        )
+        self.integralC.append(
+            ALPHA3 * self.integralC.last + self.integralB.last / BETA3
+        )
+        self.integralD.append(
+            ALPHA4 * self.integralD.last + self.integralC.last / BETA4
         )
-        self.integralB.append(ALPHA2 * self.integralB[-1] + self.integralA[-1] / BETA2)
-        self.integralC.append(ALPHA3 * self.integralC[-1] + self.integralB[-1] / BETA3)
-        self.integralD.append(ALPHA4 * self.integralD[-1] + self.integralC[-1] / BETA4)
 
     def compute_threshold(
         self, B1=0.001, B2=0.01, B3=0.5,
@@ -350,14 +976,14 @@ class Simulation:
 
         The threshold is then adjusted by the person's risk logit.
         """
-        thresh = (B1 * self.integralB[-1] + B2 * self.integralC[-1]) / (
-            1 + B3 * self.integralA[-1]
+        thresh = (B1 * self.integralB.last + B2 * self.integralC.last) / (
+            1 + B3 * self.integralA.last
         )
         if -5 < self.person.risk_logit < 5:
             return thresh
         else:
             if self.person.risk_logit < 0:
-                return thresh / np.abs(self.person.risk_logit)
+                return thresh / abs(self.person.risk_logit)
             else:
                 return thresh * self.person.risk_logit
 
@@ -374,9 +1000,9 @@ class Simulation:
         """
         return max(
             (
-                self.integralD[-1]
-                * (self.person.threshold - self.person.concentration[-1])
-                / (self.person.concentration[-1] + 1)
+                self.integralD.last
+                * (self.person.threshold - self.person.concentration.last)
+                / (self.person.concentration.last + 1)
             ),
             0,
         )
@@ -0,0 +1,242 @@
+from vou.person import Person
+from vou.simulation import Simulation
+
+from enum import Enum
+from inspect import signature
+from typing import Mapping
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+
+# Modules whose code determines the results of a simulation. The store's keys include
+# a hash of their source, so changing the model invalidates every stored result.
+MODEL_MODULES = (
+    "batch",
+    "constants",
+    "kernel",
+    "opioid",
+    "person",
+    "simulation",
+    "streams",
+    "summary",
+    "trace",
+    "utils",
+)
+
+DEFAULT_PATH = os.environ.get(
+    "VOU_RESULT_STORE",
+    os.path.join(os.path.expanduser("~"), ".cache", "vou", "results"),
+)
+
+# Default arguments of every Person and Simulation keyword argument
+DEFAULTS = {
+    name: parameter.default
+    for cls in (Person, Simulation)
+    for name, parameter in signature(cls).parameters.items()
+    if name not in ("person", "rng")
+}
+
+# Results are stored as compressed pickles, one file per key
+SUFFIX = ".pkl.z"
+
+# Files left by writers that were interrupted are removed after this many seconds
+STALE_SECONDS = 3_600
+
+
+def model_version():
+    """
+    A hash of the source code of the model's modules (MODEL_MODULES).
+    """
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in MODEL_MODULES:
+        with open(os.path.join(directory, f"{module}.py"), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+MODEL_VERSION = model_version()
+
+
+def _canonical(value):
+    # Converts arguments to JSON values with a single representation
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.random.SeedSequence):
+        return {"entropy": value.entropy, "spawn_key": list(value.spawn_key)}
+    if isinstance(value, type) or isinstance(value, np.dtype):
+        return np.dtype(value).str
+    raise TypeError(f"Cannot use {value!r} in a result store key")
+
+
+def canonical_params(params: Mapping):
+    """
+    Every Person and Simulation keyword argument of a run (other than person and rng),
+    with the ones params doesn't give at their defaults.
+    """
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+        raise TypeError(f"Unknown Person/Simulation arguments: {sorted(unknown)}")
+    return dict(DEFAULTS, **params)
+
+
+class ResultStore:
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = 2**30, level=6):
+        """
+        A persistent store of simulation results on disk, shared by every process that
+        uses the same path (e.g. the app's workers and batch jobs), so that a run that
+        has been simulated before is read from disk instead.
+
+        Results are addressed by key(): a hash of every Person and Simulation argument
+        of the run, its seed, the model version, and any other context that determines
+        the result (e.g. what was kept of the run). They are stored as pickles
+        compressed with zlib at level, one file per key.
+
+            store = ResultStore("results")
+            key = store.key(params, seed)
+            person = store.get(key)
+            if person is None:
+                ...
+                store.put(key, person)
+
+        Results are written to a temporary file that is then renamed, so concurrent
+        readers see either the whole result or none, and concurrent writers of a key
+        write the same result. Reading a result updates its modification time. When
+        the store grows beyond max_bytes, the least recently used results are evicted
+        down to 90% of max_bytes. Each process only counts its own writes between
+        evictions, so concurrent writers may exceed the cap until one of them evicts.
+
+        A store that can't be written to (e.g. on a read-only file system) doesn't fail
+        the caller: put() doesn't store anything, and get() returns the default.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.level = level
+        self.size = None
+
+    def key(self, params: Mapping, seed, **context):
+        """
+        The key of a run with params (a mapping of Person and Simulation keyword
+        arguments, see canonical_params()) and seed (e.g. the integer seed of a
+        random.Random, or a numpy SeedSequence). context are other JSON values that
+        determine the stored result.
+        """
+        settings = {
+            "params": canonical_params(params),
+            "seed": seed,
+            "version": MODEL_VERSION,
+            "context": context,
+        }
+        encoded = json.dumps(settings, sort_keys=True, default=_canonical).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def file(self, key: str):
+        return os.path.join(self.path, key[:2], key + SUFFIX)
+
+    def get(self, key: str, default=None):
+        """
+        The result stored at key, or default if there is none.
+        """
+        file = self.file(key)
+        try:
+            with open(file, "rb") as f:
+                data = f.read()
+        except OSError:
+            # Missing, or in a store that can't be read
+            return default
+        try:
+            value = pickle.loads(zlib.decompress(data))
+        except (zlib.error, pickle.UnpicklingError, EOFError):
+            return default
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+        return value
+
+    def __contains__(self, key: str):
+        return os.path.exists(self.file(key))
+
+    def put(self, key: str, value):
+        """
+        Stores value (any picklable object) at key, and evicts the least recently used
+        results if the store has grown beyond max_bytes.
+        """
+        data = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.level)
+        file = self.file(key)
+        try:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            handle, temporary = tempfile.mkstemp(
+                dir=os.path.dirname(file), suffix=".tmp"
+            )
+            try:
+                with os.fdopen(handle, "wb") as f:
+                    f.write(data)
+                os.replace(temporary, file)
+            except BaseException:
+                os.remove(temporary)
+                raise
+        except OSError:
+            return
+        if self.size is None:
+            self.evict()
+        else:
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def entries(self):
+        """
+        The (modification time, size, file) of every stored result. Removes temporary
+        files left by interrupted writers.
+        """
+        entries = []
+        now = time.time()
+        if not os.path.isdir(self.path):
+            return entries
+        for shard in os.scandir(self.path):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                    if entry.name.endswith(SUFFIX):
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    elif now - stat.st_mtime > STALE_SECONDS:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    # Evicted or renamed by another process
+                    pass
+        return entries
+
+    def evict(self):
+        """
+        Removes the least recently used results until the store is within max_bytes
+        (down to 90% of it if it had to evict anything), and returns its size.
+        """
+        entries = sorted(self.entries())
+        size = sum(entry[1] for entry in entries)
+        if size > self.max_bytes:
+            target = 0.9 * self.max_bytes
+            for _, entry_size, file in entries:
+                if size <= target:
+                    break
+                try:
+                    os.remove(file)
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+        self.size = size
+        return size
+
+    def __len__(self):
+        return len(self.entries())
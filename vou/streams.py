@@ -0,0 +1,115 @@
+from random import Random
+import math
+
+import numpy as np
+
+
+# The purposes for which the model draws random numbers, each of which gets its own
+# substream
+PURPOSES = (
+    "availability",
+    "downward_pressure",
+    "dose",
+    "counterfeit",
+    "overdose",
+    "fatality",
+)
+
+
+class Substream:
+    __slots__ = ("generator", "block", "antithetic", "buffer", "index")
+
+    def __init__(
+        self, seed: np.random.SeedSequence, block: int = 256, antithetic: bool = False
+    ):
+        """
+        A stream of random numbers backed by a NumPy Generator, which draws uniform
+        variates block values at a time. Provides the random.Random methods the model
+        uses, computed from uniform variates with the same formulas as random.Random.
+
+        If antithetic, every uniform variate u the generator draws is served as 1 - u,
+        so that the stream is the antithetic counterpart of the stream with the same
+        seed.
+        """
+        self.generator = np.random.Generator(np.random.PCG64(seed))
+        self.block = block
+        self.antithetic = antithetic
+        self.buffer = []
+        self.index = 0
+
+    def random(self):
+        index = self.index
+        if index == len(self.buffer):
+            block = self.generator.random(self.block)
+            if self.antithetic:
+                block = 1.0 - block
+            self.buffer = block.tolist()
+            index = 0
+        self.index = index + 1
+        return self.buffer[index]
+
+    def uniform(self, a: float, b: float):
+        return a + (b - a) * self.random()
+
+    def expovariate(self, lambd: float):
+        return -math.log(1.0 - self.random()) / lambd
+
+
+class RandomStreams:
+    __slots__ = PURPOSES
+
+    def __init__(self, seed=None, block: int = 256, antithetic: bool = False):
+        """
+        Independent random number streams for each purpose in PURPOSES (e.g. the daily
+        availability draw or overdose checks), spawned from a single seed. May be passed
+        as the rng of a Person and its Simulation in place of a random.Random.
+
+        With a single shared stream, adding or removing one draw (e.g. a new draw in
+        Simulation.compute_amount_taken()) shifts every later random number, so every
+        part of the trajectory changes. With one stream per purpose, the other purposes
+        keep drawing the same numbers, so scenarios can be compared with common random
+        numbers. With antithetic=True, every substream is antithetic (see Substream).
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        for i, purpose in enumerate(PURPOSES):
+            child = np.random.SeedSequence(
+                entropy=seed.entropy, spawn_key=seed.spawn_key + (i,)
+            )
+            setattr(self, purpose, Substream(child, block, antithetic))
+
+    @classmethod
+    def shared(cls, rng: Random):
+        """
+        Streams that all draw from rng, which reproduces the draws of a model using rng
+        directly.
+        """
+        return cls.from_streams({purpose: rng for purpose in PURPOSES})
+
+    @classmethod
+    def from_streams(cls, streams: dict):
+        instance = cls.__new__(cls)
+        for purpose in PURPOSES:
+            setattr(instance, purpose, streams[purpose])
+        return instance
+
+    def map(self, function):
+        """
+        Returns streams with function applied to each of these streams. Streams shared
+        by several purposes remain shared.
+        """
+        mapped = {}
+        for purpose in PURPOSES:
+            stream = getattr(self, purpose)
+            if id(stream) not in mapped:
+                mapped[id(stream)] = function(stream)
+        return RandomStreams.from_streams(
+            {purpose: mapped[id(getattr(self, purpose))] for purpose in PURPOSES}
+        )
+
+
+def as_streams(rng):
+    """
+    Returns rng if it is a RandomStreams, or streams that all draw from rng otherwise.
+    """
+    return rng if isinstance(rng, RandomStreams) else RandomStreams.shared(rng)
@@ -0,0 +1,115 @@
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+
+class Moments:
+    __slots__ = ("count", "mean", "m2", "max")
+
+    def __init__(self):
+        """
+        Accumulates the count, mean, variance, and maximum of a measure online, one
+        block of values at a time, without keeping the values. Blocks are combined with
+        the pairwise update of Chan et al. (1979), which is numerically stable.
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.max = None
+
+    def update(self, values: np.ndarray):
+        n = len(values)
+        if n == 0:
+            return
+        mean = values.mean(dtype=np.float64).item()
+        m2 = np.square(values - mean, dtype=np.float64).sum().item()
+        peak = values.max().item()
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.max = peak if self.max is None or peak > self.max else self.max
+
+    @property
+    def variance(self):
+        """
+        The population variance of the values seen so far.
+        """
+        return self.m2 / self.count if self.count else float("nan")
+
+    def __getstate__(self):
+        return self.count, self.mean, self.m2, self.max
+
+    def __setstate__(self, state):
+        self.count, self.mean, self.m2, self.max = state
+
+    def __repr__(self):
+        return (
+            f"Moments(count={self.count}, mean={self.mean}, "
+            f"variance={self.variance}, max={self.max})"
+        )
+
+
+class Summary(NamedTuple):
+    """
+    The outcomes of a simulation run with record="summary". Times are time points
+    (100 per day) and doses and amounts are in MME.
+    """
+
+    days: int
+    overdoses: tuple
+    fatal_overdose: Optional[int]
+    doses_taken: int
+    total_amount_taken: float
+    final_dose: float
+    peak_dose: float
+    dose_increases: int
+    days_unavailable: int
+    concentration: Moments
+    habit: Moments
+    effect: Moments
+    desperation: Moments
+
+
+# Outcomes of a run, computed from its Summary
+def overdoses(summary: Summary):
+    return len(summary.overdoses)
+
+
+def fatal_overdose(summary: Summary):
+    return float(summary.fatal_overdose is not None)
+
+
+def days_survived(summary: Summary):
+    """
+    Days until a fatal overdose, censored at the end of the simulation.
+    """
+    if summary.fatal_overdose is None:
+        return summary.days
+    return summary.fatal_overdose / 100
+
+
+def doses_taken(summary: Summary):
+    return summary.doses_taken
+
+
+def final_dose(summary: Summary):
+    return summary.final_dose
+
+
+def dose_increases(summary: Summary):
+    return summary.dose_increases
+
+
+OUTCOMES = {
+    "overdoses": overdoses,
+    "fatal_overdose": fatal_overdose,
+    "days_survived": days_survived,
+    "doses_taken": doses_taken,
+    "final_dose": final_dose,
+    "dose_increases": dose_increases,
+}
+
+# Outcomes that are 1 if an event occurred in a run and 0 otherwise
+BINARY_OUTCOMES = frozenset({"fatal_overdose"})
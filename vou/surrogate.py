@@ -0,0 +1,320 @@
+from vou.batch import iter_batch, keep_summary
+from vou.sensitivity import DEFAULT_RANGES, scale_point
+from vou.summary import OUTCOMES
+from vou.person import Person
+from vou.simulation import Simulation
+
+from inspect import signature
+from typing import Mapping, NamedTuple
+import json
+import math
+import os
+
+import numpy as np
+
+
+# The parameter ranges of the app's inputs, which the surrogate is trained over by
+# default
+APP_RANGES = {k: v for k, v in DEFAULT_RANGES.items() if k != "tolerance_window"}
+
+# Default values of the Person and Simulation keyword arguments
+DEFAULTS = {
+    name: parameter.default
+    for cls in (Person, Simulation)
+    for name, parameter in signature(cls).parameters.items()
+}
+
+
+class Prediction(NamedTuple):
+    """
+    A predicted outcome with its standard deviation. simulated is True if the query was
+    outside the trained domain and the prediction is the mean of simulations instead
+    (with its standard error).
+    """
+
+    mean: float
+    std: float
+    simulated: bool
+
+
+class Validation(NamedTuple):
+    """
+    The surrogate's error on held-out design points: the root mean square error, the
+    mean absolute error, and the share of held-out values within the 95% prediction
+    interval.
+    """
+
+    rmse: float
+    mae: float
+    coverage: float
+
+
+class GaussianProcess:
+    __slots__ = ("lengthscales", "noise", "x", "y_mean", "y_scale", "alpha", "inverse")
+
+    def __init__(self, lengthscales: np.ndarray = None, noise: float = None):
+        """
+        Gaussian process regression with a squared exponential kernel with a length
+        scale per input dimension and a noise variance, on standardized outputs. Unless
+        given, the length scales and noise are fitted by maximizing the marginal
+        likelihood with a coordinate search.
+        """
+        self.lengthscales = lengthscales
+        self.noise = noise
+
+    def kernel(self, a: np.ndarray, b: np.ndarray, lengthscales: np.ndarray):
+        distances = (a[:, None, :] - b[None, :, :]) / lengthscales
+        return np.exp(-0.5 * np.square(distances).sum(axis=2))
+
+    def factorize(self, x, lengthscales, noise):
+        covariance = self.kernel(x, x, lengthscales) + noise * np.eye(len(x))
+        return np.linalg.cholesky(covariance)
+
+    def log_likelihood(self, x, y, lengthscales, noise):
+        try:
+            factor = self.factorize(x, lengthscales, noise)
+        except np.linalg.LinAlgError:
+            return -math.inf
+        alpha = np.linalg.solve(factor.T, np.linalg.solve(factor, y))
+        return -0.5 * y @ alpha - np.log(np.diag(factor)).sum()
+
+    def fit(self, x: np.ndarray, y: np.ndarray, passes: int = 8):
+        self.x = x
+        self.y_mean = y.mean()
+        self.y_scale = y.std() or 1.0
+        y = (y - self.y_mean) / self.y_scale
+        if self.lengthscales is None:
+            lengthscales = np.full(x.shape[1], 0.5)
+            noise = 0.1
+            best = self.log_likelihood(x, y, lengthscales, noise)
+            for _ in range(passes):
+                improved = False
+                for d in range(x.shape[1] + 1):
+                    for factor in (0.5, 2.0):
+                        trial_scales = lengthscales.copy()
+                        trial_noise = noise
+                        if d < x.shape[1]:
+                            trial_scales[d] = min(trial_scales[d] * factor, 100.0)
+                        else:
+                            trial_noise = min(max(noise * factor, 1e-6), 10.0)
+                        value = self.log_likelihood(x, y, trial_scales, trial_noise)
+                        if value > best:
+                            best, lengthscales, noise = value, trial_scales, trial_noise
+                            improved = True
+                if not improved:
+                    break
+            self.lengthscales, self.noise = lengthscales, noise
+        self.solve(y)
+        return self
+
+    def solve(self, y: np.ndarray):
+        """
+        Precomputes the weights of the standardized outputs y and the inverse Cholesky
+        factor of the covariance, so that a prediction is only matrix products.
+        """
+        factor = self.factorize(self.x, self.lengthscales, self.noise)
+        self.inverse = np.linalg.inv(factor)
+        self.alpha = self.inverse.T @ (self.inverse @ y)
+
+    def predict(self, x: np.ndarray):
+        """
+        The predictive mean and standard deviation (including noise) at each row of x.
+        """
+        cross = self.kernel(x, self.x, self.lengthscales)
+        mean = cross @ self.alpha
+        v = self.inverse @ cross.T
+        variance = np.maximum(1 + self.noise - np.square(v).sum(axis=0), 0)
+        return (
+            mean * self.y_scale + self.y_mean,
+            np.sqrt(variance) * self.y_scale,
+        )
+
+
+class Surrogate:
+    def __init__(
+        self,
+        ranges: Mapping = APP_RANGES,
+        params: Mapping = None,
+        outcomes: Mapping = OUTCOMES,
+    ):
+        """
+        A fast emulator of the mean outcomes (functions of a run's Summary, see
+        vou.summary.OUTCOMES, e.g. the expected number of overdoses or the probability
+        of a fatal overdose) of a configuration, over the parameters in ranges (a
+        mapping of Person and Simulation keyword arguments to (low, high) bounds, by
+        default the app's inputs). Other arguments are fixed to params.
+
+            surrogate = Surrogate()
+            surrogate.train(points=300)
+            surrogate.validation["overdoses"]
+            surrogate.predict(dict(external_risk=0.8, starting_dose=100))
+
+        Each outcome is emulated by a Gaussian process on the mean outcome of a few
+        replications at each point of a random design. Predicting every outcome takes
+        about a millisecond. Queries outside the trained domain are simulated instead.
+        """
+        self.ranges = {name: tuple(bounds) for name, bounds in ranges.items()}
+        self.params = dict(params or {})
+        self.outcomes = dict(outcomes)
+        self.models = {}
+        self.validation = {}
+        self.seed = None
+
+    def train(
+        self,
+        points: int = 300,
+        replications: int = 4,
+        seed: int = 0,
+        holdout: float = 0.2,
+        workers: int = None,
+        chunksize: int = 1,
+    ):
+        """
+        Simulates replications runs at each of points random points of the domain with
+        vou.batch.iter_batch(), fits a Gaussian process per outcome on all but the
+        holdout share of the points, and stores the error on the held-out points in
+        validation. The processes are then refitted on all points with the same
+        hyperparameters.
+        """
+        self.seed = seed
+        rng = np.random.default_rng(np.random.SeedSequence(seed))
+        design = rng.random((points, len(self.ranges)))
+        tasks = (
+            scale_point(point, self.ranges, dict(self.params, record="summary"))
+            for point in design
+            for _ in range(replications)
+        )
+        values = np.array(
+            [
+                [outcome(summary) for outcome in self.outcomes.values()]
+                for summary in iter_batch(tasks, seed, workers, chunksize, keep_summary)
+            ],
+            dtype=float,
+        )
+        means = values.reshape(points, replications, -1).mean(axis=1)
+
+        test = rng.permutation(points)[: int(points * holdout)]
+        train = np.setdiff1d(np.arange(points), test)
+        for k, name in enumerate(self.outcomes):
+            model = GaussianProcess().fit(design[train], means[train, k])
+            if len(test):
+                mean, std = model.predict(design[test])
+                errors = mean - means[test, k]
+                self.validation[name] = Validation(
+                    rmse=float(np.sqrt(np.mean(errors**2))),
+                    mae=float(np.mean(np.abs(errors))),
+                    coverage=float(np.mean(np.abs(errors) <= 1.96 * std)),
+                )
+            self.models[name] = GaussianProcess(model.lengthscales, model.noise).fit(
+                design, means[:, k]
+            )
+        return self.validation
+
+    def point(self, query: Mapping):
+        """
+        The query's point in the unit cube, or None if it is outside the trained domain:
+        a parameter outside its range, or a fixed parameter with another value than in
+        params (or its default).
+        """
+        point = []
+        for name, (low, high) in self.ranges.items():
+            value = query.get(name, self.params.get(name, DEFAULTS[name]))
+            if not low <= value <= high:
+                return None
+            point.append((value - low) / (high - low))
+        for name, value in query.items():
+            fixed = self.params.get(name, DEFAULTS.get(name))
+            if name not in self.ranges and fixed != value:
+                return None
+        return np.array([point])
+
+    def predict(
+        self,
+        query: Mapping,
+        replications: int = 20,
+        seed: int = 0,
+        workers: int = 1,
+    ) -> dict:
+        """
+        Predicts each outcome for a configuration. Parameters that query doesn't give
+        are at their values in params or their defaults.
+
+        Outside the trained domain, the configuration is simulated replications times
+        instead, and the predictions are the mean outcomes with their standard errors.
+        """
+        point = self.point(query)
+        if point is not None:
+            predictions = {}
+            for name, model in self.models.items():
+                mean, std = model.predict(point)
+                predictions[name] = Prediction(float(mean[0]), float(std[0]), False)
+            return predictions
+
+        task = dict(self.params, **query, record="summary")
+        values = np.array(
+            [
+                [outcome(summary) for outcome in self.outcomes.values()]
+                for summary in iter_batch(
+                    [task] * replications, seed, workers, collect=keep_summary
+                )
+            ],
+            dtype=float,
+        )
+        error = values.std(axis=0, ddof=1) / math.sqrt(replications)
+        return {
+            name: Prediction(float(values[:, k].mean()), float(error[k]), True)
+            for k, name in enumerate(self.outcomes)
+        }
+
+    def save(self, path: str):
+        """
+        Saves the trained surrogate to the directory path. Outcomes are saved by name,
+        so a loaded surrogate must be given the same outcomes.
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {}
+        for name, model in self.models.items():
+            arrays[f"{name}.x"] = model.x
+            arrays[f"{name}.alpha"] = model.alpha
+            arrays[f"{name}.lengthscales"] = model.lengthscales
+        np.savez(os.path.join(path, "models.npz"), **arrays)
+        meta = {
+            "ranges": self.ranges,
+            "params": self.params,
+            "outcomes": list(self.outcomes),
+            "seed": self.seed,
+            "models": {
+                name: {
+                    "noise": model.noise,
+                    "y_mean": model.y_mean,
+                    "y_scale": model.y_scale,
+                }
+                for name, model in self.models.items()
+            },
+            "validation": {k: v._asdict() for k, v in self.validation.items()},
+        }
+        with open(os.path.join(path, "surrogate.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str, outcomes: Mapping = OUTCOMES):
+        with open(os.path.join(path, "surrogate.json")) as f:
+            meta = json.load(f)
+        outcomes = {name: outcomes[name] for name in meta["outcomes"]}
+        surrogate = cls(meta["ranges"], meta["params"], outcomes)
+        surrogate.seed = meta["seed"]
+        surrogate.validation = {
+            k: Validation(**v) for k, v in meta["validation"].items()
+        }
+        arrays = np.load(os.path.join(path, "models.npz"))
+        for name, fitted in meta["models"].items():
+            model = GaussianProcess(arrays[f"{name}.lengthscales"], fitted["noise"])
+            model.x = arrays[f"{name}.x"]
+            model.y_mean = fitted["y_mean"]
+            model.y_scale = fitted["y_scale"]
+            model.alpha = arrays[f"{name}.alpha"]
+            model.inverse = np.linalg.inv(
+                model.factorize(model.x, model.lengthscales, model.noise)
+            )
+            surrogate.models[name] = model
+        return surrogate
@@ -0,0 +1,169 @@
+import numpy as np
+
+
+class Trace:
+    def __init__(self, capacity: int = 0, dtype=np.float64):
+        """
+        Stores a measure recorded once per time step (e.g. concentration) in a
+        preallocated, typed NumPy array instead of a list of Python floats.
+
+        A Trace behaves like the list it replaces: values are added with append(), and
+        it supports len(), iteration, and indexing and slicing with negative indices.
+        Slices return NumPy views of the recorded values rather than copies.
+
+        Storage grows geometrically if more values are appended than the capacity
+        allows, but simulations size their traces up front so they never reallocate.
+
+        The two most recent values are also kept at full precision as the last and
+        previous attributes, which are cheaper to read than trace[-1] and trace[-2].
+        While simulating, the model only looks at those and at the maximum of the habit
+        trace (see Person.lower_dose_after_pause()), so storing every other trace as
+        float32 doesn't change simulation results. Simulations keep habit in float64.
+
+        Recorded values can be dropped with discard() to keep memory constant while
+        streaming a simulation. discarded counts the values dropped so far, so values[i]
+        is the value recorded at position discarded + i.
+        """
+        self.buffer = np.empty(capacity, dtype=dtype)
+        self.size = 0
+        self.last = None
+        self.previous = None
+        self.discarded = 0
+        self.discarded_max = None
+
+    @property
+    def dtype(self):
+        return self.buffer.dtype
+
+    @property
+    def values(self):
+        """
+        A view of the recorded values.
+        """
+        return self.buffer[: self.size]
+
+    def append(self, value: float):
+        size = self.size
+        try:
+            self.buffer[size] = value
+        except IndexError:
+            self.reserve(max(2 * size, 1_000))
+            self.buffer[size] = value
+        self.size = size + 1
+        self.previous = self.last
+        self.last = value
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=float)
+        n = len(values)
+        if n == 0:
+            return
+        if self.size + n > len(self.buffer):
+            self.reserve(max(2 * self.size, self.size + n))
+        self.buffer[self.size : self.size + n] = values
+        self.size += n
+        self.previous = self.last if n == 1 else values.item(-2)
+        self.last = values.item(-1)
+
+    def reserve(self, capacity: int, dtype=None):
+        """
+        Reallocates storage to hold at least capacity values, optionally converting
+        it to a new dtype. Recorded values are preserved.
+        """
+        dtype = self.buffer.dtype if dtype is None else dtype
+        if capacity <= len(self.buffer) and dtype == self.buffer.dtype:
+            return
+        buffer = np.empty(max(capacity, self.size), dtype=dtype)
+        buffer[: self.size] = self.values
+        self.buffer = buffer
+
+    def trim(self):
+        """
+        Releases storage beyond the recorded values, e.g. after a simulation ended
+        early due to a fatal overdose.
+        """
+        self.buffer = self.values.copy()
+
+    def discard(self):
+        """
+        Drops the recorded values other than the two most recent, which are moved to
+        the front of the buffer so that its storage can be reused. The model only
+        reads the two most recent values of a trace while simulating.
+        """
+        n = self.size - 2
+        if n <= 0:
+            return
+        dropped = self.buffer[:n].max()
+        if self.discarded_max is None or dropped > self.discarded_max:
+            self.discarded_max = dropped.item()
+        self.buffer[:2] = self.buffer[n : self.size]
+        self.size = 2
+        self.discarded += n
+
+    def max(self):
+        """
+        The maximum value recorded, including values that have been discarded.
+        """
+        if not self.size:
+            if self.discarded_max is None:
+                raise ValueError("max() of an empty trace")
+            return self.discarded_max
+        value = self.values.max().item()
+        if self.discarded_max is not None and self.discarded_max > value:
+            return self.discarded_max
+        return value
+
+    def tolist(self):
+        return self.values.tolist()
+
+    def _index(self, index: int):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("trace index out of range")
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            index = self._index(index)
+            if index == self.size - 1:
+                return self.last
+            if index == self.size - 2:
+                return self.previous
+            return self.buffer.item(index)
+        return self.values[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, (int, np.integer)):
+            index = self._index(index)
+            self.buffer[index] = value
+            if index == self.size - 1:
+                self.last = value
+            elif index == self.size - 2:
+                self.previous = value
+        else:
+            self.values[index] = value
+            if self.size:
+                self.last = self.buffer.item(self.size - 1)
+            if self.size > 1:
+                self.previous = self.buffer.item(self.size - 2)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return np.array(self.values, dtype=dtype)
+        return np.asarray(self.values, dtype=dtype)
+
+    def __getstate__(self):
+        # Don't pickle unused capacity
+        state = self.__dict__.copy()
+        state["buffer"] = self.values
+        return state
+
+    def __repr__(self):
+        return f"Trace({self.values!r})"
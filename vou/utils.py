@@ -1,3 +1,6 @@
+from functools import lru_cache
+import math
+
 import numpy as np
 
 
@@ -8,6 +11,59 @@ def logistic(x, L, k, x0):
     L is the curve's maximum value
     k is the logistic growth rate or steepness of the curve
     x0 is the x value at the sigmoid's midpoint
+
+    Works on scalars and NumPy arrays. Scalars are computed with math.exp, which is
+    much cheaper than np.exp for a single value. Where the exponential overflows, the
+    function is 0.
     """
-    y = L / (1 + np.exp(-k * (x - x0)))
+    z = -k * (x - x0)
+    if isinstance(z, float):
+        try:
+            return L / (1 + math.exp(z))
+        except OverflowError:
+            return 0.0
+    with np.errstate(over="ignore"):
+        y = L / (1 + np.exp(z))
     return y
+
+
+@lru_cache(maxsize=4_096)
+def exponential_decay(k: float, n: int):
+    """
+    Returns a read-only array of exp(-k * t) for t in 0..n-1, computed with math.exp
+    so that values match scalar computations exactly. Arrays are cached by k and n
+    (which simulations set from their number of days) in a bounded cache shared by
+    every simulation in the process.
+    """
+    decay = np.array([math.exp(-k * t) for t in range(n)])
+    decay.flags.writeable = False
+    return decay
+
+
+@lru_cache(maxsize=4_096)
+def habit_parameters(
+    dose: float,
+    L1: float = 1.0275,
+    L2: float = 0.58,
+    K1: float = 0.2,
+    K2: float = 0.0002,
+    X1: float = 0.175,
+):
+    """
+    Returns the parameters L, k, and x0 of the logistic function of habit for a dose
+    (see Simulation.compute_habit()). They only change when dose changes, and doses
+    mostly move along the same ladder of dose increases, so they are cached by dose,
+    in a bounded cache shared by every simulation in the process.
+    """
+    return (dose ** L1) * L2, K1 - (dose * K2), dose * X1
+
+
+def linear_recurrence(alpha: float, x0: float, u: np.ndarray):
+    """
+    Solves x[i] = alpha * x[i - 1] + u[i] for every i in u, given the value x0 that
+    precedes u[0], without looping in Python. Used to advance the concentration
+    integrals through blocks of time steps. Blocks should be kept short (e.g. one day)
+    since the closed form divides by powers of alpha.
+    """
+    powers = alpha ** np.arange(1, len(u) + 1)
+    return powers * (x0 + np.cumsum(u / powers))
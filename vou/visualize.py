@@ -1,8 +1,10 @@
 from vou.person import Person
 from vou.opioid import mme_equivalents
+from vou.pyramid import TraceIndex
 
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
+import numpy as np
 
 
 def make_ibm_color_palette():
@@ -13,6 +15,39 @@ def make_ibm_color_palette():
     return ["#648FFF", "#DC267F", "#FE6100", "#FFB000"]
 
 
+def downsample(values, buckets: int):
+    """
+    Reduces a series to at most 2 * buckets points by keeping the minimum and maximum
+    of each of buckets equal-width buckets, in time order. Every peak and trough
+    survives, so a line drawn through the result looks the same as one drawn through
+    every point (e.g. overdose spikes are never lost) when there is about one bucket
+    per pixel.
+
+    Returns the indices of the kept points and their values. values is only read
+    through views, so no copy of the full series is made. A series of at most
+    2 * buckets points is returned as is, with the indices of all its points.
+    """
+    values = np.asarray(values)
+    n = len(values)
+    if n <= 2 * buckets:
+        return np.arange(n), values
+    width = -(-n // buckets)
+    full = (n // width) * width
+    blocks = values[:full].reshape(-1, width)
+    offsets = np.arange(0, full, width)[:, None]
+    indices = [
+        np.sort(
+            np.stack((blocks.argmin(axis=1), blocks.argmax(axis=1)), axis=1), axis=1
+        )
+        + offsets
+    ]
+    if full < n:
+        tail = values[full:]
+        indices.append(np.sort([tail.argmin(), tail.argmax()]) + full)
+    indices = np.concatenate([i.ravel() for i in indices])
+    return indices, values[indices]
+
+
 def visualize(
     person: Person,
     start_day: int = 0,
@@ -21,6 +56,9 @@ def visualize(
     show_habit: bool = True,
     show_effect: bool = True,
     opioid: str = "Hydrocodone",
+    dpi: int = 300,
+    index: TraceIndex = None,
+    complete: bool = True,
 ):
     """
     Generates a plot of the person's opioid concentration, habit, effect,
@@ -29,6 +67,19 @@ def visualize(
     matplotlib figure.
 
     Start day and duration parameters allow control over time frame shown.
+
+    Each series is downsampled to about one min/max pair per pixel of the plot's
+    width at the given dpi (see downsample()), so plotting takes about as long for a
+    long simulation as for a short one. dpi should match the resolution the figure is
+    saved at.
+
+    index may be a TraceIndex of the person's traces, which answers the same
+    downsampling in time proportional to the plot's width rather than to duration.
+    Build it once to plot several windows (e.g. zoomed plots) of the same person.
+
+    With complete=False, the person's simulation is still in progress (see
+    vou.progressive), so the traces are plotted as far as they go rather than as zero
+    after their end.
     """
     dose_multiplier = mme_equivalents[opioid]
 
@@ -38,44 +89,56 @@ def visualize(
     end_time = start_time + duration_time
 
     fig, ax1 = plt.subplots(figsize=(16, 8))
+    buckets = int(ax1.get_position().width * fig.get_figwidth() * dpi)
+
+    def series(name):
+        # Time points and scaled values to plot for a trace. Time points after the
+        # end of the simulation (e.g. after a fatal overdose) are plotted as zero.
+        trace = getattr(person, name)
+        if index is None:
+            values = np.asarray(trace)
+            times, values = downsample(values[start_time:end_time], buckets)
+            times = times + start_time
+        else:
+            times, values = index[name].query(start_time, end_time, buckets).points()
+        values = values / dose_multiplier
+        end_of_trace = max(start_time, len(trace))
+        if complete and end_of_trace < end_time:
+            times = np.concatenate((times, [end_of_trace, end_time - 1]))
+            values = np.concatenate((values, [0, 0]))
+        return times, values
 
     ax1.plot(
-        range(start_time, end_time),
-        [c / dose_multiplier for c in person.concentration[start_time:end_time]]
-        + [0] * max(0, (end_time - start_time) - len(person.concentration)),
+        *series("concentration"),
         label="Concentration",
         color=palette[0],
         zorder=0,
     )
     if show_habit:
         ax1.plot(
-            range(start_time, end_time),
-            [h / dose_multiplier for h in person.habit[start_time:end_time]]
-            + [0] * max(0, (end_time - start_time) - len(person.habit)),
-            label="Tolerance",
-            color=palette[1],
-            zorder=2,
+            *series("habit"), label="Tolerance", color=palette[1], zorder=2,
         )
     if show_effect:
         ax1.plot(
-            range(start_time, end_time),
-            [e / dose_multiplier for e in person.effect[start_time:end_time]]
-            + [0] * max(0, (end_time - start_time) - len(person.effect)),
-            label="Effect",
-            color=palette[2],
-            zorder=1,
+            *series("effect"), label="Effect", color=palette[2], zorder=1,
         )
     if len(person.concentration) < end_time:
         ax1.set_xlim(right=end_time)
 
     ax1.set_ylabel(f"Milligrams of {opioid}")
 
+    overdoses = np.asarray(person.overdoses)
+    overdoses = overdoses[(start_time <= overdoses) & (overdoses < end_time)]
+    if index is None:
+        max_concentration = np.asarray(person.concentration).max()
+    else:
+        max_concentration = index["concentration"].max()
+    max_concentration /= dose_multiplier
+
     if show_desperation:
         ax2 = ax1.twinx()
         ax2.plot(
-            range(start_time, end_time),
-            [d / dose_multiplier for d in person.desperation[start_time:end_time]]
-            + [0] * max(0, (end_time - start_time) - len(person.desperation)),
+            *series("desperation"),
             label="Desperation",
             color=palette[3],
             zorder=3,
@@ -84,9 +147,9 @@ def visualize(
         ax2.set_ylabel("Desperation (Arbitrary Units)")
 
         ax2.vlines(
-            x=[od for od in person.overdoses if start_time <= od < end_time],
+            x=overdoses,
             ymin=0,
-            ymax=max(person.concentration) / dose_multiplier,
+            ymax=max_concentration,
             colors="black",
             linestyles="dotted",
             label="OD",
@@ -101,9 +164,9 @@ def visualize(
 
     else:
         ax1.vlines(
-            x=[od for od in person.overdoses if start_time <= od < end_time],
+            x=overdoses,
             ymin=0,
-            ymax=max(person.concentration) / dose_multiplier,
+            ymax=max_concentration,
             colors="black",
             linestyles="dotted",
             label="OD",